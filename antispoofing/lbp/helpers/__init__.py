@@ -1,3 +1,13 @@
 from .database import *
 from .score_manipulate import *
+from .video import *
+from .parallel import *
+from .sharding import *
+from .manifest import *
+from .splitindex import *
+from .featurestore import *
+from .chunked import *
 
+from .kernelcache import *
+from .decimate import *
+from .crossval import *
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to process large datasets (for example, memory-mapped feature stores) in chunks of rows, so that no full copy of them is ever made
+"""
+
+import numpy
+import multiprocessing
+
+# the default size of a chunk of rows, in bytes
+CHUNK_BYTES = 1 << 27
+
+# the function and the data processed by the pool of apply_chunked. The workers are forked and inherit them, so that they do not need to be pickled
+_task = None
+
+def chunk_size(data, budget=CHUNK_BYTES):
+  """Returns the number of rows of the data which fit in the given number of bytes (at least 1)"""
+  rowbytes = data.dtype.itemsize * int(numpy.prod(data.shape[1:]))
+  return max(1, budget // max(1, rowbytes))
+
+
+def iter_chunks(data, budget=CHUNK_BYTES):
+  """Yields the consecutive chunks of rows of the data, as views"""
+  size = chunk_size(data, budget)
+  for start in range(0, data.shape[0], size):
+    yield data[start:start + size]
+
+
+def _apply_chunk(start):
+  """Applies the function of the pool to the chunk of rows starting at the given row, in a worker"""
+  func, data, size = _task
+  return numpy.asarray(func(data[start:start + size]))
+
+
+def _gather(results, length):
+  """Concatenates the results of the consecutive chunks into an output of the given number of rows, allocated after the first chunk"""
+  output = None
+  row = 0
+  for result in results:
+    if output is None:
+      output = numpy.ndarray((length,) + result.shape[1:], result.dtype)
+    output[row:row + len(result)] = result
+    row += len(result)
+  return output
+
+
+def apply_chunked(func, data, budget=CHUNK_BYTES, jobs=1):
+  """Applies a function to consecutive chunks of rows of the data and returns the concatenated results. The output is allocated once, after the first chunk, and only one chunk of the input is in the memory at a time
+
+  Keyword parameters:
+
+  func: function taking a 2D array of rows and returning a result with one row (or one element) per input row
+
+  data: the 2D data
+
+  budget: the size of a chunk of the input, in bytes
+
+  jobs: the number of processes. If larger than 1, the chunks are distributed over a pool of forked processes, which inherit the function and the data, so that only the results are sent back. The results are gathered in the order of the chunks, and the chunks do not depend on the number of processes, so the output is identical to the one of a single process
+  """
+  global _task
+  size = chunk_size(data, budget)
+  if jobs <= 1 or data.shape[0] <= size:
+    output = _gather((numpy.asarray(func(chunk)) for chunk in iter_chunks(data, budget)), data.shape[0])
+  else:
+    _task = (func, data, size)
+    pool = multiprocessing.Pool(jobs)
+    try:
+      output = _gather(pool.imap(_apply_chunk, range(0, data.shape[0], size)), data.shape[0])
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+      _task = None
+  if output is None: # no rows at all
+    return numpy.asarray(func(data))
+  return output
+
+
+def min_max(datasets, budget=CHUNK_BYTES):
+  """Calculates the minimum and the maximum of each feature over all the rows of several datasets, in chunks. Equivalent to calc_min_max on their concatenation"""
+  mins = None; maxs = None
+  for data in datasets:
+    for chunk in iter_chunks(data, budget):
+      if mins is None:
+        mins = chunk.min(axis=0); maxs = chunk.max(axis=0)
+      else:
+        numpy.minimum(mins, chunk.min(axis=0), mins); numpy.maximum(maxs, chunk.max(axis=0), maxs)
+  return mins, maxs
+
+
+def mean_std(datasets, nonStdZero=False, budget=CHUNK_BYTES):
+  """Calculates the mean and the (population) standard deviation of each feature over all the rows of several datasets, in chunks. Equivalent to calc_mean_std on their concatenation. The statistics of the chunks are merged with the pairwise update of Chan et al., which is numerically stable
+
+  Keyword parameters:
+
+  datasets: the list of 2D datasets
+
+  nonStdZero: if True, the standard deviations equal to 0 are set to 1, so that the data can be divided by them
+
+  budget: the size of a chunk, in bytes
+  """
+  count = 0; mean = None; m2 = None
+  for data in datasets:
+    for chunk in iter_chunks(data, budget):
+      n = chunk.shape[0]
+      cmean = chunk.mean(axis=0)
+      cm2 = ((chunk - cmean) ** 2).sum(axis=0)
+      if mean is None:
+        count = n; mean = cmean; m2 = cm2
+        continue
+      delta = cmean - mean
+      total = count + n
+      mean = mean + delta * (float(n) / total)
+      m2 = m2 + cm2 + delta ** 2 * (float(count) * n / total)
+      count = total
+  std = numpy.sqrt(m2 / count)
+  if nonStdZero:
+    std[std == 0] = 1
+  return mean, std
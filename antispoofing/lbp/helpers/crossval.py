@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to split the frames of a training set into folds for cross-validation. All the frames of a video, and of all the videos of a group (for example, of a client), are in the same fold, as the frames of the same video or client are too similar to train and validate the same machine
+"""
+
+import re
+import numpy
+
+def video_groups(paths, groupby=None):
+  """Returns the group of each video. The groups are given by a regular expression, searched in the path of each video: the videos with the same match (or the same first group of the expression, if it has one) are in the same group. Raises ValueError if a path does not match
+
+  Keyword parameters:
+
+  paths: the paths of the videos
+
+  groupby: the regular expression of the groups, or None to have each video in its own group
+  """
+  if groupby is None:
+    return list(paths)
+  expression = re.compile(groupby)
+  groups = []
+  for path in paths:
+    match = expression.search(path)
+    if match is None:
+      raise ValueError("the path %s does not match the expression of the groups" % path)
+    groups.append(match.group(1) if expression.groups else match.group(0))
+  return groups
+
+
+def assign_folds(groups, folds, seed=0):
+  """Assigns the groups to the folds. The groups are shuffled and dealt to the folds one after another, so that each fold has the same number of groups (up to one). Returns the dictionary with the fold of each group. Raises ValueError if there are fewer groups than folds
+
+  Keyword parameters:
+
+  groups: the groups (with repetitions)
+
+  folds: the number of folds
+
+  seed: the seed of the shuffling
+  """
+  unique = sorted(set(groups))
+  if len(unique) < folds:
+    raise ValueError("%d groups of videos can not be split into %d folds" % (len(unique), folds))
+  order = numpy.random.RandomState(seed).permutation(len(unique))
+  return dict((unique[k], rank % folds) for rank, k in enumerate(order))
+
+
+def row_folds(index, rows, groups, fold_of):
+  """Returns the fold of each row of the training data of a class
+
+  Keyword parameters:
+
+  index: the index of the frames of the videos of the class (see SplitIndex)
+
+  rows: the rows of the index which are in the training data (for example, the ones kept by the decimation)
+
+  groups: the group of each video of the index, as returned by video_groups
+
+  fold_of: the fold of each group, as returned by assign_folds
+  """
+  video_folds = numpy.array([fold_of[g] for g in groups], 'int64')
+  return video_folds[index.row_object[rows]]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to decimate the frames of a training set before training a classifier. The frames of a video are often nearly identical, so keeping only some of them bounds the training time at a small cost in accuracy
+"""
+
+import numpy
+
+from .splitindex import SplitIndex
+from .score_manipulate import valid_frames
+
+def frame_index(indir, objects, store=None):
+  """Returns the index (see SplitIndex) of the valid frames of the objects, which maps the rows of the matrix returned by create_full_dataset to the videos and the frames they come from
+
+  Keyword parameters:
+
+  indir: the directory with the feature files of the objects
+
+  objects: the objects
+
+  store: the name of the feature store of the objects, if any
+  """
+  valid = valid_frames(indir, objects, store)
+  offsets = numpy.zeros((len(objects) + 1,), 'int64')
+  offsets[1:] = numpy.cumsum([len(v) for v in valid])
+  valid = numpy.concatenate(valid) if valid else numpy.zeros((0,), 'bool')
+  return SplitIndex([obj.make_path() for obj in objects], valid, offsets)
+
+
+def _spread(n, m):
+  """Returns m indices evenly spread in range(n), or all of them if m >= n"""
+  if m >= n:
+    return numpy.arange(n)
+  return numpy.linspace(0, n - 1, m).round().astype('int64')
+
+
+def cap_rows(data, index, amount, rng):
+  """Keeps at most amount frames of each video, evenly spread in time"""
+  rows = [start + _spread(end - start, amount) for (start, end) in zip(index.row_offsets[:-1], index.row_offsets[1:])]
+  return numpy.concatenate(rows) if rows else numpy.zeros((0,), 'int64')
+
+
+def stride_rows(data, index, amount, rng):
+  """Keeps one frame out of amount of each video (the frames whose number is a multiple of amount)"""
+  return numpy.flatnonzero(index.row_frame % amount == 0)
+
+
+def _sqdist(data, centers):
+  """Returns the squared euclidean distances between each sample of the data and each center"""
+  dist = numpy.dot(data, centers.T)
+  dist *= -2
+  dist += (data ** 2).sum(axis=1).reshape(-1, 1)
+  dist += (centers ** 2).sum(axis=1).reshape(1, -1)
+  return dist
+
+
+def kmeans_rows(data, index, amount, rng, iterations=10):
+  """Keeps amount representative frames of each video: the frames of the video are clustered into amount clusters by k-means, and the frame the closest to the center of each cluster is kept"""
+  rows = []
+  for start, end in zip(index.row_offsets[:-1], index.row_offsets[1:]):
+    if end - start <= amount:
+      rows.append(numpy.arange(start, end))
+      continue
+    feat = numpy.asarray(data[start:end], 'float64')
+    centers = feat[numpy.sort(rng.permutation(len(feat))[:amount])]
+    for i in range(iterations):
+      onehot = (_sqdist(feat, centers).argmin(axis=1).reshape(-1, 1) == numpy.arange(amount)).astype('float64')
+      counts = onehot.sum(axis=0)
+      filled = counts > 0 # the empty clusters keep their center
+      centers[filled] = numpy.dot(onehot.T, feat)[filled] / counts[filled].reshape(-1, 1)
+    rows.append(start + numpy.unique(_sqdist(feat, centers).argmin(axis=0)))
+  return numpy.concatenate(rows) if rows else numpy.zeros((0,), 'int64')
+
+
+# the decimation strategies, as functions func(data, index, amount, rng) returning the sorted rows of the data which are kept
+DECIMATIONS = {'cap': cap_rows, 'stride': stride_rows, 'kmeans': kmeans_rows}
+
+def decimate_rows(datasets, indices, strategy=None, amount=None, balance=False, seed=0):
+  """Selects the frames of the classes of a training set which are kept. Returns the list of the sorted rows of each class which are kept
+
+  Keyword parameters:
+
+  datasets: the list of the 2D datasets of the classes, as returned by create_full_dataset
+
+  indices: the list of the indices of the frames of the classes (see frame_index)
+
+  strategy: the name of the decimation strategy (one of DECIMATIONS), or None to keep all the frames
+
+  amount: the parameter of the strategy (the number of frames per video for cap and kmeans, the stride for stride)
+
+  balance: if True, the classes are then balanced: the same number of frames, evenly spread over the kept ones, is kept for each class
+
+  seed: the seed of the random numbers of the strategy
+  """
+  rng = numpy.random.RandomState(seed)
+  rows = []
+  for data, index in zip(datasets, indices):
+    if strategy is None:
+      rows.append(numpy.arange(len(data)))
+    else:
+      rows.append(DECIMATIONS[strategy](data, index, amount, rng))
+  if balance:
+    size = min(len(r) for r in rows)
+    rows = [r[_spread(len(r), size)] for r in rows]
+  return rows
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to consolidate the features of all the videos of a split of a database into a single file (a feature store), so that they can be loaded with a few large reads instead of opening one small file per video
+"""
+
+import os, sys
+import numpy
+import bob.io.base
+
+from .splitindex import SplitIndex
+
+# the splits of the database which are consolidated into stores
+SPLITS = ('train_real', 'train_attack', 'devel_real', 'devel_attack', 'test_real', 'test_attack')
+
+def store_filename(storedir, split):
+  """Returns the name of the store of a split in the given directory, or None if no directory is given"""
+  if storedir is None:
+    return None
+  return os.path.join(storedir, split + '.hdf5')
+
+
+def load_features(indir, objects, counts=None):
+  """Loads the features of the objects into a single matrix. The shapes of the files are read first (unless the numbers of rows are given), so that the matrix is allocated only once, and the files are then read one after another, each of them into its own rows. They are not read concurrently, as the HDF5 library is in general not thread-safe. Returns the tuple (features, offsets), where offsets has the index of the first row of each object and the total number of rows as the last element
+
+  Keyword parameters:
+
+  indir: the directory with the feature files of the objects
+
+  objects: the objects
+
+  counts: the number of rows of each object, if known (for example, from a SplitIndex)
+  """
+  filenames = [os.path.expanduser(obj.make_path(indir, '.hdf5')) for obj in objects]
+  if counts is None:
+    counts = [bob.io.base.peek_all(f)[1][0] for f in filenames]
+  offsets = numpy.zeros((len(objects) + 1,), 'int64')
+  offsets[1:] = numpy.cumsum(counts)
+  length = bob.io.base.peek_all(filenames[0])[1][1] if filenames else 0
+  features = numpy.ndarray((offsets[-1], length), 'float64')
+
+  for k, f in enumerate(filenames):
+    features[offsets[k]:offsets[k+1]] = bob.io.base.load(f)
+  return features, offsets
+
+
+def memmap_filename(filename):
+  """Returns the name of the file with the memory-mapped features of a store"""
+  return os.path.splitext(filename)[0] + '.npy'
+
+
+def file_dates(indir, objects):
+  """Returns the modification time of the feature file of each object, or NaN for the objects which have none"""
+  dates = numpy.ndarray((len(objects),), 'float64')
+  for k, obj in enumerate(objects):
+    filename = os.path.expanduser(obj.make_path(indir, '.hdf5'))
+    dates[k] = os.path.getmtime(filename) if os.path.exists(filename) else numpy.NaN
+  return dates
+
+
+def write_store(filename, indir, objects, memmap=False, features=True):
+  """Writes the features of the objects into a store. The store contains the index of the frames of the objects (see SplitIndex), the features of all their frames one after another ('features') and the modification time of the feature file of each object when the store was written ('dates', see fresh_store). The features are read one object at a time into a memory-mapped file, so that they never need to fit in the memory at once
+
+  Keyword parameters:
+
+  filename: the name of the store
+
+  indir: the directory with the feature files of the objects
+
+  objects: the objects of the split
+
+  memmap: if True, the features of the valid frames only are written into a separate contiguous .npy file (see memmap_filename), which can be memory-mapped by map_store
+
+  features: if False, only the index is written. It is built from the validframes files, without reading the features
+  """
+  dates = file_dates(indir, objects) # taken before the files are read, so that a file modified while the store is written makes it stale
+  if not memmap and os.path.exists(memmap_filename(filename)): # the memory-mapped features of a previous store are stale
+    os.remove(memmap_filename(filename))
+
+  bob.io.base.create_directories_safe(os.path.dirname(filename))
+  store = bob.io.base.HDF5File(filename, 'w')
+  if memmap and features:
+    index = SplitIndex.build(indir, objects) # the valid frames are needed first to know the size of the file
+    length = bob.io.base.peek_all(os.path.expanduser(objects[0].make_path(indir, '.hdf5')))[1][1] if objects else 0
+    data = numpy.lib.format.open_memmap(memmap_filename(filename), 'w+', 'float64', (len(index.row_object), length))
+    for obj in objects:
+      start, end = index.rows(obj.make_path())
+      data[start:end] = bob.io.base.load(os.path.expanduser(obj.make_path(indir, '.hdf5')))[index.valid_frames(obj.make_path())]
+    data.flush()
+    del data
+  elif features: # the features are gathered in a memory-mapped file next to the store, allocated once from the sizes of the files, and written into the store at once
+    filenames = [os.path.expanduser(obj.make_path(indir, '.hdf5')) for obj in objects]
+    offsets = numpy.zeros((len(objects) + 1,), 'int64')
+    offsets[1:] = numpy.cumsum([bob.io.base.peek_all(f)[1][0] for f in filenames])
+    valid = numpy.zeros((offsets[-1],), 'bool')
+    if offsets[-1] > 0:
+      length = bob.io.base.peek_all(filenames[0])[1][1]
+      data = numpy.lib.format.open_memmap(filename + '.tmp.npy', 'w+', 'float64', (offsets[-1], length))
+      try:
+        for k, f in enumerate(filenames):
+          data[offsets[k]:offsets[k+1]] = bob.io.base.load(f)
+          valid[offsets[k]:offsets[k+1]] = ~numpy.isnan(data[offsets[k]:offsets[k+1]]).any(axis=1)
+        data.flush()
+        store.set('features', data)
+      finally:
+        del data
+        os.remove(filename + '.tmp.npy')
+    index = SplitIndex([obj.make_path() for obj in objects], valid, offsets)
+  else:
+    index = SplitIndex.build(indir, objects)
+  index.save(store)
+  store.set('dates', dates)
+  del store
+
+
+def fresh_store(filename, indir, objects):
+  """Returns True if none of the feature files of the objects was modified after the store was written. Otherwise, or if the store has no dates of the files, writes a warning and returns False, and the store should not be used
+
+  Keyword parameters:
+
+  filename: the name of the store
+
+  indir: the directory with the feature files of the objects
+
+  objects: the objects which are read from the store
+  """
+  store = bob.io.base.HDF5File(filename, 'r')
+  index = SplitIndex.read(store)
+  objects = [obj for obj in objects if obj.make_path() in index.position]
+  if store.has_dataset('dates'):
+    stored = store.read('dates')[[index.position[obj.make_path()] for obj in objects]] if objects else numpy.zeros((0,), 'float64')
+    newer = file_dates(indir, objects) > stored # False for the files which do not exist (NaN)
+    if not newer.any():
+      return True
+  sys.stderr.write("The feature store %s is older than the feature files in %s, reading the files instead. Write the store again with mkfeaturestore.py\n" % (filename, indir))
+  return False
+
+
+def read_index(filename):
+  """Reads the index of the frames of the objects of a store (see SplitIndex)"""
+  return SplitIndex.read(bob.io.base.HDF5File(filename, 'r'))
+
+
+def map_store(filename, objects, indir=None):
+  """Memory-maps the features of the valid frames of the objects from a store written with memmap=True. Returns a read-only array which is read from the disk only when accessed, or None if the store has no memory-mapped features, if the objects are not exactly the ones of the store, in the same order, or if the store is older than the feature files
+
+  Keyword parameters:
+
+  filename: the name of the store
+
+  objects: the objects whose features are mapped
+
+  indir: the directory with the feature files of the objects. If given, the store is not used if it is older than the files (see fresh_store)
+  """
+  if not os.path.exists(memmap_filename(filename)):
+    return None
+  if indir is not None and not fresh_store(filename, indir, objects):
+    return None
+  if read_index(filename).paths != [obj.make_path() for obj in objects]:
+    return None
+  return numpy.load(memmap_filename(filename), mmap_mode='r')
+
+
+def read_valid(filename, objects, indir=None):
+  """Reads the flags of the valid frames of the objects from the index of a store, without reading their features. Returns the list of boolean arrays with the flags of the frames of each object, or None if some of the objects are not in the store, or if the store is older than the feature files
+
+  Keyword parameters:
+
+  filename: the name of the store
+
+  objects: the objects whose flags are read
+
+  indir: the directory with the feature files of the objects. If given, the store is not used if it is older than the files (see fresh_store)
+  """
+  index = read_index(filename)
+  if not index.contains(objects):
+    return None
+  if indir is not None and not fresh_store(filename, indir, objects):
+    return None
+  return [index.valid_frames(obj.make_path()) for obj in objects]
+
+
+def iter_features(indir, objects, store=None):
+  """Yields the tuple (obj, features) with the features of the valid frames of each of the objects, one object at a time, so that the features of all the objects never need to be in the memory at once. If the store has memory-mapped features for all the objects and is not older than their files, the features are slices of the memory map, otherwise they are read from the file of each object
+
+  Keyword parameters:
+
+  indir: the directory with the feature files of the objects
+
+  objects: the objects
+
+  store: the name of the feature store of the objects, if any
+  """
+  index = None
+  if store is not None and os.path.exists(memmap_filename(store)):
+    index = read_index(store)
+    if index.contains(objects) and fresh_store(store, indir, objects):
+      data = numpy.load(memmap_filename(store), mmap_mode='r')
+    else:
+      index = None
+  for obj in objects:
+    if index is not None:
+      start, end = index.rows(obj.make_path())
+      yield obj, data[start:end]
+    else:
+      feat = bob.io.base.load(os.path.expanduser(obj.make_path(indir, '.hdf5')))
+      yield obj, feat[~numpy.isnan(feat).any(axis=1)]
+
+
+def read_store(filename, objects, indir=None):
+  """Reads the features of the objects from a store. Returns the tuple (features, valid) with the features of all the frames of the objects, in the order of the objects, and the boolean array of the valid frames. For a store with memory-mapped features, only the valid frames are returned (and all of them are flagged as valid). Returns None if some of the objects are not in the store, if the store has only the index, or if it is older than the feature files
+
+  Keyword parameters:
+
+  filename: the name of the store
+
+  objects: the objects whose features are read
+
+  indir: the directory with the feature files of the objects. If given, the store is not used if it is older than the files (see fresh_store)
+  """
+  store = bob.io.base.HDF5File(filename, 'r')
+  index = SplitIndex.read(store)
+  if not index.contains(objects):
+    return None
+  if indir is not None and not fresh_store(filename, indir, objects):
+    return None
+  if store.has_dataset('features'):
+    features = store.read('features')
+    valid = index.valid
+    ranges = [index.frames(obj.make_path()) for obj in objects]
+  elif os.path.exists(memmap_filename(filename)): # the memory-mapped features have the valid frames only
+    features = numpy.load(memmap_filename(filename), mmap_mode='r')
+    valid = numpy.ones((features.shape[0],), 'bool')
+    ranges = [index.rows(obj.make_path()) for obj in objects]
+  else:
+    return None
+  if index.paths == [obj.make_path() for obj in objects]: # all the objects of the store, in the same order
+    return features, valid
+  rows = numpy.zeros((0,), 'int64')
+  if ranges:
+    rows = numpy.concatenate([numpy.arange(start, end) for (start, end) in ranges])
+  return features[rows], valid[rows]
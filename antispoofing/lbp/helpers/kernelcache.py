@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to cache on the disk the matrices computed from a feature set (for example, the kernel matrix of the training samples), so that they are computed only once for all the runs on the same features
+"""
+
+import os
+import hashlib
+import numpy
+import bob.io.base
+
+from . import chunked
+
+def data_hash(data, budget=chunked.CHUNK_BYTES):
+  """Returns a hash of the shape, the type and the content of a 2D dataset. The data is read in chunks, so that no copy of it is made"""
+  h = hashlib.sha1(repr((data.shape, str(data.dtype))))
+  for chunk in chunked.iter_chunks(data, budget):
+    h.update(numpy.ascontiguousarray(chunk).data)
+  return h.hexdigest()
+
+
+def cached_matrix(cachedir, name, data, func, jobs=1, budget=chunked.CHUNK_BYTES):
+  """Returns the matrix computed by func on the chunks of rows of the data, reading it from the cache if it was already computed on the same data. The matrix is written in the cache as a .npy file named after the name and the hash of the data, and it is memory-mapped when read
+
+  Keyword parameters:
+
+  cachedir: the directory of the cache
+
+  name: the name of the matrix, which must identify the function (for example, the name of the kernel)
+
+  data: the 2D data
+
+  func: function taking a chunk of rows of the data and returning the rows of the matrix
+
+  jobs: the number of processes among which the chunks are distributed (see chunked.apply_chunked)
+
+  budget: the size of a chunk of the data, in bytes
+  """
+  filename = os.path.join(cachedir, '%s-%s.npy' % (name, data_hash(data)))
+  if os.path.exists(filename):
+    return numpy.load(filename, mmap_mode='r')
+  matrix = chunked.apply_chunked(func, data, budget, jobs)
+  bob.io.base.create_directories_safe(cachedir)
+  tmpname = filename[:-4] + '.tmp.npy' # written under a temporary name first, so that an interrupted run leaves no partial matrix in the cache
+  numpy.save(tmpname, matrix)
+  os.rename(tmpname, filename)
+  return matrix
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to keep a manifest of the objects whose features have been computed in an output directory, so that an interrupted run can be resumed and only the missing or stale objects are processed again
+"""
+
+import os
+import glob
+import json
+import hashlib
+import bob.io.base
+
+def parameters_hash(name, args, parameters):
+  """Returns a hash of the parameters which determine the computed features
+
+  Keyword parameters:
+
+  name: the name of the features (for example, the name of the script), so that different features written in the same directory are not mixed
+
+  args: the parsed command line arguments
+
+  parameters: the names of the arguments which determine the features
+  """
+  values = [(p, getattr(args, p)) for p in sorted(parameters)]
+  return hashlib.sha1(repr((name, values))).hexdigest()
+
+
+def object_signature(params, contents=(), stats=()):
+  """Returns the signature of the computation of the features of an object. It changes whenever the parameters, the content of one of the files in contents or the size or modification time of one of the files in stats change. The large files (like the videos) should be given in stats, in order not to read them
+
+  Keyword parameters:
+
+  params: the hash of the parameters, as returned by parameters_hash
+
+  contents: the files whose content is hashed (for example, the face locations). None entries are ignored
+
+  stats: the files whose size and modification time are hashed
+  """
+  h = hashlib.sha1(params)
+  for filename in contents:
+    if filename is not None:
+      h.update(open(filename, 'rb').read())
+  for filename in stats:
+    st = os.stat(filename)
+    h.update('%d:%d' % (st.st_size, int(st.st_mtime)))
+  return h.hexdigest()
+
+
+def manifest_filename(directory, shard=None):
+  """Returns the name of the manifest of an output directory. Each shard keeps its own manifest, so that shards running at the same time do not overwrite each other"""
+  if shard is None:
+    return os.path.join(directory, 'manifest.json')
+  return os.path.join(directory, 'manifest-shard-%d-of-%d.json' % shard)
+
+
+def read_manifest(filename):
+  """Reads a single manifest. Returns a dictionary with an entry {'signature':..., 'status':...} for each object path"""
+  if not os.path.exists(filename):
+    return {}
+  return json.load(open(filename))
+
+
+def load_manifests(directory, filename):
+  """Reads and merges all the manifests of an output directory. The entries of the given manifest (the one written by this run) take precedence over the ones of the other manifests"""
+  entries = {}
+  for other in sorted(glob.glob(os.path.join(directory, 'manifest*.json'))):
+    if other != filename:
+      entries.update(read_manifest(other))
+  entries.update(read_manifest(filename))
+  return entries
+
+
+def is_finished(entries, path, signature, outputs):
+  """Returns True if the object with the given path has been finished with the given signature and all its output files exist
+
+  Keyword parameters:
+
+  entries: the entries of the manifests, as returned by load_manifests
+
+  path: the path of the object
+
+  signature: the current signature of the object, as returned by object_signature
+
+  outputs: the output files of the object
+  """
+  entry = entries.get(path)
+  if entry is None or entry['status'] != 'done' or entry['signature'] != signature:
+    return False
+  return all(os.path.exists(filename) for filename in outputs)
+
+
+def record_objects(filename, entries, paths, signatures, status):
+  """Sets the status of the given objects in the manifest and writes it. The file is replaced atomically, so that it is never left half-written if the run is interrupted. Should be called only from the main process
+
+  Keyword parameters:
+
+  filename: the name of the manifest
+
+  entries: the entries of the manifest, as returned by read_manifest. They are updated in place
+
+  paths: the paths of the objects
+
+  signatures: dictionary with the signature of each object path
+
+  status: the new status of the objects ('pending' or 'done')
+  """
+  for path in paths:
+    entries[path] = {'signature': signatures[path], 'status': status}
+  bob.io.base.create_directories_safe(os.path.dirname(filename))
+  f = open(filename + '.tmp', 'w')
+  json.dump(entries, f, indent=1, sort_keys=True)
+  f.close()
+  os.rename(filename + '.tmp', filename)
+
+
+def face_file(database, obj, inputdir, boundingbox=False):
+  """Returns the file with the face locations of the video of an object, or None if they are given by the database
+
+  Keyword parameters:
+
+  database: the database of the object
+
+  obj: the object
+
+  inputdir: the directory with the videos and the face locations
+
+  boundingbox: if the faces of the MSU database are given by its bounding boxes
+  """
+  if 'CASIA' in database.short_description():
+    return obj.facefile()
+  elif 'MSU' in database.short_description() and boundingbox:
+    return None
+  return obj.facefile(inputdir)
+
+
+def pending_objects(args, database, objects, params, outputs):
+  """Returns the objects which are not finished yet with the same parameters, face locations and video files (or all of them if args.force is set) and records them as pending in the manifest of the output directory. Returns the tuple (todo, record), where record(obj, result) records a finished object in the manifest and can be given as callback to parallel.process_objects
+
+  Keyword parameters:
+
+  args: the parsed command line arguments, with the input directory (inputdir), the output directory (directory), the shard (shard), the --force flag (force) and the --boundingbox flag (boundingbox)
+
+  database: the database of the objects
+
+  objects: the objects to process
+
+  params: the hash of the parameters, as returned by parameters_hash
+
+  outputs: function returning the output files of an object
+  """
+  signatures = dict((obj.make_path(), object_signature(params, [face_file(database, obj, args.inputdir, args.boundingbox)], [obj.videofile(directory=args.inputdir)])) for obj in objects)
+  filename = manifest_filename(args.directory, args.shard)
+  entries = read_manifest(filename)
+  finished = load_manifests(args.directory, filename)
+  todo = [obj for obj in objects if args.force or not is_finished(finished, obj.make_path(), signatures[obj.make_path()], outputs(obj))]
+  if len(todo) < len(objects):
+    print "Skipping %d out of %d videos which are already finished" % (len(objects) - len(todo), len(objects))
+  record_objects(filename, entries, [obj.make_path() for obj in todo], signatures, 'pending')
+
+  def record(obj, result):
+    """Records a finished object in the manifest"""
+    record_objects(filename, entries, [obj.make_path()], signatures, 'done')
+
+  return todo, record
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to process the objects of a database in parallel, in a pool of processes
+"""
+
+import sys
+import traceback
+import multiprocessing
+from StringIO import StringIO
+
+# the function and the objects processed by the pool. The workers are forked and inherit them, so that they do not need to be pickled
+_task = None
+
+# the function and the items of fork_map, inherited by the workers in the same way
+_mapped = None
+
+def _run(index):
+  """Processes a single object in a worker, capturing everything it writes on the standard output"""
+  func, objects = _task
+  log = StringIO()
+  stdout = sys.stdout
+  sys.stdout = log
+  try:
+    result = func(index + 1, objects[index])
+    error = None
+  except Exception:
+    result = None
+    error = traceback.format_exc()
+  finally:
+    sys.stdout = stdout
+  return log.getvalue(), result, error
+
+
+def process_objects(func, objects, jobs=1, done=None):
+  """Calls func(counter, obj) for each of the objects, where counter is the 1-based position of the object in the list. If jobs is larger than 1, the objects are distributed over a pool of jobs processes. The output each object writes on the standard output is printed in the order of the objects, as soon as the object and all the ones before it are finished. A failure on one object does not stop the processing of the others. Returns the tuple (results, failures): the list of values returned by func (None for the failed objects) and the list of (object, traceback) of the failures.
+
+  Keyword parameters:
+
+  func: the function processing a single object
+
+  objects: the list of objects
+
+  jobs: the number of processes
+
+  done: if given, function called in the main process as done(obj, result) as soon as an object is successfully processed, in the order of the objects
+  """
+  global _task
+  results = []
+  failures = []
+  if jobs <= 1:
+    for index, obj in enumerate(objects):
+      try:
+        result = func(index + 1, obj)
+      except Exception:
+        error = traceback.format_exc()
+        sys.stdout.write('\n')
+        sys.stderr.write("Error processing %s:\n%s" % (obj.make_path(), error))
+        results.append(None)
+        failures.append((obj, error))
+        continue
+      results.append(result)
+      if done is not None:
+        done(obj, result)
+    return results, failures
+
+  _task = (func, objects)
+  pool = multiprocessing.Pool(jobs)
+  try:
+    for index, (log, result, error) in enumerate(pool.imap(_run, range(len(objects)), chunksize=1)):
+      sys.stdout.write(log)
+      sys.stdout.flush()
+      results.append(result)
+      if error is not None:
+        sys.stdout.write('\n')
+        sys.stderr.write("Error processing %s:\n%s" % (objects[index].make_path(), error))
+        failures.append((objects[index], error))
+      elif done is not None:
+        done(objects[index], result)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    _task = None
+  return results, failures
+
+
+def _call(index):
+  """Calls the function of fork_map on a single item, in a worker"""
+  func, items = _mapped
+  return func(items[index])
+
+
+def fork_map(func, items, jobs=1):
+  """Returns the list of func(item) for each of the items. If jobs is larger than 1, the items are distributed over a pool of jobs forked processes. The workers inherit the function and everything it refers to (for example, large read-only datasets), so that only the results are pickled. The results are in the order of the items, and an exception in a worker is raised again in the main process
+
+  Keyword parameters:
+
+  func: the function processing a single item
+
+  items: the list of items
+
+  jobs: the number of processes
+  """
+  global _mapped
+  if jobs <= 1 or len(items) <= 1:
+    return [func(item) for item in items]
+  _mapped = (func, items)
+  pool = multiprocessing.Pool(min(jobs, len(items)))
+  try:
+    results = pool.map(_call, range(len(items)), chunksize=1)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    _mapped = None
+  return results
+
+
+def report_failures(failures, total):
+  """Prints a summary of the failed objects on the standard error. Returns the exit code of the script: 0 if all the objects were processed, 1 otherwise
+
+  Keyword parameters:
+
+  failures: the list of (object, traceback) of the failures, as returned by process_objects
+
+  total: the total number of objects
+  """
+  if not failures:
+    return 0
+  sys.stderr.write("Failed to process %d out of %d objects:\n" % (len(failures), total))
+  for obj, error in failures:
+    sys.stderr.write("  %s\n" % obj.make_path())
+  return 1
@@ -8,42 +8,138 @@ import os, sys
 import bob.io.base
 import numpy
 
+from .featurestore import read_store, read_valid, read_index, map_store, load_features, fresh_store
+from .splitindex import read_valid_frames
+
 """
 Utilitary functions to collect features in a matrix for a database and to map scores with the corresponding frame
 """
 
-def create_full_dataset(indir, objects):
-  """Creates a full dataset matrix out of all the specified files"""
-  dataset = None
-  for obj in objects:
-    filename = os.path.expanduser(obj.make_path(indir, '.hdf5'))
-    fvs = bob.io.base.load(filename)
-    if dataset is None:
-      dataset = fvs
+def _compact_rows(dataset, valid):
+  """Moves the valid rows of the dataset to its beginning, in place and keeping their order, and shrinks it to them. The rows are moved by contiguous runs, so that no copy of the full dataset is made"""
+  changes = numpy.diff(numpy.concatenate(([0], valid.astype('int8'), [0])))
+  starts = numpy.flatnonzero(changes == 1) # the first rows of the runs of valid rows
+  ends = numpy.flatnonzero(changes == -1) # the rows after the runs
+  numvalid = 0
+  for start, end in zip(starts, ends):
+    if start != numvalid:
+      dataset[numvalid:numvalid + end - start] = dataset[start:end]
+    numvalid += end - start
+  if not dataset.flags.owndata: # a view can not be shrunk, the memory is released with its base
+    return dataset[:numvalid]
+  dataset.resize((numvalid,) + dataset.shape[1:], refcheck=False)
+  return dataset
+
+def create_full_dataset(indir, objects, store=None):
+  """Creates a full dataset matrix out of all the specified files, keeping only the valid frames (the ones with no NaN features). The matrix is allocated once and filled with the files one after another. If the name of a feature store is given (see featurestore.write_store) and the store contains all the objects and is not older than their files, the matrix is read from the store instead. If the store has memory-mapped features for exactly these objects, the returned matrix is a read-only memory map
+
+  Keyword parameters:
+
+  indir: the directory with the feature vectors
+
+  objects: list of objects
+
+  store: the name of the feature store of the objects, if any
+  """
+  counts = None
+  if store is not None and os.path.exists(store) and fresh_store(store, indir, objects): # the store is checked only once for its staleness
+    mapped = map_store(store, objects)
+    if mapped is not None: # read-only and loaded from the disk only when accessed
+      return mapped
+    stored = read_store(store, objects)
+    if stored is not None:
+      features, valid = stored
+      return _compact_rows(features, valid)
+    index = read_index(store)
+    if index.contains(objects): # a store with the index only gives the sizes of the files
+      counts = [len(index.valid_frames(obj.make_path())) for obj in objects]
     else:
-      dataset = numpy.append(dataset, fvs, axis = 0)
-  return dataset[~numpy.isnan(dataset).any(axis=1)]  # remove all the Nan elements 
+      sys.stderr.write("The feature store %s does not contain all the objects, reading the files from %s instead\n" % (store, indir))
+  dataset, _ = load_features(indir, objects, counts)
+  return _compact_rows(dataset, ~numpy.isnan(dataset).any(axis=1)) # remove all the Nan elements
+
+def valid_frames(indir, objects, store=None):
+  """Returns the list of boolean arrays with the flags of the valid frames (the ones with no NaN features) of each object. The flags are taken from the index of the feature store if it contains all the objects and is not older than their files, otherwise from the validframes files written by the feature extraction scripts. Only the feature files of the objects which have neither of them are loaded
+
+  Keyword parameters:
+
+  indir: the directory with the feature vectors
+
+  objects: list of objects
+
+  store: the name of the feature store of the objects, if any
+  """
+  if store is not None and os.path.exists(store):
+    valid = read_valid(store, objects, indir)
+    if valid is not None:
+      return valid
+  return [read_valid_frames(indir, obj) for obj in objects]
+
+def check_valid_frames(indir, objects, valid, numscores):
+  """Checks that the flags of the valid frames of the objects match their feature files and the scores. Raises ValueError, naming the object, if the number of flags of an object is not the number of rows of its feature file (for example, because its validframes file is stale), or if the number of scores is not the number of valid frames of all the objects
 
-def map_scores(indir, score_dir, objects, score_list):
-  """Maps frame scores to frames of the objects. Writes the scores for each frame in a file, NaN for invalid frames
+  Keyword parameters:
+
+  indir: the directory with the feature vectors
+
+  objects: list of objects
+
+  valid: the flags of the valid frames of each object, as returned by valid_frames
+
+  numscores: the number of scores
+  """
+  for obj, indices in zip(objects, valid):
+    filename = os.path.expanduser(obj.make_path(indir, '.hdf5'))
+    if os.path.exists(filename):
+      numframes = bob.io.base.peek_all(filename)[1][0]
+      if numframes != len(indices):
+        raise ValueError("the valid frames of %s are given for %d frames, but its feature file %s has %d frames: compute its features again" % (obj.make_path(), len(indices), filename, numframes))
+  ends = numpy.cumsum([numpy.count_nonzero(indices) for indices in valid])
+  total = int(ends[-1]) if len(ends) else 0
+  if numscores < total:
+    k = int(numpy.searchsorted(ends, numscores, side='right')) # the first object whose valid frames have no scores
+    raise ValueError("there are %d scores for the %d valid frames of the objects: the scores run out at %s" % (numscores, total, objects[k].make_path()))
+  if numscores > total:
+    raise ValueError("there are %d scores for the %d valid frames of the objects: some scores are left after the ones of %s, the last object" % (numscores, total, objects[-1].make_path() if objects else None))
+
+def map_scores(indir, score_dir, objects, score_list, selected=None, store=None):
+  """Maps frame scores to frames of the objects. Writes the scores for each frame in a file, NaN for invalid frames. The flags of the valid frames are checked first (see check_valid_frames), so that no score is written if they do not match the features or the scores
 
   Keyword parameters:
 
-  indir: the directory with the feature vectors (needed to read which frames are invalid)
+  indir: the directory with the feature vectors (needed to know which frames are invalid, see valid_frames)
 
   score_dir: the directory where the score files are going to be written
 
   objects: list of objects
 
   score_list: list of scores for the given objects
+
+  selected: if given, the set of paths (as returned by make_path()) of the objects whose scores are written. The scores of the other objects are not written
+
+  store: the name of the feature store of the objects, if any
   """
+  valid = valid_frames(indir, objects, store)
+  check_valid_frames(indir, objects, valid, len(score_list))
   num_scores = 0 # counter for how many valid frames have been processed so far in total of all the objects
-  for obj in objects:
-    filename = os.path.expanduser(obj.make_path(indir, '.hdf5'))
-    feat = bob.io.base.load(filename)
-    indices = ~numpy.isnan(feat).any(axis=1) #find the indices of invalid frames (they are set to False in the resulting array)
-    scores = numpy.ndarray((len(indices), 1), dtype='float64') 
-    scores[indices] = score_list[num_scores:num_scores + sum(indices)] # set the scores of the valid frames only
-    scores[~indices] = numpy.NaN # set NaN for the scores of the invalid frames
-    num_scores += sum(indices) # increase the number of valid scores that have been already maped
-    obj.save(scores, score_dir, '.hdf5') # save the scores
+  for obj, indices in zip(objects, valid):
+    numvalid = numpy.count_nonzero(indices)
+    if selected is None or obj.make_path() in selected:
+      scores = numpy.ndarray((len(indices), 1), dtype='float64')
+      scores[indices] = score_list[num_scores:num_scores + numvalid] # set the scores of the valid frames only
+      scores[~indices] = numpy.NaN # set NaN for the scores of the invalid frames
+      obj.save(scores, score_dir, '.hdf5') # save the scores
+    num_scores += numvalid # increase the number of valid scores that have been already maped
+
+def read_scores(score_dir, objects):
+  """Reads the scores of the valid frames of the objects from the score files written by map_scores. Returns a 1D array with the scores of all the objects one after another
+
+  Keyword parameters:
+
+  score_dir: the directory with the score files
+
+  objects: list of objects
+  """
+  scores = [bob.io.base.load(os.path.expanduser(obj.make_path(score_dir, '.hdf5'))).flatten() for obj in objects]
+  scores = numpy.concatenate(scores) if scores else numpy.zeros((0,), 'float64')
+  return scores[~numpy.isnan(scores)]
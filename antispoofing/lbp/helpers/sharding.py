@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to split the objects of a database into shards which can be processed independently on different machines, and to verify that all the shards have been produced
+"""
+
+import os
+import argparse
+import bob.io.base
+import bob.io.video
+
+# the polarities of the scores written by the classification scripts, so that the real accesses get the higher scores once the shards are merged (see checkshards.py): 'devel' if all the scores are to be inverted when the mean score of the real accesses of the devel set is lower than the one of the attacks, 'fixed' if the scores are written with their final sign
+POLARITIES = ('devel', 'fixed')
+
+def parse_shard(value):
+  """Parses a shard given as "i/n" (the i-th out of n shards, counting from 0). To be used as an argparse type"""
+  try:
+    index, total = [int(k) for k in value.split('/')]
+  except ValueError:
+    raise argparse.ArgumentTypeError("the shard should be given as i/n, not '%s'" % value)
+  if total < 1 or index < 0 or index >= total:
+    raise argparse.ArgumentTypeError("the shard %s does not exist: i should be between 0 and n-1" % value)
+  return (index, total)
+
+
+def video_frames(inputdir):
+  """Returns a function giving the number of frames of the video of an object, to be used as a weight for shard_objects"""
+  def weight(obj):
+    return bob.io.video.reader(obj.videofile(directory=inputdir)).number_of_frames
+  return weight
+
+
+def feature_rows(indir):
+  """Returns a function giving the number of rows in the feature file of an object, to be used as a weight for shard_objects"""
+  def weight(obj):
+    return bob.io.base.peek_all(os.path.expanduser(obj.make_path(indir, '.hdf5')))[1][0]
+  return weight
+
+
+def shard_objects(objects, shard, weight):
+  """Returns the objects that belong to the given shard, in their original order. The partition is deterministic: the objects are sorted by decreasing weight (and by path for equal weights) and each of them is assigned to the least loaded shard. In this way, the shards are balanced according to the total weight (for example, the number of frames) rather than the number of objects
+
+  Keyword parameters:
+
+  objects: the list of all the objects
+
+  shard: the tuple (i, n) of the shard, as returned by parse_shard
+
+  weight: function returning the weight of an object
+  """
+  index, total = shard
+  weights = [weight(obj) for obj in objects]
+  order = sorted(range(len(objects)), key=lambda k: (-weights[k], objects[k].make_path()))
+  loads = [0] * total
+  selected = []
+  for k in order:
+    target = min(range(total), key=lambda s: (loads[s], s))
+    loads[target] += weights[k]
+    if target == index:
+      selected.append(k)
+  return [objects[k] for k in sorted(selected)]
+
+
+def shard_splits(splits, shard, weight):
+  """Returns the tuple (splits, objects): the list of the objects of each split that belong to the given shard, and the list of all of them. The shards are computed over the objects of all the splits together (see shard_objects), so that each split is spread over all the shards
+
+  Keyword parameters:
+
+  splits: the list of the lists of the objects of the splits
+
+  shard: the tuple (i, n) of the shard, as returned by parse_shard
+
+  weight: function returning the weight of an object
+  """
+  objects = shard_objects([obj for split in splits for obj in split], shard, weight)
+  selected = set(obj.make_path() for obj in objects)
+  return [[obj for obj in split if obj.make_path() in selected] for split in splits], objects
+
+
+def shard_filename(directory, shard):
+  """Returns the name of the file listing the objects produced by a shard"""
+  return os.path.join(directory, 'shards', 'shard-%d-of-%d.txt' % shard)
+
+
+def polarity_filename(directory):
+  """Returns the name of the file with the polarity of the scores written by the shards"""
+  return os.path.join(directory, 'shards', 'polarity.txt')
+
+
+def read_polarity(directory):
+  """Returns the polarity of the scores written by the shards in the directory (one of POLARITIES), or None if it was not recorded"""
+  filename = polarity_filename(directory)
+  if not os.path.exists(filename):
+    return None
+  return open(filename).read().strip()
+
+
+def record_shard(directory, shard, objects, failures=(), polarity=None):
+  """Writes the list of the objects successfully produced by a shard in the directory where the outputs were written
+
+  Keyword parameters:
+
+  directory: the output directory
+
+  shard: the tuple (i, n) of the shard
+
+  objects: the objects of the shard
+
+  failures: the list of (object, traceback) of the objects which failed
+
+  polarity: for the scores of the classification scripts, the polarity of the scores (one of POLARITIES), which is recorded for all the shards
+  """
+  failed = set(obj.make_path() for obj, _ in failures)
+  filename = shard_filename(directory, shard)
+  bob.io.base.create_directories_safe(os.path.dirname(filename))
+  f = open(filename, 'w')
+  for obj in objects:
+    if obj.make_path() not in failed:
+      f.write(obj.make_path() + '\n')
+  f.close()
+  if polarity is not None:
+    f = open(polarity_filename(directory), 'w')
+    f.write(polarity + '\n')
+    f.close()
+
+
+def verify_shards(directory, objects, total):
+  """Checks that each of the objects has been produced by exactly one of the total shards. Returns the tuple (missing_shards, missing, duplicated, unexpected) with the list of shards without a list of objects, the objects which were not produced, the objects produced more than once and the produced objects which are not in the list
+
+  Keyword parameters:
+
+  directory: the output directory of the shards
+
+  objects: the list of all the objects which should have been produced
+
+  total: the number of shards
+  """
+  counts = {}
+  missing_shards = []
+  for index in range(total):
+    filename = shard_filename(directory, (index, total))
+    if not os.path.exists(filename):
+      missing_shards.append(index)
+      continue
+    for line in open(filename):
+      path = line.strip()
+      if path:
+        counts[path] = counts.get(path, 0) + 1
+  expected = [obj.make_path() for obj in objects]
+  missing = [path for path in expected if path not in counts]
+  duplicated = sorted(path for path, count in counts.items() if count > 1)
+  unexpected = sorted(set(counts) - set(expected))
+  return missing_shards, missing, duplicated, unexpected
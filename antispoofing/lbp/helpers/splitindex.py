@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""An index of the frames of the videos of a split of a database, which maps the rows of the matrix of the valid frames (as built by create_full_dataset) to the videos and the frames they come from, and back
+"""
+
+import os
+import numpy
+import bob.io.base
+
+def read_valid_frames(indir, obj):
+  """Returns the boolean array with the flags of the valid frames (the ones with no NaN features) of an object. The flags are read from the validframes file written by the feature extraction scripts, and only if it does not exist, from the features themselves"""
+  filename = os.path.expanduser(obj.make_path(os.path.join(indir, 'validframes'), '.hdf5'))
+  if os.path.exists(filename):
+    return bob.io.base.load(filename).astype('bool')
+  feat = bob.io.base.load(os.path.expanduser(obj.make_path(indir, '.hdf5')))
+  return ~numpy.isnan(feat).any(axis=1)
+
+
+class SplitIndex(object):
+  """Index of the frames of a list of objects. The frames of all the objects are numbered one after another, and the valid frames only are numbered as rows, in the same order as in the matrix returned by create_full_dataset. All the lookups between objects, frames and rows take constant time
+
+  Keyword parameters:
+
+  paths: the paths of the objects (as returned by make_path())
+
+  valid: the flags of the valid frames of all the objects, one after another
+
+  offsets: the index of the first frame of each object, with the total number of frames as the last element
+  """
+
+  def __init__(self, paths, valid, offsets):
+    self.paths = list(paths)
+    self.valid = numpy.asarray(valid, 'bool')
+    self.offsets = numpy.asarray(offsets, 'int64')
+    self.position = dict((path, k) for k, path in enumerate(self.paths))
+    ranks = numpy.zeros((len(self.valid) + 1,), 'int64')
+    numpy.cumsum(self.valid, out=ranks[1:])
+    self.ranks = ranks # the number of valid frames before each frame
+    self.row_offsets = ranks[self.offsets] # the first row of each object
+    frames = numpy.flatnonzero(self.valid)
+    self.row_object = (numpy.searchsorted(self.offsets, frames, side='right') - 1).astype('int32') # the object of each row
+    self.row_frame = (frames - self.offsets[self.row_object]).astype('int32') # the frame of each row within its object
+
+  @classmethod
+  def build(cls, indir, objects):
+    """Builds the index of the objects from the validframes files in the feature directory (see read_valid_frames)"""
+    valid = [read_valid_frames(indir, obj) for obj in objects]
+    offsets = numpy.zeros((len(objects) + 1,), 'int64')
+    offsets[1:] = numpy.cumsum([len(v) for v in valid])
+    valid = numpy.concatenate(valid) if valid else numpy.zeros((0,), 'bool')
+    return cls([obj.make_path() for obj in objects], valid, offsets)
+
+  @classmethod
+  def read(cls, hdf5):
+    """Reads an index from an open bob HDF5 file"""
+    numframes = int(hdf5.read('numframes'))
+    valid = numpy.unpackbits(hdf5.read('valid_bits').astype('uint8'))[:numframes]
+    return cls(hdf5.read('paths').split('\n'), valid, hdf5.read('offsets'))
+
+  def save(self, hdf5):
+    """Writes the index into an open bob HDF5 file. Only the paths, the frame offsets and the bitmap of the valid frames are written, everything else is computed again when the index is read"""
+    hdf5.set('paths', '\n'.join(self.paths))
+    hdf5.set('offsets', self.offsets)
+    hdf5.set('numframes', len(self.valid))
+    hdf5.set('valid_bits', numpy.packbits(self.valid.astype('uint8')))
+
+  def contains(self, objects):
+    """Returns True if all the objects are in the index"""
+    return all(obj.make_path() in self.position for obj in objects)
+
+  def frames(self, path):
+    """Returns the (start, end) range of the frames of an object"""
+    k = self.position[path]
+    return self.offsets[k], self.offsets[k+1]
+
+  def rows(self, path):
+    """Returns the (start, end) range of the rows of the valid frames of an object"""
+    k = self.position[path]
+    return self.row_offsets[k], self.row_offsets[k+1]
+
+  def valid_frames(self, path):
+    """Returns the flags of the valid frames of an object"""
+    start, end = self.frames(path)
+    return self.valid[start:end]
+
+  def locate(self, row):
+    """Returns the tuple (path, frame) of the object and the frame of a row"""
+    return self.paths[self.row_object[row]], int(self.row_frame[row])
+
+  def row(self, path, frame):
+    """Returns the row of a frame of an object, or None if the frame is not valid"""
+    start, _ = self.frames(path)
+    if not self.valid[start + frame]:
+      return None
+    return int(self.ranks[start + frame])
+
+  def split_rows(self, values):
+    """Splits an array with one element (or row) per valid frame, in the order of the index, into the list of the parts of each object (as views)"""
+    return numpy.split(values, self.row_offsets[1:-1])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Utilitary functions to read the frames of the videos in a streaming fashion, without loading the full video in the memory
+"""
+
+import sys
+import numpy
+import bob.ip.color
+
+def iter_frames(input, chunk=1):
+  """Iterates over the RGB frames of a video in chunks of at most the given number of frames. Each chunk is a 4D array (frames, 3, height, width). The array of the chunk is reused for the next one, so it should not be kept by the caller. If chunk is 0, the full video is loaded and returned as a single chunk
+
+  Keyword parameters:
+
+  input: the bob.io.video.reader of the video
+
+  chunk: the number of frames read at once
+  """
+  if chunk <= 0:
+    yield input.load()
+    return
+  buf = None
+  n = 0
+  for frame in input:
+    if buf is None:
+      buf = numpy.ndarray((chunk,) + frame.shape, frame.dtype)
+    buf[n] = frame
+    n += 1
+    if n == chunk:
+      yield buf
+      n = 0
+  if n > 0:
+    yield buf[:n]
+
+
+def gray_frames(input, chunk=1, rotate=False):
+  """Iterates over the frames of a video converted to gray-scale, reading them in chunks (see iter_frames). Only a chunk of frames is kept in memory at a time. At most the number of frames announced by the reader is returned, as the face locations and the feature matrices are sized by it: the frame counts of some codecs are off by one or two, and the extra frames are ignored, with a warning
+
+  Keyword parameters:
+
+  input: the bob.io.video.reader of the video
+
+  chunk: the number of frames read at once (0 to load the full video)
+
+  rotate: if True, the frames are rotated by 180 degrees
+  """
+  numframes = 0
+  for frames in iter_frames(input, chunk):
+    for frame in frames:
+      if numframes >= input.number_of_frames:
+        sys.stderr.write("The video has more frames than the %d announced, the extra frames are ignored\n" % input.number_of_frames)
+        return
+      numframes += 1
+      frame = bob.ip.color.rgb_to_gray(frame)
+      if rotate:
+        frame = numpy.rot90(numpy.rot90(frame))
+      yield frame
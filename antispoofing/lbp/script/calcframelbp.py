@@ -17,6 +17,8 @@ import string
 import antispoofing.utils.faceloc as faceloc
 from antispoofing.utils.db import *
 
+from ..helpers import sharding
+
 def main():
 
   basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -38,6 +40,11 @@ def main():
   parser.add_argument('-e', '--enrollment', action='store_true', default=False, dest='enrollment', help='If True, will do the processing on the enrollment data of the database (defaults to "%(default)s")')
   parser.add_argument('--nn', '--nonorm', dest='nonorm', action='store_true', default=False, help='If True, normalization on the bounding box will NOT be perfomed. If False, normalization will be done depending on the -n parameter.')
   parser.add_argument('--bbx', '--boundingbox', action='store_true', default=False, dest='boundingbox', help='If True, will read the face locations using the bbx function of the File class of the database. If False, will use faceloc.read_face utility to read the faceloc. For MSU-MFSD only (defaults to "%(default)s")')
+  parser.add_argument('--cs', '--chunk-size', dest='chunk_size', type=int, default=1, help='The number of frames read from the video at once. If 0, the full video is loaded in the memory at once (defaults to "%(default)s")')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the videos are distributed (defaults to "%(default)s")')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the i-th (counting from 0) out of n shards of the videos is processed. The shards are balanced by the number of frames of the videos')
+  parser.add_argument('--force', dest='force', action='store_true', default=False, help='If set, all the videos are processed again, even the ones which the manifest of the output directory records as finished with the same parameters')
+  parser.add_argument('--ne', '--numpy-engine', action='store_true', default=False, dest='numpy_engine', help='If True, the LBP histograms of all the valid frames of a video are computed at once with the numpy LBP engine, instead of frame by frame with the bob LBP operator. Works only on normalized faces, with regular or modified LBP (defaults to "%(default)s")')
 
   #######
   # Database especific configuration
@@ -47,9 +54,13 @@ def main():
 
   args = parser.parse_args()
 
+  if args.numpy_engine and (args.nonorm or args.elbptype not in ('regular', 'modified')):
+    parser.error("the numpy LBP engine can only be used on normalized faces, with regular or modified LBP")
+
   lbphistlength = {'regular':256, 'riu2':10, 'uniform':59} # hardcoding the number of bins for the LBP variants
 
   from .. import spoof
+  from ..helpers import video, parallel, manifest
 
   ########################
   #Querying the database
@@ -63,10 +74,17 @@ def main():
     realObjects, attackObjects = database.get_all_data()
     process = realObjects + attackObjects
 
-  counter = 0
-  # process each video
-  for obj in process:
-    counter += 1
+  if args.shard is not None: # only process the videos of the given shard
+    process = sharding.shard_objects(process, args.shard, sharding.video_frames(args.inputdir))
+
+  # skip the videos which are already finished with the same parameters, face locations and video files
+  params = manifest.parameters_hash('calcframelbp', args, ('normfacesize', 'facesize_filter', 'lbptype', 'elbptype', 'blocks', 'circular', 'overlap', 'nonorm', 'boundingbox', 'numpy_engine'))
+  todo, finish_video = manifest.pending_objects(args, database, process, params, lambda obj: [obj.make_path(args.directory, '.hdf5'), obj.make_path(os.path.join(args.directory, 'validframes'), '.hdf5')])
+
+  normalizer = spoof.FaceNormalizer(args.normfacesize, args.facesize_filter) # the normalized faces are kept in the same buffers for all the videos
+
+  def process_video(counter, obj):
+    """Calculates the LBP histograms of all the frames of a single video and saves them"""
     input = bob.io.video.reader(obj.videofile(directory=args.inputdir))
 
     # loading the face locations
@@ -84,32 +102,45 @@ def main():
     sz = args.normfacesize # the size of the normalized face box
 
     sys.stdout.write("Processing file %s (%d frames) [%d/%d] " % (obj.make_path(),
-      input.number_of_frames, counter, len(process)))
+      input.number_of_frames, counter, len(todo)))
 
     # start the work here...
-    vin = input.load() # load the video
+    rotate = string.find(database.short_description(), "MSU") != -1 and obj.is_rotated() # rotate the frames by 180 degrees if needed
+    frames = video.gray_frames(input, args.chunk_size, rotate) # the gray-scale frames, read from the video in chunks
 
-    histdata = numpy.ndarray((0,args.blocks * args.blocks * lbphistlength[args.lbptype]), 'float64') # the numpy.ndarray, each row is the histogram of one frame
+    histlength = args.blocks * args.blocks * lbphistlength[args.lbptype]
+    histdata = numpy.ndarray((input.number_of_frames, histlength), 'float64') # the numpy.ndarray, each row is the histogram of one frame. It is filled in place
 
     numvf = 0 # number of valid frames in the video (will be smaller then the total number of frames if a face is not detected or a very small face is detected in a frame when face lbp are calculated
     validframes = [] # list with the indices of the valid frames
 
-    for k in range(0, vin.shape[0]):
-      frame = bob.ip.color.rgb_to_gray(vin[k,:,:,:])
-      if string.find(database.short_description(), "MSU") != -1 and obj.is_rotated(): # rotate the frame by 180 degrees if needed
-        frame = numpy.rot90(numpy.rot90(frame))  
-        #sys.stdout.write("File %s is rotated " % (obj.make_path()))
-      
-      sys.stdout.write('.')
-      sys.stdout.flush()
-      if args.nonorm:
+    if args.nonorm:
+      for k, frame in enumerate(frames):
+        sys.stdout.write('.')
+        sys.stdout.flush()
         hist, vf = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, numbl=args.blocks,  circ=args.circular, overlap=args.overlap, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
+        numvf = numvf + vf
+        validframes.append(vf) # add 0 if it is not a valid frame, 1 in contrary
+        histdata[k] = hist # set the histogram as the frame feature vector
+
+    else:
+      faces, valid = normalizer(frames, locations, input.number_of_frames) # the normalized faces of all the frames
+      numvf = int(valid.sum())
+      validframes = list(valid.astype('int64'))
+
+      if args.numpy_engine: # the histograms of all the valid frames are computed at once
+        histdata[:faces.shape[0]][~valid] = numpy.NaN # invalid frames have histograms with NaNs
+        histdata[:faces.shape[0]][valid] = spoof.lbphist_batch(faces[valid], args.lbptype, args.elbptype, neighbors=8, circ=args.circular, numbl=args.blocks, overlap=args.overlap)
       else:
-        hist, vf = spoof.lbphist_facenorm(frame, args.lbptype, locations[k], sz, args.elbptype, numbl=args.blocks,  circ=args.circular, overlap=args.overlap, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise
-      numvf = numvf + vf
-      validframes.append(vf) # add 0 if it is not a valid frame, 1 in contrary
-      #if vf == 1: # if it is a valid frame, add its histogram into the list of frame feature vectors
-      histdata = numpy.append(histdata, hist.reshape([1, hist.size]), axis = 0) # add the histogram into the list of frame feature vectors
+        for k in range(0, faces.shape[0]):
+          sys.stdout.write('.')
+          sys.stdout.flush()
+          if valid[k]:
+            histdata[k], vf = spoof.lbphist_frame(faces[k], args.lbptype, args.elbptype, numbl=args.blocks, circ=args.circular, overlap=args.overlap)
+          else: # histogram with NaNs if there is no valid face in the frame
+            histdata[k] = numpy.NaN
+
+    histdata = histdata[:len(validframes)] # the video may have less frames than announced
 
     sys.stdout.write('\n')
     sys.stdout.flush()
@@ -118,7 +149,11 @@ def main():
     obj.save(histdata, directory = args.directory, extension='.hdf5')
     obj.save(numpy.array(validframes), directory = os.path.join(args.directory, 'validframes'), extension='.hdf5')
 
-  return 0
+  # process each video, distributing them over several processes if required
+  results, failures = parallel.process_objects(process_video, todo, args.jobs, finish_video)
+  if args.shard is not None: # record the videos produced by this shard
+    sharding.record_shard(args.directory, args.shard, process, failures)
+  return parallel.report_failures(failures, len(todo))
 
 if __name__ == "__main__":
   main()
@@ -18,6 +18,38 @@ import string
 import antispoofing.utils.faceloc as faceloc
 from antispoofing.utils.db import *
 
+from ..helpers import sharding
+
+# the scales of the paper by Maatta, Hadid & Pietikainen: (radius, neighbors, blocks, overlap)
+DEFAULT_SCALES = [(2, 16, 1, False), (1, 8, 3, True), (2, 8, 1, False)]
+
+def parse_scale(value):
+  """Parses a scale given as "radius,neighbors,blocks[,o]", where the optional "o" stands for overlapping blocks and neighbors is 8 or 16. To be used as an argparse type"""
+  fields = [k.strip() for k in value.split(',')]
+  try:
+    if len(fields) not in (3, 4) or (len(fields) == 4 and fields[3] != 'o'):
+      raise ValueError
+    radius = float(fields[0])
+    if radius == int(radius): radius = int(radius)
+    neighbors = int(fields[1])
+    blocks = int(fields[2])
+  except ValueError:
+    raise argparse.ArgumentTypeError("the scale should be given as radius,neighbors,blocks[,o], not '%s'" % value)
+  if neighbors not in (8, 16): # the histograms of the invalid frames (see spoof.lbphist_face) have the lengths of 8 or 16 neighbors only
+    raise argparse.ArgumentTypeError("the number of neighbors of the scale '%s' should be 8 or 16" % value)
+  return (radius, neighbors, blocks, len(fields) == 4)
+
+
+def read_scales(filename):
+  """Reads a list of scales from a file, one scale per line as given to parse_scale. Empty lines and lines starting with # are ignored"""
+  scales = []
+  for line in open(filename):
+    line = line.strip()
+    if line and not line.startswith('#'):
+      scales.append(parse_scale(line))
+  return scales
+
+
 def main():
 
   basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -36,6 +68,13 @@ def main():
   parser.add_argument('-e', '--enrollment', action='store_true', default=False, dest='enrollment', help='If True, will do the processing on the enrollment data of the database (defaults to "%(default)s")')
   parser.add_argument('--nn', '--nonorm', dest='nonorm', action='store_true', default=False, help='If True, normalization on the bounding box will NOT be perfomed. If False, normalization will be done depending on the -n parameter.')
   parser.add_argument('--bbx', '--boundingbox', action='store_true', default=False, dest='boundingbox', help='If True, will read the face locations using the bbx function of the File class of the database. If False, will use faceloc.read_face utility to read the faceloc. For MSU-MFSD only (defaults to "%(default)s")')
+  parser.add_argument('-s', '--scale', dest='scales', type=parse_scale, action='append', default=None, help='A scale of the LBP histograms, as radius,neighbors,blocks[,o] (o for overlapping blocks), with 8 or 16 neighbors. Can be given several times, the histograms of the scales are concatenated in the given order. The LBP is always circular (defaults to the scales of the paper: 2,16,1 1,8,3,o 2,8,1)')
+  parser.add_argument('--sf', '--scales-file', dest='scalesfile', type=str, default=None, help='A file with the scales of the LBP histograms, one per line in the format of the -s option')
+  parser.add_argument('--ne', '--numpy-engine', action='store_true', default=False, dest='numpy_engine', help='If True, the LBP histograms of all the valid frames of a video are computed at once for each scale with the numpy LBP engine, instead of frame by frame with the bob LBP operator. Works only on normalized faces, with regular or modified LBP (defaults to "%(default)s")')
+  parser.add_argument('--cs', '--chunk-size', dest='chunk_size', type=int, default=1, help='The number of frames read from the video at once. If 0, the full video is loaded in the memory at once (defaults to "%(default)s")')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the videos are distributed (defaults to "%(default)s")')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the i-th (counting from 0) out of n shards of the videos is processed. The shards are balanced by the number of frames of the videos')
+  parser.add_argument('--force', dest='force', action='store_true', default=False, help='If set, all the videos are processed again, even the ones which the manifest of the output directory records as finished with the same parameters')
 
   #######
   # Database especific configuration
@@ -45,7 +84,26 @@ def main():
 
   args = parser.parse_args()
 
+  if args.scales is not None and args.scalesfile is not None:
+    parser.error("the scales can be given either on the command line or in a file, not both")
+  if args.scalesfile is not None:
+    try:
+      scales = read_scales(args.scalesfile)
+    except argparse.ArgumentTypeError as e:
+      parser.error(str(e))
+  elif args.scales is not None:
+    scales = args.scales
+  else:
+    scales = DEFAULT_SCALES
+  if not scales:
+    parser.error("at least one scale is needed")
+  args.scales = scales # the scales which are actually used determine the features
+
+  if args.numpy_engine and (args.nonorm or args.elbptype not in ('regular', 'modified')):
+    parser.error("the numpy LBP engine can only be used on normalized faces, with regular or modified LBP")
+
   from .. import spoof
+  from ..helpers import video, parallel, manifest
 
   ########################
   #Querying the database
@@ -59,10 +117,23 @@ def main():
     realObjects, attackObjects = database.get_all_data()
     process = realObjects + attackObjects
 
-  counter = 0
-  # process each video
-  for obj in process:
-    counter += 1
+  if args.shard is not None: # only process the videos of the given shard
+    process = sharding.shard_objects(process, args.shard, sharding.video_frames(args.inputdir))
+
+  # skip the videos which are already finished with the same parameters, face locations and video files
+  params = manifest.parameters_hash('calcframelbp_multiscale', args, ('normfacesize', 'facesize_filter', 'lbptype', 'elbptype', 'scales', 'nonorm', 'boundingbox', 'numpy_engine'))
+  todo, finish_video = manifest.pending_objects(args, database, process, params, lambda obj: [obj.make_path(args.directory, '.hdf5'), obj.make_path(os.path.join(args.directory, 'validframes'), '.hdf5')])
+
+  # the columns of the histogram of each scale in the concatenated histogram
+  bounds = [0]
+  for (radius, neighbors, blocks, overlap) in scales:
+    bounds.append(bounds[-1] + blocks * blocks * spoof.lbp_lut(args.lbptype, neighbors)[1])
+  histlength = bounds[-1]
+
+  normalizer = spoof.FaceNormalizer(args.normfacesize, args.facesize_filter) # the normalized faces are kept in the same buffers for all the videos
+
+  def process_video(counter, obj):
+    """Calculates the multi-scale LBP histograms of all the frames of a single video and saves them"""
     input = bob.io.video.reader(obj.videofile(directory=args.inputdir))
 
     # loading the face locations
@@ -80,40 +151,46 @@ def main():
     sz = args.normfacesize # the size of the normalized face box
 
     sys.stdout.write("Processing file %s (%d frames) [%d/%d] " % (obj.make_path(),
-      input.number_of_frames, counter, len(process)))
+      input.number_of_frames, counter, len(todo)))
 
     # start the work here...
-    vin = input.load() # load the video
+    rotate = string.find(database.short_description(), "MSU") != -1 and obj.is_rotated() # rotate the frames by 180 degrees if needed
+    frames = video.gray_frames(input, args.chunk_size, rotate) # the gray-scale frames, read from the video in chunks
 
-    histdata = None
+    histdata = numpy.ndarray((input.number_of_frames, histlength), 'float64') # the numpy.ndarray, each row is the histogram of one frame. It is filled in place
 
     numvf = 0 # number of valid frames in the video (will be smaller then the total number of frames if a face is not detected or a very small face is detected in a frame when face lbp are calculated
     validframes = [] # list with the indices of the valid frames
 
-    for k in range(0, vin.shape[0]):
-      frame = bob.ip.color.rgb_to_gray(vin[k,:,:,:])
-      if string.find(database.short_description(), "MSU") != -1 and obj.is_rotated(): # rotate the frame by 180 degrees if needed
-        frame = numpy.rot90(numpy.rot90(frame))  
-      
-      sys.stdout.write('.')
-      sys.stdout.flush()
-      if args.nonorm:
-        hist1, _ = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, radius=2, neighbors=16, numbl=1,  circ=True, overlap=False, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist2, _ = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, radius=1, neighbors=8, numbl=3,  circ=True, overlap=True, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist3, vf = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, radius=2, neighbors=8, numbl=1,  circ=True, overlap=False, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist = numpy.hstack((hist1, hist2, hist3))
+    if args.nonorm:
+      for k, frame in enumerate(frames):
+        sys.stdout.write('.')
+        sys.stdout.flush()
+        for i, (radius, neighbors, blocks, overlap) in enumerate(scales):
+          histdata[k, bounds[i]:bounds[i+1]], vf = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, radius=radius, neighbors=neighbors, numbl=blocks,  circ=True, overlap=overlap, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
+        numvf = numvf + vf
+        validframes.append(vf) # add 0 if it is not a valid frame, 1 in contrary
+
+    else:
+      faces, valid = normalizer(frames, locations, input.number_of_frames) # the face is normalized only once for all the scales
+      numvf = int(valid.sum())
+      validframes = list(valid.astype('int64'))
+
+      if args.numpy_engine: # the histograms of all the valid frames are computed at once, scale by scale
+        histdata[:faces.shape[0]][~valid] = numpy.NaN # invalid frames have histograms with NaNs
+        for i, (radius, neighbors, blocks, overlap) in enumerate(scales):
+          histdata[:faces.shape[0], bounds[i]:bounds[i+1]][valid] = spoof.lbphist_batch(faces[valid], args.lbptype, args.elbptype, radius=radius, neighbors=neighbors, circ=True, numbl=blocks, overlap=overlap)
       else:
-        hist1, _ = spoof.lbphist_facenorm(frame, args.lbptype, locations[k], sz, args.elbptype, radius=2, neighbors=16, numbl=1,  circ=True, overlap=False, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist2, _ = spoof.lbphist_facenorm(frame, args.lbptype, locations[k], sz, args.elbptype, radius=1, neighbors=8, numbl=3,  circ=True, overlap=True, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist3, vf = spoof.lbphist_facenorm(frame, args.lbptype, locations[k], sz, args.elbptype, radius=2, neighbors=8, numbl=1,  circ=True, overlap=False, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-        hist = numpy.hstack((hist1, hist2, hist3))
-      numvf = numvf + vf
-      validframes.append(vf) # add 0 if it is not a valid frame, 1 in contrary
-      
-      if histdata is None:
-        histdata = hist.reshape([1, hist.size])
-      else:  
-        histdata = numpy.append(histdata, hist.reshape([1, hist.size]), axis = 0) # add the histogram into the list of frame feature vectors
+        for k in range(0, faces.shape[0]):
+          sys.stdout.write('.')
+          sys.stdout.flush()
+          if valid[k]:
+            for i, (radius, neighbors, blocks, overlap) in enumerate(scales):
+              histdata[k, bounds[i]:bounds[i+1]], _ = spoof.lbphist_frame(faces[k], args.lbptype, args.elbptype, radius=radius, neighbors=neighbors, numbl=blocks, circ=True, overlap=overlap)
+          else: # histogram with NaNs if there is no valid face in the frame
+            histdata[k] = numpy.NaN
+
+    histdata = histdata[:len(validframes)] # the video may have less frames than announced
 
     sys.stdout.write('\n')
     sys.stdout.flush()
@@ -122,7 +199,11 @@ def main():
     obj.save(histdata, directory = args.directory, extension='.hdf5')
     obj.save(numpy.array(validframes), directory = os.path.join(args.directory, 'validframes'), extension='.hdf5')
 
-  return 0
+  # process each video, distributing them over several processes if required
+  results, failures = parallel.process_objects(process_video, todo, args.jobs, finish_video)
+  if args.shard is not None: # record the videos produced by this shard
+    sharding.record_shard(args.directory, args.shard, process, failures)
+  return parallel.report_failures(failures, len(todo))
 
 if __name__ == "__main__":
   main()
@@ -17,6 +17,8 @@ import string
 import antispoofing.utils.faceloc as faceloc
 from antispoofing.utils.db import *
 
+from ..helpers import sharding
+
 
 def cut_face_bbx(frame, bbx, sz, bbxsize_filter=0):
   """Calculates the normalized 3x3 LBP histogram over a given bounding box (bbx) in an image (around the detected face for example), using the bob LBP operator, after first rescaling bbx to a predefined size. If bbx is None or invalid, returns an empty histogram.
@@ -34,19 +36,8 @@ def cut_face_bbx(frame, bbx, sz, bbxsize_filter=0):
   bbxsize_filter
     Considers as invalid all the bounding boxes with size smaller then this value
   """
-  
-  if bbx and bbx.is_valid() and bbx.height > bbxsize_filter:
-    cutframe = frame[bbx.y:(bbx.y+bbx.height),bbx.x:(bbx.x+bbx.width)] # cutting the box region
-    tempbbx = numpy.ndarray((sz, sz), 'float64')
-    normbbx = numpy.ndarray((sz, sz), 'uint8')
-    bob.ip.base.scale(cutframe, tempbbx) # normalization
-    tempbbx_ = tempbbx + 0.5
-    tempbbx_ = numpy.floor(tempbbx_)
-    normbbx = numpy.cast['uint8'](tempbbx_)
-
-    return normbbx, 1
-  else:
-    return None, 0  
+  from ..spoof import facenorm
+  return facenorm(frame, bbx, sz, bbxsize_filter)
     
 
 
@@ -71,6 +62,10 @@ def main():
   parser.add_argument('--bo', '--block-overlap', dest="block_overlap", type=int, default=1, help='The overlap size of the blocks (defaults to "%(default)s")')
   parser.add_argument('--nn', '--nonorm', dest='nonorm', action='store_true', default=False, help='If True, block normalization of the HOG featurs will NOT be perfomed.')
   parser.add_argument('--bbx', '--boundingbox', action='store_true', default=False, dest='boundingbox', help='If True, will read the face locations using the bbx function of the File class of the database. If False, will use faceloc.read_face utility to read the faceloc. For MSU-MFSD only (defaults to "%(default)s")')
+  parser.add_argument('--cs', '--chunk-size', dest='chunk_size', type=int, default=1, help='The number of frames read from the video at once. If 0, the full video is loaded in the memory at once (defaults to "%(default)s")')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the videos are distributed (defaults to "%(default)s")')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the i-th (counting from 0) out of n shards of the videos is processed. The shards are balanced by the number of frames of the videos')
+  parser.add_argument('--force', dest='force', action='store_true', default=False, help='If set, all the videos are processed again, even the ones which the manifest of the output directory records as finished with the same parameters')
 
   #######
   # Database especific configuration
@@ -81,6 +76,7 @@ def main():
   args = parser.parse_args()
 
   from .. import spoof
+  from ..helpers import video, parallel, manifest
 
   ########################
   #Querying the database
@@ -94,10 +90,17 @@ def main():
     realObjects, attackObjects = database.get_all_data()
     process = realObjects + attackObjects
 
-  counter = 0
-  # process each video
-  for obj in process:
-    counter += 1
+  if args.shard is not None: # only process the videos of the given shard
+    process = sharding.shard_objects(process, args.shard, sharding.video_frames(args.inputdir))
+
+  # skip the videos which are already finished with the same parameters, face locations and video files
+  params = manifest.parameters_hash('calchog', args, ('normfacesize', 'cell', 'cell_overlap', 'block', 'block_overlap', 'nonorm', 'boundingbox'))
+  todo, finish_video = manifest.pending_objects(args, database, process, params, lambda obj: [obj.make_path(args.directory, '.hdf5'), obj.make_path(os.path.join(args.directory, 'validframes'), '.hdf5')])
+
+  normalizer = spoof.FaceNormalizer(args.normfacesize) # the normalized faces are kept in the same buffers for all the videos
+
+  def process_video(counter, obj):
+    """Calculates the HOG features of all the frames of a single video and saves them"""
     input = bob.io.video.reader(obj.videofile(directory=args.inputdir))
 
     # loading the face locations
@@ -115,41 +118,31 @@ def main():
     sz = args.normfacesize # the size of the normalized face box
 
     sys.stdout.write("Processing file %s (%d frames) [%d/%d] " % (obj.make_path(),
-      input.number_of_frames, counter, len(process)))
+      input.number_of_frames, counter, len(todo)))
 
     # start the work here...
-    vin = input.load() # load the video
+    rotate = string.find(database.short_description(), "MSU") != -1 and obj.is_rotated() # rotate the frames by 180 degrees if needed
+    frames = video.gray_frames(input, args.chunk_size, rotate) # the gray-scale frames, read from the video in chunks
 
     hog = bob.ip.base.HOG((sz,sz), cell_size=(args.cell, args.cell), cell_overlap=(args.cell_overlap, args.cell_overlap), block_size=(args.block,args.block), block_overlap=(args.block_overlap, args.block_overlap))
     if args.nonorm:
       hog.disable_block_normalization()
     hog_feat_shape = hog.output_shape()
     
-    histdata = numpy.ndarray((0, hog_feat_shape[0] * hog_feat_shape[1] * hog_feat_shape[2]), 'float64')
+    faces, valid = normalizer(frames, locations, input.number_of_frames) # the normalized faces of all the frames
+    histdata = numpy.ndarray((faces.shape[0], hog_feat_shape[0] * hog_feat_shape[1] * hog_feat_shape[2]), 'float64') # the numpy.ndarray, each row is the HOG feature vector of one frame. It is filled in place
 
-    numvf = 0 # number of valid frames in the video (will be smaller then the total number of frames if a face is not detected or a very small face is detected in a frame when face lbp are calculated
-    validframes = [] # list with the indices of the valid frames
+    numvf = int(valid.sum()) # number of valid frames in the video (will be smaller then the total number of frames if a face is not detected or a very small face is detected in a frame when face lbp are calculated
+    validframes = list(valid.astype('int64')) # list with the indices of the valid frames
 
-    for k in range(0, vin.shape[0]):
-      frame = bob.ip.color.rgb_to_gray(vin[k,:,:,:])
-      if string.find(database.short_description(), "MSU") != -1 and obj.is_rotated(): # rotate the frame by 180 degrees if needed
-        frame = numpy.rot90(numpy.rot90(frame))  
-        #sys.stdout.write("File %s is rotated " % (obj.make_path()))
-      
+    for k in range(0, faces.shape[0]):
       sys.stdout.write('.')
       sys.stdout.flush()
       
-      normbbx, vf = cut_face_bbx(frame, locations[k], sz, bbxsize_filter=0)
-      
-      numvf = numvf + vf
-      validframes.append(vf)
-      if vf == 1:
-        hogfeats = hog.extract(normbbx)
+      if valid[k]:
+        hog.extract(faces[k], histdata[k].reshape(hog_feat_shape)) # the HOG features are written directly as the frame feature vector
       else:
-        numpy.array(hog_feat_shape[0] * hog_feat_shape[1] * hog_feat_shape[2] * [numpy.NaN])  
-      
-
-      histdata = numpy.append(histdata, hogfeats.reshape([1, hog_feat_shape[0] * hog_feat_shape[1] * hog_feat_shape[2]]), axis = 0) # add the histogram into the list of frame feature vectors
+        histdata[k] = numpy.NaN
 
     sys.stdout.write('\n')
     sys.stdout.flush()
@@ -158,7 +151,11 @@ def main():
     obj.save(histdata, directory = args.directory, extension='.hdf5')
     obj.save(numpy.array(validframes), directory = os.path.join(args.directory, 'validframes'), extension='.hdf5')
 
-  return 0
+  # process each video, distributing them over several processes if required
+  results, failures = parallel.process_objects(process_video, todo, args.jobs, finish_video)
+  if args.shard is not None: # record the videos produced by this shard
+    sharding.record_shard(args.directory, args.shard, process, failures)
+  return parallel.report_failures(failures, len(todo))
 
 if __name__ == "__main__":
   main()
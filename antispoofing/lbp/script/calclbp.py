@@ -17,6 +17,8 @@ import string
 import antispoofing.utils.faceloc as faceloc
 from antispoofing.utils.db import *
 
+from ..helpers import sharding
+
 
 def main():
   
@@ -38,6 +40,10 @@ def main():
   parser.add_argument('-e', '--enrollment', action='store_true', default=False, dest='enrollment', help='If True, will do the processing of the enrollment data of the database (defaults to "%(default)s")')
   parser.add_argument('--nn', '--nonorm', dest='nonorm', action='store_true', default=False, help='If True, normalization on the bounding box will NOT be perfomed. If False, normalization will be done depending on the -n parameter.')
   parser.add_argument('--bbx', '--boundingbox', action='store_true', default=False, dest='boundingbox', help='If True, will read the face locations using the bbx function of the File class of the database. If False, will use faceloc.read_face utility to read the faceloc. For MSU-MFSD only (defaults to "%(default)s")')
+  parser.add_argument('--cs', '--chunk-size', dest='chunk_size', type=int, default=1, help='The number of frames read from the video at once. If 0, the full video is loaded in the memory at once (defaults to "%(default)s")')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the videos are distributed (defaults to "%(default)s")')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the i-th (counting from 0) out of n shards of the videos is processed. The shards are balanced by the number of frames of the videos')
+  parser.add_argument('--force', dest='force', action='store_true', default=False, help='If set, all the videos are processed again, even the ones which the manifest of the output directory records as finished with the same parameters')
 
   
   #######
@@ -51,6 +57,7 @@ def main():
   lbphistlength = {'regular':256, 'riu2':10, 'uniform':59} # hardcoding the number of bins for the LBP variants
 
   from .. import spoof
+  from ..helpers import video, parallel, manifest
 
   ########################
   #Querying the database
@@ -63,10 +70,17 @@ def main():
     realObjects, attackObjects = database.get_all_data()
     process = realObjects + attackObjects 
 
-  counter = 0
-  # process each video
-  for obj in process:
-    counter += 1
+  if args.shard is not None: # only process the videos of the given shard
+    process = sharding.shard_objects(process, args.shard, sharding.video_frames(args.inputdir))
+
+  # skip the videos which are already finished with the same parameters, face locations and video files
+  params = manifest.parameters_hash('calclbp', args, ('normfacesize', 'facesize_filter', 'lbptype', 'elbptype', 'blocks', 'circular', 'overlap', 'nonorm', 'boundingbox'))
+  todo, finish_video = manifest.pending_objects(args, database, process, params, lambda obj: [obj.make_path(args.directory, '.hdf5')])
+
+  normalizer = spoof.FaceNormalizer(args.normfacesize, args.facesize_filter) # the normalized faces are kept in the same buffers for all the videos
+
+  def process_video(counter, obj):
+    """Calculates the averaged LBP histogram of a single video and saves it"""
     input = bob.io.video.reader(obj.videofile(directory=args.inputdir))
 
     # loading the face locations
@@ -84,25 +98,30 @@ def main():
     sz = args.normfacesize # the size of the normalized face box
    
     sys.stdout.write("Processing file %s (%d frames) [%d/%d] " % (obj.make_path(),
-      input.number_of_frames, counter, len(process)))
+      input.number_of_frames, counter, len(todo)))
 
     # start the work here...
-    vin = input.load() # load the video
+    frames = video.gray_frames(input, args.chunk_size) # the gray-scale frames, read from the video in chunks
     
     data = numpy.array(args.blocks * args.blocks * lbphistlength[args.lbptype] * [0.]) # initialize the accumulated histogram	for uniform LBP
 
     numvf = 0 # number of valid frames in the video (will be smaller then the total number of frames if a face is not detected or a very small face is detected in a frame when face lbp are calculated   
 
-    for k in range(0, vin.shape[0]): 
-      frame = bob.ip.color.rgb_to_gray(vin[k,:,:,:])
-      sys.stdout.write('.')
-      sys.stdout.flush()
-      if args.nonorm:
+    if args.nonorm:
+      for k, frame in enumerate(frames): 
+        sys.stdout.write('.')
+        sys.stdout.flush()
         hist, vf = spoof.lbphist_face(frame, args.lbptype, locations[k], args.elbptype, numbl=args.blocks,  circ=args.circular, overlap=args.overlap, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise  
-      else:
-        hist, vf = spoof.lbphist_facenorm(frame, args.lbptype, locations[k], sz, args.elbptype, numbl=args.blocks,  circ=args.circular, overlap=args.overlap, bbxsize_filter=args.facesize_filter) # vf = 1 if it was a valid frame, 0 otherwise
-      numvf = numvf + vf
-      if vf == 1: # if it is a valid frame, add this histogram into the accumulated histogram
+        numvf = numvf + vf
+        if vf == 1: # if it is a valid frame, add this histogram into the accumulated histogram
+          data = data + hist # accumulate the histograms of all the frames one by one
+    else:
+      faces, valid = normalizer(frames, locations, input.number_of_frames) # the normalized faces of all the frames
+      for k in numpy.flatnonzero(valid): # only the valid frames are accumulated
+        sys.stdout.write('.')
+        sys.stdout.flush()
+        hist, vf = spoof.lbphist_frame(faces[k], args.lbptype, args.elbptype, numbl=args.blocks, circ=args.circular, overlap=args.overlap)
+        numvf = numvf + vf
         data = data + hist # accumulate the histograms of all the frames one by one
           
     data = data / numvf # averaging over the number of valied frames
@@ -113,7 +132,11 @@ def main():
     # saves the output
     obj.save(data.reshape([1,data.size]), directory = args.directory, extension='.hdf5')
 
-  return 0
+  # process each video, distributing them over several processes if required
+  results, failures = parallel.process_objects(process_video, todo, args.jobs, finish_video)
+  if args.shard is not None: # record the videos produced by this shard
+    sharding.record_shard(args.directory, args.shard, process, failures)
+  return parallel.report_failures(failures, len(todo))
 
 if __name__ == "__main__":
   main()
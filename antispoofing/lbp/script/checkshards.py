@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""Verifies the outputs of a run which was split into shards (using the --shard option of the feature extraction and classification scripts). Each video of the database (using the protocols in the database) needs to be produced by exactly one of the shards. If this is the case, the lists of the videos of all the shards are merged into a single list in the output directory.
+
+With --evaluate, the output directory is the 'scores' directory of a classification script run in shards. The error rates, which the shards can not compute from their part of the scores, are then computed from the merged scores.
+"""
+
+import os, sys
+import argparse
+
+from antispoofing.utils.db import *
+
+def main():
+
+  basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
+
+  OUTPUT_DIR = os.path.join(basedir, 'lbp_features')
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-d', '--directory', dest="directory", default=OUTPUT_DIR, help="The output directory of the shards: the directory with the features for the feature extraction scripts, or the 'scores' directory for the classification scripts (defaults to '%(default)s')")
+  parser.add_argument('-n', '--shards', dest='shards', type=int, required=True, help='The number of shards the run was split into')
+  parser.add_argument('-e', '--enrollment', action='store_true', default=False, dest='enrollment', help='If True, the shards are expected to cover the enrollment data of the database (defaults to "%(default)s")')
+  parser.add_argument('--ev', '--evaluate', action='store_true', default=False, dest='evaluate', help="If set, the directory is the 'scores' directory of a classification script run in shards. Once the shards are verified, the scores are oriented as the script does in a single run, following the polarity recorded by the shards: for svmeval_lbp.py and ldatrain_lbp.py, all the scores are inverted if the scores of the real accesses of the devel set are lower on average than the ones of the attacks, and the scores of cmphistmodels.py are kept as they are. The error rates at the EER threshold of the devel set are written in perf_table.txt in the output directory of the script (the parent of the 'scores' directory)")
+
+  from ..helpers import sharding
+  from ..helpers import score_manipulate as sm
+
+  #######
+  # Database especific configuration
+  #######
+  Database.create_parser(parser, implements_any_of='video')
+
+  args = parser.parse_args()
+
+  database = args.cls(args)
+  if args.enrollment:
+    process = database.get_enroll_data()
+  else:
+    realObjects, attackObjects = database.get_all_data()
+    process = realObjects + attackObjects
+
+  missing_shards, missing, duplicated, unexpected = sharding.verify_shards(args.directory, process, args.shards)
+
+  for index in missing_shards:
+    print "Shard %d/%d has not been produced" % (index, args.shards)
+  for path in missing:
+    print "Missing: %s" % path
+  for path in duplicated:
+    print "Produced by more than one shard: %s" % path
+  for path in unexpected:
+    print "Not in the database: %s" % path
+
+  if missing_shards or missing or duplicated:
+    print "Verification failed: %d of %d videos are missing, %d are duplicated" % (len(missing), len(process), len(duplicated))
+    return 1
+
+  # merge the lists of the shards
+  f = open(os.path.join(args.directory, 'shards', 'all.txt'), 'w')
+  for obj in process:
+    f.write(obj.make_path() + '\n')
+  f.close()
+  print "All the %d videos have been produced exactly once by the %d shards" % (len(process), args.shards)
+
+  if args.evaluate:
+    import bob.io.base
+    import bob.measure
+    import numpy
+    polarity = sharding.read_polarity(args.directory)
+    if polarity not in sharding.POLARITIES:
+      parser.error("the shards in %s did not record the polarity of their scores: run the shards of the classification script again" % args.directory)
+    process_train_real, process_train_attack = database.get_train_data()
+    process_devel_real, process_devel_attack = database.get_devel_data()
+    process_test_real, process_test_attack = database.get_test_data()
+    devel_real_out = sm.read_scores(args.directory, process_devel_real); devel_attack_out = sm.read_scores(args.directory, process_devel_attack)
+    test_real_out = sm.read_scores(args.directory, process_test_real); test_attack_out = sm.read_scores(args.directory, process_test_attack)
+
+    # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, unless the script gave the scores their final sign, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1.
+    if polarity == 'devel' and numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
+      print "Inverting the scores..."
+      devel_real_out = devel_real_out * -1; devel_attack_out = devel_attack_out * -1
+      test_real_out = test_real_out * -1; test_attack_out = test_attack_out * -1
+      for obj in process_train_real + process_train_attack + process_devel_real + process_devel_attack + process_test_real + process_test_attack:
+        obj.save(bob.io.base.load(os.path.expanduser(obj.make_path(args.directory, '.hdf5'))) * -1, args.directory, '.hdf5')
+
+    # calculation of the error rates
+    thres = bob.measure.eer_threshold(devel_attack_out, devel_real_out)
+    dev_far, dev_frr = bob.measure.farfrr(devel_attack_out, devel_real_out, thres)
+    test_far, test_frr = bob.measure.farfrr(test_attack_out, test_real_out, thres)
+
+    tbl = []
+    tbl.append(" ")
+    tbl.append(" threshold: %.4f" % thres)
+    tbl.append(" dev:  FAR %.2f%% (%d / %d) | FRR %.2f%% (%d / %d) | HTER %.2f%% " % \
+        (100*dev_far, int(round(dev_far*len(devel_attack_out))), len(devel_attack_out),
+         100*dev_frr, int(round(dev_frr*len(devel_real_out))), len(devel_real_out),
+         50*(dev_far+dev_frr)))
+    tbl.append(" test: FAR %.2f%% (%d / %d) | FRR %.2f%% (%d / %d) | HTER %.2f%% " % \
+        (100*test_far, int(round(test_far*len(test_attack_out))), len(test_attack_out),
+         100*test_frr, int(round(test_frr*len(test_real_out))), len(test_real_out),
+         50*(test_far+test_frr)))
+    txt = ''.join([k+'\n' for k in tbl])
+
+    print txt
+
+    # write the results to a file, in the output directory of the classification script
+    tf = open(os.path.join(os.path.dirname(os.path.abspath(args.directory)), 'perf_table.txt'), 'w')
+    tf.write(txt)
+    tf.close()
+  return 0
+
+if __name__ == "__main__":
+  main()
@@ -14,6 +14,8 @@ import numpy
 
 from antispoofing.utils.db import *
 from antispoofing.utils.ml import *
+
+from ..helpers import sharding
     
 def main():
 
@@ -26,13 +28,18 @@ def main():
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the scores to be loaded')
+  parser.add_argument('--st', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='If given, the features of each split are read from the feature stores in this directory (see mkfeaturestore.py) instead of from the file of each video')
   parser.add_argument('-m', '--input-modeldir', metavar='DIR', type=str, dest='inputmodeldir', default=INPUT_MODEL_DIR, help='Base directory containing the histogram models to be loaded')
   parser.add_argument('-d', '--output-dir', metavar='DIR', type=str, dest='outputdir', default=OUTPUT_DIR, help='Base directory that will be used to save the results.')
   parser.add_argument('-s', '--score', dest='score', action='store_true', default=False, help='If set, the final classification scores of all the frames will be dumped in a file')
+  parser.add_argument('-b', '--bank', dest='bank', type=str, choices=('min', 'mean'), default=None, help='If given, the data is compared to all the models of the bank of models (see the --group-by option of mkhistmodel.py) instead of to the single model, and the differences to the models are reduced by taking their minimum (the closest model) or their mean')
+  parser.add_argument('--dt', '--dtype', dest='dtype', type=str, choices=('float32', 'float64'), default='float64', help='The precision of the Chi-2 differences. float32 is faster and needs half the memory (defaults to "%(default)s")')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the videos of the i-th (counting from 0) out of n shards are loaded and compared to the models, and their scores are written (needs --score). The shards are balanced by the number of frames of the videos. The scores are written inverted, as in a single run, and no error rates are computed: when all the shards are finished, run checkshards.py --evaluate on the scores directory, which computes them from the merged scores')
 
   from .. import spoof, helpers
   from ..spoof import chi2
   from ..helpers import score_manipulate as sm
+  from ..helpers import featurestore
    
   #######
   # Database especific configuration
@@ -44,6 +51,9 @@ def main():
   if not os.path.exists(args.inputdir) or not os.path.exists(args.inputmodeldir):
     parser.error("input directory does not exist")
 
+  if args.shard is not None and not args.score:
+    parser.error("the shards only write the scores of their videos: --shard needs --score")
+
   if not os.path.exists(args.outputdir): # if the output directory doesn't exist, create it
     bob.io.base.create_directories_safe(args.outputdir)
     
@@ -56,24 +66,38 @@ def main():
   process_devel_real, process_devel_attack = database.get_devel_data()
   process_test_real, process_test_attack = database.get_test_data()
 
+  if args.shard is not None: # only the videos of the given shard are loaded and compared to the models
+    splits, shardobjects = sharding.shard_splits([process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack], args.shard, sharding.feature_rows(args.inputdir))
+    process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack = splits
+
   # create the full datasets from the file data
-  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack); 
-  test_real = sm.create_full_dataset(args.inputdir, process_test_real); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack); 
-  train_real = sm.create_full_dataset(args.inputdir, process_train_real); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack); 
+  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real, featurestore.store_filename(args.storedir, 'devel_real')); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack, featurestore.store_filename(args.storedir, 'devel_attack')); 
+  test_real = sm.create_full_dataset(args.inputdir, process_test_real, featurestore.store_filename(args.storedir, 'test_real')); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack, featurestore.store_filename(args.storedir, 'test_attack')); 
+  train_real = sm.create_full_dataset(args.inputdir, process_train_real, featurestore.store_filename(args.storedir, 'train_real')); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack, featurestore.store_filename(args.storedir, 'train_attack')); 
 
   print "Loading the models..."
   # loading the histogram models
   histmodelsfile = bob.io.base.HDF5File(os.path.join(args.inputmodeldir, 'histmodelsfile.hdf5'),'r')
   model_hist_real = histmodelsfile.read('model_hist_real')
+  if args.bank is not None:
+    if not histmodelsfile.has_dataset('model_bank'):
+      parser.error("the models file has no bank of models, make it with the --group-by option of mkhistmodel.py")
+    model_bank = histmodelsfile.read('model_bank')
+    print "Loaded a bank of %d models" % model_bank.shape[0]
   del histmodelsfile
     
   model_hist_real = model_hist_real[0,:]
 
   print "Calculating the Chi-2 differences..."
   # calculating the comparison scores with chi2 distribution for each protocol subset   
-  sc_devel_realmodel = chi2.cmphistbinschimod(model_hist_real, (devel_real, devel_attack))
-  sc_test_realmodel = chi2.cmphistbinschimod(model_hist_real, (test_real, test_attack))
-  sc_train_realmodel = chi2.cmphistbinschimod(model_hist_real, (train_real, train_attack))
+  if args.bank is not None: # all the models of the bank at once
+    sc_devel_realmodel = chi2.cmphistbankchimod(model_bank, (devel_real, devel_attack), args.bank, args.dtype)
+    sc_test_realmodel = chi2.cmphistbankchimod(model_bank, (test_real, test_attack), args.bank, args.dtype)
+    sc_train_realmodel = chi2.cmphistbankchimod(model_bank, (train_real, train_attack), args.bank, args.dtype)
+  else:
+    sc_devel_realmodel = chi2.cmphistbinschimod(model_hist_real, (devel_real, devel_attack), args.dtype)
+    sc_test_realmodel = chi2.cmphistbinschimod(model_hist_real, (test_real, test_attack), args.dtype)
+    sc_train_realmodel = chi2.cmphistbinschimod(model_hist_real, (train_real, train_attack), args.dtype)
 
   print "Saving the results in a file"
   # It is expected that the positives always have larger scores. Therefore, it is necessary to "invert" the scores by multiplying them by -1 (the chi-square test gives smaller scores to the data from the similar distribution)
@@ -83,12 +107,16 @@ def main():
 
   if args.score: # save the scores in a file
     score_dir = os.path.join(args.outputdir, 'scores') # output directory for the socre files
-    sm.map_scores(args.inputdir, score_dir, process_devel_real, sc_devel_realmodel[0]) 
-    sm.map_scores(args.inputdir, score_dir, process_devel_attack, sc_devel_realmodel[1])
-    sm.map_scores(args.inputdir, score_dir, process_test_real, sc_test_realmodel[0])
-    sm.map_scores(args.inputdir, score_dir, process_test_attack, sc_test_realmodel[1])
-    sm.map_scores(args.inputdir, score_dir, process_train_real, sc_train_realmodel[0])
-    sm.map_scores(args.inputdir, score_dir, process_train_attack, sc_train_realmodel[1])
+    sm.map_scores(args.inputdir, score_dir, process_devel_real, sc_devel_realmodel[0], store=featurestore.store_filename(args.storedir, 'devel_real'))
+    sm.map_scores(args.inputdir, score_dir, process_devel_attack, sc_devel_realmodel[1], store=featurestore.store_filename(args.storedir, 'devel_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_test_real, sc_test_realmodel[0], store=featurestore.store_filename(args.storedir, 'test_real'))
+    sm.map_scores(args.inputdir, score_dir, process_test_attack, sc_test_realmodel[1], store=featurestore.store_filename(args.storedir, 'test_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_train_real, sc_train_realmodel[0], store=featurestore.store_filename(args.storedir, 'train_real'))
+    sm.map_scores(args.inputdir, score_dir, process_train_attack, sc_train_realmodel[1], store=featurestore.store_filename(args.storedir, 'train_attack'))
+    if args.shard is not None: # record the videos whose scores were written by this shard
+      sharding.record_shard(score_dir, args.shard, shardobjects, polarity='fixed') # the chi-square scores are always inverted, whatever the devel set
+      print "The error rates are computed by checkshards.py --evaluate when all the shards are finished"
+      return 0
 
   # calculation of the error rates
   thres = bob.measure.eer_threshold(sc_devel_realmodel[1].flatten(), sc_devel_realmodel[0].flatten())
@@ -17,6 +17,8 @@ import numpy
 from antispoofing.utils.db import *
 from antispoofing.utils.ml import *
 
+from ..helpers import sharding
+
 def main():
 
   basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -27,13 +29,17 @@ def main():
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the scores to be loaded')
+  parser.add_argument('--st', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='If given, the features of each split are read from the feature stores in this directory (see mkfeaturestore.py) instead of from the file of each video')
   parser.add_argument('-d', '--output-dir', metavar='DIR', type=str, dest='outputdir', default=OUTPUT_DIR, help='Base directory that will be used to save the results.')
   parser.add_argument('-n', '--normalize', action='store_true', dest='normalize', default=False, help='If True, will do zero mean unit variance normalization on the data before creating the LDA machine')
   parser.add_argument('-r', '--pca_reduction', action='store_true', dest='pca_reduction', default=False, help='If set, PCA dimensionality reduction will be performed to the data before doing LDA')
   parser.add_argument('-e', '--energy', type=str, dest="energy", default='0.99', help='The energy which needs to be preserved after the dimensionality reduction if PCA is performed prior to LDA')
   parser.add_argument('-s', '--score', dest='score', action='store_true', default=False, help='If set, the final classification scores of all the frames will be dumped in a file')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the devel and test videos of the i-th (counting from 0) out of n shards are loaded and scored, and the scores of the videos of the shard are written (needs --score). The full training set is still loaded, as the LDA machine is trained on it. The shards are balanced by the number of frames of the videos. The scores are written as given by the machine and no error rates are computed: when all the shards are finished, run checkshards.py --evaluate on the scores directory, which inverts the scores if needed and computes the error rates from the merged scores')
 
   from ..helpers import score_manipulate as sm
+  from ..helpers import featurestore
+  from ..helpers import chunked
 
   #######
   # Database especific configuration
@@ -45,6 +51,9 @@ def main():
   if not os.path.exists(args.inputdir):
     parser.error("input directory does not exist")
 
+  if args.shard is not None and not args.score:
+    parser.error("the shards only write the scores of their videos: --shard needs --score")
+
   if not os.path.exists(args.outputdir): # if the output directory doesn't exist, create it
     bob.io.base.create_directories_safe(args.outputdir)
 
@@ -57,54 +66,76 @@ def main():
   process_devel_real, process_devel_attack = database.get_devel_data()
   process_test_real, process_test_attack = database.get_test_data()
   
+  selected = None
+  if args.shard is not None: # only the devel and test videos of the given shard are loaded and scored. The training videos are all needed to train the machine, and the scores of the ones of the shard only are written
+    splits, shardobjects = sharding.shard_splits([process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack], args.shard, sharding.feature_rows(args.inputdir))
+    process_devel_real, process_devel_attack, process_test_real, process_test_attack = splits[2:]
+    selected = set(obj.make_path() for obj in shardobjects)
 
   # create the full datasets from the file data
-  train_real = sm.create_full_dataset(args.inputdir, process_train_real); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack); 
-  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack); 
-  test_real = sm.create_full_dataset(args.inputdir, process_test_real); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack); 
+  train_real = sm.create_full_dataset(args.inputdir, process_train_real, featurestore.store_filename(args.storedir, 'train_real')); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack, featurestore.store_filename(args.storedir, 'train_attack')); 
+  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real, featurestore.store_filename(args.storedir, 'devel_real')); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack, featurestore.store_filename(args.storedir, 'devel_attack')); 
+  test_real = sm.create_full_dataset(args.inputdir, process_test_real, featurestore.store_filename(args.storedir, 'test_real')); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack, featurestore.store_filename(args.storedir, 'test_attack')); 
   
+  mean = None; std = None; pca_machine = None
+
+  def transform(data):
+    """Applies the normalization and the PCA reduction to the data of the devel and test sets"""
+    if mean is not None:
+      data = norm.zeromean_unitvar_norm(data, mean, std)
+    if pca_machine is not None:
+      data = pca.pcareduce(pca_machine, data)
+    return data
+
+  # the training data is transformed step by step, as each step is computed on the output of the previous one. The devel and test data are transformed in chunks only when they are scored, so that no full copy of them is made
   if args.normalize:  # zero mean unit variance data normalziation
     print "Applying standard normalization..."
-    #import ipdb; ipdb.set_trace()
     mean, std = norm.calc_mean_std(train_real, train_attack)
-    train_real = norm.zeromean_unitvar_norm(train_real, mean, std); train_attack = norm.zeromean_unitvar_norm(train_attack, mean, std)
-    devel_real = norm.zeromean_unitvar_norm(devel_real, mean, std); devel_attack = norm.zeromean_unitvar_norm(devel_attack, mean, std)
-    test_real = norm.zeromean_unitvar_norm(test_real, mean, std); test_attack = norm.zeromean_unitvar_norm(test_attack, mean, std)
+    train_real = chunked.apply_chunked(lambda x: norm.zeromean_unitvar_norm(x, mean, std), train_real); train_attack = chunked.apply_chunked(lambda x: norm.zeromean_unitvar_norm(x, mean, std), train_attack)
 
   if args.pca_reduction: # PCA dimensionality reduction of the data
     print "Running PCA reduction..."
     train=numpy.append(train_real, train_attack, axis=0)
     pca_machine = pca.make_pca(train, energy) # performing PCA
-    train_real = pca.pcareduce(pca_machine, train_real); train_attack = pca.pcareduce(pca_machine, train_attack)
-    devel_real = pca.pcareduce(pca_machine, devel_real); devel_attack = pca.pcareduce(pca_machine, devel_attack)
-    test_real = pca.pcareduce(pca_machine, test_real); test_attack = pca.pcareduce(pca_machine, test_attack)
+    del train
+    train_real = chunked.apply_chunked(lambda x: pca.pcareduce(pca_machine, x), train_real); train_attack = chunked.apply_chunked(lambda x: pca.pcareduce(pca_machine, x), train_attack)
 
   print "Training LDA machine..."
   lda_machine = lda.make_lda((train_real, train_attack)) # training the LDA
   lda_machine.shape = (lda_machine.shape[0], 1) #only use first component!
   
+  def score(data):
+    """Transforms and scores the devel or test data in chunks"""
+    if data.shape[0] == 0: # a shard may have no video of a split
+      return numpy.zeros((0,), 'float64')
+    return chunked.apply_chunked(lambda x: lda.get_scores(lda_machine, transform(x)), data)
+
   print "Computing devel and test scores..."
-  devel_real_out = lda.get_scores(lda_machine, devel_real)
-  devel_attack_out = lda.get_scores(lda_machine, devel_attack)
-  test_real_out = lda.get_scores(lda_machine, test_real)
-  test_attack_out = lda.get_scores(lda_machine, test_attack)
-  train_real_out = lda.get_scores(lda_machine, train_real)
+  devel_real_out = score(devel_real)
+  devel_attack_out = score(devel_attack)
+  test_real_out = score(test_real)
+  test_attack_out = score(test_attack)
+  train_real_out = lda.get_scores(lda_machine, train_real) # already transformed
   train_attack_out = lda.get_scores(lda_machine, train_attack)
 
-  # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1.
-  if numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
+  # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1. A shard has only some of the devel scores, so the check is made by checkshards.py on the merged scores
+  if args.shard is None and numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
     devel_real_out = devel_real_out * -1; devel_attack_out = devel_attack_out * -1
     test_real_out = test_real_out * -1; test_attack_out = test_attack_out * -1
     train_real_out = train_real_out * -1; train_attack_out = train_attack_out * -1     
 
   if args.score: # save the scores in a file
     score_dir = os.path.join(args.outputdir, 'scores') # output directory for the socre files
-    sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1])) 
-    sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]))
+    sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1]), selected, featurestore.store_filename(args.storedir, 'devel_real'))
+    sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]), selected, featurestore.store_filename(args.storedir, 'devel_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]), selected, featurestore.store_filename(args.storedir, 'test_real'))
+    sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]), selected, featurestore.store_filename(args.storedir, 'test_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]), selected, featurestore.store_filename(args.storedir, 'train_real'))
+    sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]), selected, featurestore.store_filename(args.storedir, 'train_attack'))
+    if args.shard is not None: # record the videos whose scores were written by this shard
+      sharding.record_shard(score_dir, args.shard, shardobjects, polarity='devel')
+      print "The error rates are computed by checkshards.py --evaluate when all the shards are finished"
+      return 0
    
   # calculation of the error rates
   thres = bob.measure.eer_threshold(devel_attack_out.flatten(), devel_real_out.flatten())
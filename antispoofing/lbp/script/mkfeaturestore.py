@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""Consolidates the features of the videos of each split of the database (train, devel and test; real and attack, using the protocols in the database) into a single file per split: a feature store. The classification scripts read the features of a split from its store with a few large reads (option --store-dir), instead of opening the file of each video.
+"""
+
+import os, sys
+import argparse
+
+from antispoofing.utils.db import *
+
+def main():
+
+  basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
+
+  INPUT_DIR = os.path.join(basedir, 'lbp_features')
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the features of all the videos (defaults to "%(default)s")')
+  parser.add_argument('-o', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='The directory where the stores of the splits are written (defaults to the "store" subdirectory of the input directory)')
+  parser.add_argument('--mm', '--memmap', dest='memmap', action='store_true', default=False, help='If set, the features of the valid frames are written into a contiguous .npy file per split, which the classification scripts memory-map instead of loading. Use it for feature sets larger than the memory')
+  parser.add_argument('--io', '--index-only', dest='index_only', action='store_true', default=False, help='If set, only the index of the frames of each split is written (the videos, the number of frames and the valid frames), from the validframes files and without copying the features. The classification scripts use it to know the layout of the features without opening the feature files')
+
+  from ..helpers import featurestore
+
+  #######
+  # Database especific configuration
+  #######
+  Database.create_parser(parser, implements_any_of='video')
+
+  args = parser.parse_args()
+
+  if not os.path.exists(args.inputdir):
+    parser.error("input directory does not exist")
+
+  if args.storedir is None:
+    args.storedir = os.path.join(args.inputdir, 'store')
+
+  database = args.cls(args)
+  process_train_real, process_train_attack = database.get_train_data()
+  process_devel_real, process_devel_attack = database.get_devel_data()
+  process_test_real, process_test_attack = database.get_test_data()
+  splits = dict(zip(featurestore.SPLITS, (process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack)))
+
+  for split in featurestore.SPLITS:
+    filename = featurestore.store_filename(args.storedir, split)
+    print "Writing the %s of %d videos of the %s split to %s..." % ('index' if args.index_only else 'features', len(splits[split]), split, filename)
+    featurestore.write_store(filename, args.inputdir, splits[split], args.memmap, not args.index_only)
+
+  print "Done."
+
+if __name__ == "__main__":
+  main()
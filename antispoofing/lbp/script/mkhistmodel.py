@@ -6,6 +6,7 @@
 """
 
 import os, sys
+import re
 import argparse
 import bob.io.base
 import numpy
@@ -21,9 +22,13 @@ def main():
   
   parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the histogram features of all the videos')
+  parser.add_argument('--st', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='If given, the features of each split are read from the feature stores in this directory (see mkfeaturestore.py) instead of from the file of each video')
   parser.add_argument('-d', '--output-dir', metavar='DIR', type=str, dest='outputdir', default=OUTPUT_DIR, help='Base directory that will be used to save the results (models).')
+  parser.add_argument('-u', '--update', dest='update', action='store_true', default=False, help='If set, the models in the output directory are updated instead of being made again: only the real access videos of the training set which are not in the models yet are added to them, using the sums of the histograms which are saved with the models')
+  parser.add_argument('-r', '--remove', metavar='PATH', dest='remove', action='append', default=[], help='The path of a video in the models (as in the database, with no extension) whose histograms are subtracted from the models. Its features must not have changed since it was added. Can be given several times, and implies --update. The removed videos are recorded with the models, and are not added back by the later updates: make the models again without --update to include them')
+  parser.add_argument('-g', '--group-by', dest='groupby', type=str, default=None, help='If given, a bank of models is also made, with one model per group of real access videos. The groups are given by this regular expression, searched in the path of each video: the videos with the same match (or the same first group of the expression, if it has one) are in the same group. For example, "client(\\d+)" makes one model per client of Replay-Attack. With --update, it defaults to the expression of the models which are updated, and can not be changed: make the models again without --update to group the videos differently')
   
-  from ..helpers import score_manipulate as sm
+  from ..helpers import featurestore
   
   #######
   # Database especific configuration
@@ -44,20 +49,105 @@ def main():
   database = args.cls(args)
   process_train_real, process_train_attack = database.get_train_data()
 
-  # create the full datasets from the file data
-  train_real = sm.create_full_dataset(args.inputdir, process_train_real);
-  
-  print "Creating the model..."
+  histmodelsname = os.path.join(args.outputdir, 'histmodelsfile.hdf5')
+  args.update = args.update or bool(args.remove)
+  if args.update and not os.path.exists(histmodelsname):
+    parser.error("there are no models to update in the output directory")
 
-  model_hist_real = [sum(train_real[:,i]) for i in range(0, train_real.shape[1])] # sum the histograms of the real access videos
-  
-  model_hist_real = [i / train_real.shape[0] for i in model_hist_real]  # average the model histogram for the real access videos
+  sums = {} # the sum of the histograms and the number of frames of the model (None) and of each group of the bank
+  included = [] # the paths of the videos in the models
+  excluded = [] # the paths of the videos removed from the models, which are not added back by the updates
+  groups = {} # the group of each video, for the bank of models
+  if args.update:
+    histmodelsfile = bob.io.base.HDF5File(histmodelsname, 'r')
+    if not histmodelsfile.has_dataset('model_sum'):
+      parser.error("the models in the output directory have no sums of the histograms and can not be updated")
+    sums[None] = [histmodelsfile.read('model_sum'), int(histmodelsfile.read('model_count'))]
+    included = [path for path in histmodelsfile.read('included').split('\n') if path]
+    if histmodelsfile.has_dataset('excluded'):
+      excluded = [path for path in histmodelsfile.read('excluded').split('\n') if path]
+    if histmodelsfile.has_dataset('bank_sum'):
+      if args.groupby is not None and args.groupby != histmodelsfile.read('group_by'):
+        parser.error("the bank of models in the output directory is grouped by \"%s\": make the models again without --update to group them by another expression" % histmodelsfile.read('group_by'))
+      args.groupby = histmodelsfile.read('group_by')
+      bank_sum = histmodelsfile.read('bank_sum'); bank_count = histmodelsfile.read('bank_count')
+      for k, name in enumerate(histmodelsfile.read('model_names').split('\n')):
+        sums[name] = [bank_sum[k], int(bank_count[k])]
+      groups = dict(zip(included, histmodelsfile.read('included_groups').split('\n')))
+    elif args.groupby is not None and included:
+      parser.error("the models in the output directory have no bank of models, which can not be added with --update")
+    del histmodelsfile
+
+  removed = set(args.remove)
+  for path in removed.difference(included):
+    parser.error("the video %s is not in the models" % path)
+  known = set(included).union(excluded)
+  todo = [obj for obj in process_train_real if obj.make_path() not in known and obj.make_path() not in removed]
+
+  if args.groupby is not None:
+    expression = re.compile(args.groupby)
+    for obj in todo:
+      match = expression.search(obj.make_path())
+      if match is None:
+        parser.error("the path %s does not match the expression of the groups" % obj.make_path())
+      groups[obj.make_path()] = match.group(1) if expression.groups else match.group(0)
+
+  def accumulate(path, feat, sign):
+    """Adds (sign=1) or subtracts (sign=-1) the histograms of the valid frames of a video to the sums of the models it belongs to"""
+    hist_sum = feat.sum(axis=0, dtype='float64')
+    for key in ((None, groups[path]) if path in groups else (None,)):
+      if key not in sums:
+        sums[key] = [numpy.zeros(hist_sum.shape, 'float64'), 0]
+      sums[key][0] += sign * hist_sum
+      sums[key][1] += sign * feat.shape[0]
+
+  if args.update:
+    print "Updating the models: adding %d videos and removing %d..." % (len(todo), len(removed))
+  else:
+    print "Creating the model..."
+
+  for path in removed:
+    filename = os.path.expanduser(os.path.join(args.inputdir, path + '.hdf5'))
+    if not os.path.exists(filename):
+      parser.error("the features of the removed video %s do not exist" % path)
+    feat = bob.io.base.load(filename)
+    accumulate(path, feat[~numpy.isnan(feat).any(axis=1)], -1)
+
+  # the histograms are summed in a single pass over the videos, so that only the sums are kept in the memory
+  for obj, feat in featurestore.iter_features(args.inputdir, todo, featurestore.store_filename(args.storedir, 'train_real')):
+    accumulate(obj.make_path(), feat, 1)
+
+  included = [path for path in included if path not in removed] + [obj.make_path() for obj in todo]
+  excluded = sorted(removed.union(excluded))
+  if None not in sums or sums[None][1] <= 0:
+    parser.error("there are no valid frames in the real access videos of the models")
+  names = sorted(key for key in sums if key is not None and sums[key][1] > 0) # the groups with no videos left are dropped
+
+  model_sum, model_count = sums[None]
+  model_hist_real = model_sum / model_count # average the model histogram for the real access videos
 
   print "Saving the model histograms..."
-  histmodelsfile = bob.io.base.HDF5File(os.path.join(args.outputdir, 'histmodelsfile.hdf5'),'w')
-  histmodelsfile.append('model_hist_real', numpy.array(model_hist_real))
+  # the models are written into a temporary file first, so that the models being updated are never lost
+  histmodelsfile = bob.io.base.HDF5File(histmodelsname + '.tmp', 'w')
+  histmodelsfile.append('model_hist_real', model_hist_real)
+  histmodelsfile.set('model_sum', model_sum)
+  histmodelsfile.set('model_count', model_count)
+  histmodelsfile.set('included', '\n'.join(included))
+  histmodelsfile.set('excluded', '\n'.join(excluded))
+
+  if names: # the bank of models, one per group of videos
+    print "Saving a bank of %d models..." % len(names)
+    bank_sum = numpy.vstack([sums[name][0] for name in names])
+    bank_count = numpy.array([sums[name][1] for name in names], 'int64')
+    histmodelsfile.set('model_bank', bank_sum / bank_count.reshape(-1, 1)) # the average histogram of each group
+    histmodelsfile.set('model_names', '\n'.join(names))
+    histmodelsfile.set('bank_sum', bank_sum)
+    histmodelsfile.set('bank_count', bank_count)
+    histmodelsfile.set('group_by', args.groupby)
+    histmodelsfile.set('included_groups', '\n'.join(groups[path] for path in included))
 
   del histmodelsfile
- 
+  os.rename(histmodelsname + '.tmp', histmodelsname)
+
 if __name__ == '__main__':
   main()
@@ -21,6 +21,8 @@ import numpy
 from antispoofing.utils.db import *
 from antispoofing.utils.ml import *
 
+from ..helpers import sharding
+
 
 def main():
 
@@ -32,11 +34,19 @@ def main():
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the scores to be loaded')
+  parser.add_argument('--st', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='If given, the features of each split are read from the feature stores in this directory (see mkfeaturestore.py) instead of from the file of each video')
   parser.add_argument('-d', '--output-dir', metavar='DIR', type=str, dest='outputdir', default=OUTPUT_DIR, help='Base directory that will be used to save the results.')
   parser.add_argument('-i', '--infile', type=str, dest='infile', default='res/svm_machine.hdf5', help='File containing the SVM machine and parameters to be loaded')
   parser.add_argument('-s', '--score', dest='score', action='store_true', default=False, help='If set, the final classification scores of all the frames will be dumped in a file')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the frames are distributed for the scoring (defaults to "%(default)s"). The scores are the same whatever the number of processes')
+  parser.add_argument('-a', '--approx', dest='approx', action='store_true', default=False, help='If set, the frames are scored with the approximation of the SVM machine saved in the input file (see the option --approx of svmtrain_lbp.py) instead of with the machine itself')
+  parser.add_argument('--shard', dest='shard', type=sharding.parse_shard, default=None, help='If set as i/n, only the videos of the i-th (counting from 0) out of n shards are loaded and scored, and their scores are written (needs --score). The shards are balanced by the number of frames of the videos. The scores are written as given by the machine and no error rates are computed: when all the shards are finished, run checkshards.py --evaluate on the scores directory, which inverts the scores if needed and computes the error rates from the merged scores')
 
   from ..helpers import score_manipulate as sm
+  from ..helpers import featurestore
+  from ..helpers import chunked
+  from ..spoof import svm
+  from ..spoof import histkernel
 
   #######
   # Database especific configuration
@@ -48,6 +58,9 @@ def main():
   if not os.path.exists(args.inputdir):
     parser.error("input directory does not exist")
 
+  if args.shard is not None and not args.score:
+    parser.error("the shards only write the scores of their videos: --shard needs --score")
+
   if not os.path.exists(args.outputdir): # if the output directory doesn't exist, create it
     bob.io.base.create_directories_safe(args.outputdir)
 
@@ -80,6 +93,23 @@ def main():
   svm_machine = bob.learn.libsvm.Machine(fin)
   fin.cd('/')
 
+  if fin.has_group('histkernel'): # the machine was trained on a precomputed histogram kernel
+    fin.cd('histkernel')
+    kind = fin.read('kind')
+    gamma = fin.read('gamma') if fin.has_dataset('gamma') else None
+    vectors = fin.read('vectors'); coefs = fin.read('coefs'); rho = fin.read('rho')
+    fin.cd('/')
+  else:
+    kind = None
+
+  if args.approx:
+    if not fin.has_group('approx'):
+      parser.error("the input file has no approximation of the SVM machine")
+    fin.cd('approx')
+    fmap = svm.FeatureMap.read(fin)
+    weights = fin.read('weights'); bias = fin.read('bias')
+    fin.cd('/')
+
   print "Loading input files..."
   # loading the input files
   database = args.cls(args)
@@ -87,52 +117,58 @@ def main():
   process_devel_real, process_devel_attack = database.get_devel_data()
   process_test_real, process_test_attack = database.get_test_data()
 
+  if args.shard is not None: # only the videos of the given shard are loaded and scored
+    splits, shardobjects = sharding.shard_splits([process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack], args.shard, sharding.feature_rows(args.inputdir))
+    process_train_real, process_train_attack, process_devel_real, process_devel_attack, process_test_real, process_test_attack = splits
+
   # create the full datasets from the file data
-  train_real = sm.create_full_dataset(args.inputdir, process_train_real); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack); 
-  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack); 
-  test_real = sm.create_full_dataset(args.inputdir, process_test_real); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack); 
-
-  if mins != None and maxs != None:  # normalization in the range [-1, 1] (recommended by LIBSVM)
-    train_real = norm.norm_range(train_real, mins, maxs, -1, 1); train_attack = norm.norm_range(train_attack, mins, maxs, -1, 1)
-    devel_real = norm.norm_range(devel_real, mins, maxs, -1, 1); devel_attack = norm.norm_range(devel_attack, mins, maxs, -1, 1)
-    test_real = norm.norm_range(test_real, mins, maxs, -1, 1); test_attack = norm.norm_range(test_attack, mins, maxs, -1, 1)
-    
-  if mean != None and std != None:  # standard normalization
-    train_real = norm.zeromean_unitvar_norm(train_real, mean, std); train_attack = norm.zeromean_unitvar_norm(train_attack, mean, std)
-    devel_real = norm.zeromean_unitvar_norm(devel_real, mean, std); devel_attack = norm.zeromean_unitvar_norm(devel_attack, mean, std)
-    test_real = norm.zeromean_unitvar_norm(test_real, mean, std); test_attack = norm.zeromean_unitvar_norm(test_attack, mean, std)
-  
-  if pca_machine != None: # PCA dimensionality reduction of the data
-    train_real = pca.pcareduce(pca_machine, train_real); train_attack = pca.pcareduce(pca_machine, train_attack)
-    devel_real = pca.pcareduce(pca_machine, devel_real); devel_attack = pca.pcareduce(pca_machine, devel_attack)
-    test_real = pca.pcareduce(pca_machine, test_real); test_attack = pca.pcareduce(pca_machine, test_attack)
-
-  def svm_predict(svm_machine, data):
-    labels = [svm_machine.predict_class_and_scores(x)[1][0] for x in data]
-    return labels
-  
+  train_real = sm.create_full_dataset(args.inputdir, process_train_real, featurestore.store_filename(args.storedir, 'train_real')); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack, featurestore.store_filename(args.storedir, 'train_attack')); 
+  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real, featurestore.store_filename(args.storedir, 'devel_real')); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack, featurestore.store_filename(args.storedir, 'devel_attack')); 
+  test_real = sm.create_full_dataset(args.inputdir, process_test_real, featurestore.store_filename(args.storedir, 'test_real')); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack, featurestore.store_filename(args.storedir, 'test_attack')); 
+
+  def transform(data):
+    """Applies the normalization and the PCA reduction of the machine file to the data"""
+    if mins is not None and maxs is not None:  # normalization in the range [-1, 1] (recommended by LIBSVM)
+      data = norm.norm_range(data, mins, maxs, -1, 1)
+    if mean is not None and std is not None:  # standard normalization
+      data = norm.zeromean_unitvar_norm(data, mean, std)
+    if pca_machine is not None: # PCA dimensionality reduction of the data
+      data = pca.pcareduce(pca_machine, data)
+    return data
+
+  def score(data):
+    """Transforms and scores the data in chunks, so that no full copy of it is made. The chunks are distributed over the processes, which inherit the SVM machine loaded above"""
+    if data.shape[0] == 0: # a shard may have no video of a split
+      return numpy.zeros((0,), 'float64')
+    if args.approx:
+      return chunked.apply_chunked(lambda x: svm.approx_predict(fmap, weights, bias, transform(x)), data, svm.SVM_CHUNK_BYTES, args.jobs)
+    if kind is not None:
+      return chunked.apply_chunked(lambda x: histkernel.precomputed_predict(kind, gamma, vectors, coefs, rho, transform(x)), data, svm.SVM_CHUNK_BYTES, args.jobs)
+    return chunked.apply_chunked(lambda x: svm.svm_predict(svm_machine, transform(x)), data, svm.SVM_CHUNK_BYTES, args.jobs)
+
   print "Computing devel and test scores..."
-  devel_real_out = svm_predict(svm_machine, devel_real);
-  devel_attack_out = svm_predict(svm_machine, devel_attack);
-  test_real_out = svm_predict(svm_machine, test_real);
-  test_attack_out = svm_predict(svm_machine, test_attack);
-  train_real_out = svm_predict(svm_machine, train_real);
-  train_attack_out = svm_predict(svm_machine, train_attack);
-
-  # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1.
-  if numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
+  devel_real_out = score(devel_real); devel_attack_out = score(devel_attack)
+  test_real_out = score(test_real); test_attack_out = score(test_attack)
+  train_real_out = score(train_real); train_attack_out = score(train_attack)
+
+  # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1. A shard has only some of the devel scores, so the check is made by checkshards.py on the merged scores
+  if args.shard is None and numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
     devel_real_out = devel_real_out * -1; devel_attack_out = devel_attack_out * -1
     test_real_out = test_real_out * -1; test_attack_out = test_attack_out * -1
     train_real_out = train_real_out * -1; train_attack_out = train_attack_out * -1
     
   if args.score: # save the scores in a file
     score_dir = os.path.join(args.outputdir, 'scores') # output directory for the socre files
-    sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1])) 
-    sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]))
-    sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]))
+    sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1]), store=featurestore.store_filename(args.storedir, 'devel_real'))
+    sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'devel_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]), store=featurestore.store_filename(args.storedir, 'test_real'))
+    sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'test_attack'))
+    sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]), store=featurestore.store_filename(args.storedir, 'train_real'))
+    sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'train_attack'))
+    if args.shard is not None: # record the videos whose scores were written by this shard
+      sharding.record_shard(score_dir, args.shard, shardobjects, polarity='devel')
+      print "The error rates are computed by checkshards.py --evaluate when all the shards are finished"
+      return 0
 
   # calculation of the error rates
   thres = bob.measure.eer_threshold(devel_attack_out, devel_real_out)
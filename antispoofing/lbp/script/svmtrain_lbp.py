@@ -13,6 +13,7 @@ The details about the procedure are described in the paper: "On the Effectivenes
 """
 
 import os, sys
+import time
 import argparse
 import bob.io.base
 import bob.learn.libsvm
@@ -22,10 +23,28 @@ import numpy
 from antispoofing.utils.db import *
 from antispoofing.utils.ml import *
 
+# the kernels of the SVM
+KERNELS = ('rbf', 'chi2', 'intersection')
 
-def svm_predict(svm_machine, data):
-  labels = [svm_machine.predict_class_and_scores(x)[1][0] for x in data]
-  return labels
+
+def parse_values(value):
+  """Parses a comma-separated list of positive numbers"""
+  try:
+    values = [float(v) for v in value.split(',')]
+  except ValueError:
+    raise argparse.ArgumentTypeError("%s is not a comma-separated list of numbers" % value)
+  if not values or min(values) <= 0:
+    raise argparse.ArgumentTypeError("the values of %s must be positive" % value)
+  return values
+
+
+def parse_kernels(value):
+  """Parses a comma-separated list of kernels"""
+  kernels = value.split(',')
+  for kernel in kernels:
+    if kernel not in KERNELS:
+      raise argparse.ArgumentTypeError("unknown kernel %s" % kernel)
+  return kernels
 
 
 def main():
@@ -38,6 +57,7 @@ def main():
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-v', '--input-dir', metavar='DIR', type=str, dest='inputdir', default=INPUT_DIR, help='Base directory containing the scores to be loaded')
+  parser.add_argument('--st', '--store-dir', metavar='DIR', type=str, dest='storedir', default=None, help='If given, the features of each split are read from the feature stores in this directory (see mkfeaturestore.py) instead of from the file of each video')
   parser.add_argument('-d', '--output-dir', metavar='DIR', type=str, dest='outputdir', default=OUTPUT_DIR, help='Base directory that will be used to save the results.')
   parser.add_argument('--mn', '--min-max-normalize', action='store_true', dest='min_max_normalize', default=False, help='If True, will do normalization on the data between [-1, 1] before training the SVM machine')
   parser.add_argument('--sn', '--std-normalize', action='store_true', dest='std_normalize', default=False, help='If True, will do standard normalization on the data before training the SVM machine')
@@ -45,8 +65,36 @@ def main():
   parser.add_argument('-e', '--energy', type=str, dest="energy", default='0.99', help='The energy which needs to be preserved after the dimensionality reduction if PCA is performed prior to SVM training')
   parser.add_argument('--eval', dest='eval', action='store_true', default=False, help='If set, evaluation will be performed using the trained SVM')
   parser.add_argument('-s', '--score', dest='score', action='store_true', default=False, help='If set, the final classification scores of all the frames will be dumped in a file')
+  parser.add_argument('-k', '--kernel', dest='kernel', type=str, default='rbf', choices=KERNELS, help='The kernel of the SVM (defaults to "%(default)s"). The exponential chi-square (chi2) and histogram intersection kernels are computed on the histograms and given to LIBSVM as a precomputed kernel matrix, which needs the memory for the square of the number of training frames. They need non-negative features, so they can not be combined with the normalizations or PCA')
+  parser.add_argument('-c', '--cost', dest='cost', type=float, default=None, help='The cost parameter C of the SVM (defaults to the one of LIBSVM)')
+  parser.add_argument('-g', '--gamma', dest='gamma', type=float, default=None, help='The parameter gamma of the rbf and chi2 kernels (defaults to the one of LIBSVM for rbf, and to the inverse of the average chi-square distance between the training frames for chi2)')
+  parser.add_argument('--kc', '--kernel-cache', metavar='DIR', type=str, dest='kernelcache', default=None, help='The directory where the kernel matrices of the training frames are cached, so that they are computed only once for all the runs on the same features, for example with different costs (defaults to the "kernels" subdirectory of the output directory)')
+  parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='The number of processes among which the rows of the kernel matrix, or the machines of the search, are distributed (defaults to "%(default)s")')
+  parser.add_argument('--search', dest='search', type=str, default=None, choices=('grid', 'random'), help='If set, SVM machines with different kernels, costs and gammas are compared by a cross-validation on the training set (see --search-folds), and the one with the lowest HTER at the EER threshold of the scores of the held-out frames is kept and trained on the whole training set. The devel set is not used by the search. The data is loaded and transformed only once, and the machines are trained by --jobs processes sharing it. The results of all the machines are written in search_report.txt')
+  parser.add_argument('--search-kernels', dest='search_kernels', type=parse_kernels, default=None, help='The comma-separated kernels of the search (defaults to the one of --kernel)')
+  parser.add_argument('--search-costs', dest='search_costs', type=parse_values, default=[0.1, 1, 10, 100], help='The comma-separated costs of the grid search. The random search draws the costs between the smallest and the largest of them (defaults to "0.1,1,10,100")')
+  parser.add_argument('--search-gammas', dest='search_gammas', type=parse_values, default=[0.25, 1, 4], help='The comma-separated gammas of the grid search, as factors of the default gamma of each kernel (see --gamma). The random search draws the factors between the smallest and the largest of them (defaults to "0.25,1,4")')
+  parser.add_argument('--search-folds', dest='search_folds', type=int, default=5, help='The number of folds of the cross-validation of the search. The training videos are split into folds, each machine is trained once on the frames out of each fold and scores the frames of the fold (defaults to "%(default)s")')
+  parser.add_argument('--search-group-by', dest='search_groupby', type=str, default=None, help='If given, the videos of the same group are in the same fold of the cross-validation of the search. The groups are given by this regular expression, searched in the path of each video (as for the --group-by option of mkhistmodel.py). For example, "client(\\d+)" keeps all the real accesses and attacks of each client of Replay-Attack in the same fold. By default, each video is in its own group, and the frames of a video are never split between folds')
+  parser.add_argument('--search-trials', dest='search_trials', type=int, default=20, help='The number of machines of the random search (defaults to "%(default)s")')
+  parser.add_argument('--dc', '--decimate', dest='decimate', type=str, default=None, choices=('cap', 'stride', 'kmeans'), help='If set, only some of the frames of each training video are used to train the SVM: at most --decimate-amount frames evenly spread in time (cap), one frame out of --decimate-amount (stride), or the frames the closest to the centers of --decimate-amount k-means clusters of the frames (kmeans). The chosen frames are recorded in the output file')
+  parser.add_argument('--da', '--decimate-amount', dest='decimate_amount', type=int, default=None, help='The number of frames per video (cap and kmeans) or the stride (stride) of the decimation')
+  parser.add_argument('--bal', '--balance', dest='balance', action='store_true', default=False, help='If set, the same number of training frames is used for the real accesses and the attacks, evenly spread over the (decimated) frames of the larger class')
+  parser.add_argument('--ds', '--decimate-seed', dest='decimate_seed', type=int, default=0, help='The seed of the random numbers of the decimation (defaults to "%(default)s")')
+  parser.add_argument('--ap', '--approx', dest='approx', type=str, default=None, choices=('rff', 'nystroem'), help='If set, an approximation of the SVM machine is also made and saved with it: an explicit map of the RBF kernel (random Fourier features, or the Nystroem approximation on the support vectors) and a linear model distilled on the training data. Its error rates are compared to the ones of the machine in approx_fidelity.txt')
+  parser.add_argument('--ad', '--approx-dim', dest='approx_dim', type=int, default=1000, help='The dimension of the map of the approximation (defaults to "%(default)s")')
+  parser.add_argument('--as', '--approx-samples', dest='approx_samples', type=int, default=20000, help='The number of training frames, drawn at random, on which the linear model of the approximation is distilled (defaults to "%(default)s")')
 
   from ..helpers import score_manipulate as sm
+  from ..helpers import featurestore
+  from ..helpers import chunked
+  from ..helpers import kernelcache
+  from ..helpers import parallel
+  from ..helpers import decimate
+  from ..helpers import crossval
+  from ..spoof import svm
+  from ..spoof import histkernel
+  from ..spoof.svm import svm_predict
 
   #######
   # Database especific configuration
@@ -61,6 +109,24 @@ def main():
   if not os.path.exists(args.outputdir): # if the output directory doesn't exist, create it
     bob.io.base.create_directories_safe(args.outputdir)
 
+  if args.decimate is not None and (args.decimate_amount is None or args.decimate_amount < 1):
+    parser.error("the decimation needs a positive --decimate-amount")
+
+  if args.search and args.search_folds < 2:
+    parser.error("the cross-validation of the search needs at least 2 folds")
+
+  if args.search_kernels is None:
+    args.search_kernels = [args.kernel]
+
+  for kernel in (args.search_kernels if args.search else [args.kernel]):
+    if kernel != 'rbf' and (args.min_max_normalize or args.std_normalize or args.pca_reduction):
+      parser.error("the %s kernel needs non-negative histograms: it can not be combined with the normalizations or PCA" % kernel)
+    if kernel != 'rbf' and args.approx:
+      parser.error("the approximation is only possible for an SVM machine with an rbf kernel, not %s" % kernel)
+
+  if args.kernelcache is None:
+    args.kernelcache = os.path.join(args.outputdir, 'kernels')
+
   energy = float(args.energy)
 
   # Setting the output file
@@ -75,38 +141,191 @@ def main():
   process_test_real, process_test_attack = database.get_test_data()
   
   # create the full datasets from the file data
-  train_real = sm.create_full_dataset(args.inputdir, process_train_real); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack); 
-  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack); 
-  test_real = sm.create_full_dataset(args.inputdir, process_test_real); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack); 
+  train_real = sm.create_full_dataset(args.inputdir, process_train_real, featurestore.store_filename(args.storedir, 'train_real')); train_attack = sm.create_full_dataset(args.inputdir, process_train_attack, featurestore.store_filename(args.storedir, 'train_attack')); 
+  devel_real = sm.create_full_dataset(args.inputdir, process_devel_real, featurestore.store_filename(args.storedir, 'devel_real')); devel_attack = sm.create_full_dataset(args.inputdir, process_devel_attack, featurestore.store_filename(args.storedir, 'devel_attack')); 
+  test_real = sm.create_full_dataset(args.inputdir, process_test_real, featurestore.store_filename(args.storedir, 'test_real')); test_attack = sm.create_full_dataset(args.inputdir, process_test_attack, featurestore.store_filename(args.storedir, 'test_attack')); 
+
+  full_train_real = train_real; full_train_attack = train_attack # all the training frames, which are scored even if only some of them are used for the training
+  if args.decimate is not None or args.balance or args.search: # the videos and frames of the training frames are needed
+    index_real = decimate.frame_index(args.inputdir, process_train_real, featurestore.store_filename(args.storedir, 'train_real')); index_attack = decimate.frame_index(args.inputdir, process_train_attack, featurestore.store_filename(args.storedir, 'train_attack'))
+    if len(index_real.row_object) != len(train_real) or len(index_attack.row_object) != len(train_attack):
+      parser.error("the valid frames of the training videos do not match their features: compute the features (or the stores) again")
+  rows_real = numpy.arange(len(train_real)); rows_attack = numpy.arange(len(train_attack)) # the rows of the index of each class which are used for the training
+  if args.decimate is not None or args.balance: # only some of the training frames are kept
+    print "Decimating the training frames..."
+    rows_real, rows_attack = decimate.decimate_rows([train_real, train_attack], [index_real, index_attack], args.decimate, args.decimate_amount, args.balance, args.decimate_seed)
+    print "...keeping %d out of %d real access frames and %d out of %d attack frames" % (len(rows_real), len(train_real), len(rows_attack), len(train_attack))
+    train_real = train_real[rows_real]; train_attack = train_attack[rows_attack]
+    # the kept frames are recorded as the videos (in the order of the paths) and the frames they come from
+    fout.create_group('decimation')
+    fout.cd('decimation')
+    fout.set('strategy', args.decimate if args.decimate is not None else 'none')
+    fout.set('amount', args.decimate_amount if args.decimate_amount is not None else 0)
+    fout.set('balance', int(args.balance))
+    fout.set('seed', args.decimate_seed)
+    for name, index, rows in (('train_real', index_real, rows_real), ('train_attack', index_attack, rows_attack)):
+      fout.set(name + '_paths', '\n'.join(index.paths))
+      fout.set(name + '_videos', index.row_object[rows])
+      fout.set(name + '_frames', index.row_frame[rows])
+    fout.cd('/')
+
+  mins = None; maxs = None; mean = None; std = None; pca_machine = None
+
+  def transform(data):
+    """Applies the normalization and the PCA reduction to the data of the devel and test sets"""
+    if mins is not None:
+      data = norm.norm_range(data, mins, maxs, -1, 1)
+    if mean is not None:
+      data = norm.zeromean_unitvar_norm(data, mean, std)
+    if pca_machine is not None:
+      data = pca.pcareduce(pca_machine, data)
+    return data
 
+  # the training data is transformed step by step, as each step is computed on the output of the previous one. The devel and test data are transformed in chunks only when they are scored, so that no full copy of them is made
   if args.min_max_normalize:  # normalization in the range [-1, 1] (recommended by LIBSVM)
     print "Running min max normalization in range[-1, 1]..."
-    train_data = numpy.concatenate((train_real, train_attack), axis=0) 
-    mins, maxs = norm.calc_min_max(train_data)
-    train_real = norm.norm_range(train_real, mins, maxs, -1, 1); train_attack = norm.norm_range(train_attack, mins, maxs, -1, 1)
-    devel_real = norm.norm_range(devel_real, mins, maxs, -1, 1); devel_attack = norm.norm_range(devel_attack, mins, maxs, -1, 1)
-    test_real = norm.norm_range(test_real, mins, maxs, -1, 1); test_attack = norm.norm_range(test_attack, mins, maxs, -1, 1)
+    mins, maxs = chunked.min_max([train_real, train_attack])
+    train_real = chunked.apply_chunked(lambda x: norm.norm_range(x, mins, maxs, -1, 1), train_real); train_attack = chunked.apply_chunked(lambda x: norm.norm_range(x, mins, maxs, -1, 1), train_attack)
     
   if args.std_normalize: 
     print "Running standard normalization..."
-    train_data = numpy.concatenate((train_real, train_attack), axis=0) 
-    mean, std = norm.calc_mean_std(train_data, nonStdZero = True)
-    train_real = norm.zeromean_unitvar_norm(train_real, mean, std); train_attack = norm.zeromean_unitvar_norm(train_attack, mean, std)
-    devel_real = norm.zeromean_unitvar_norm(devel_real, mean, std); devel_attack = norm.zeromean_unitvar_norm(devel_attack, mean, std)
-    test_real = norm.zeromean_unitvar_norm(test_real, mean, std); test_attack = norm.zeromean_unitvar_norm(test_attack, mean, std)
+    mean, std = chunked.mean_std([train_real, train_attack], nonStdZero = True)
+    train_real = chunked.apply_chunked(lambda x: norm.zeromean_unitvar_norm(x, mean, std), train_real); train_attack = chunked.apply_chunked(lambda x: norm.zeromean_unitvar_norm(x, mean, std), train_attack)
   
   if args.pca_reduction: # PCA dimensionality reduction of the data
     print "Running PCA reduction..."
     train=numpy.append(train_real, train_attack, axis=0)
     pca_machine = pca.make_pca(train, energy, cov=True) # performing PCA
-    train_real = pca.pcareduce(pca_machine, train_real); train_attack = pca.pcareduce(pca_machine, train_attack)
-    devel_real = pca.pcareduce(pca_machine, devel_real); devel_attack = pca.pcareduce(pca_machine, devel_attack)
-    test_real = pca.pcareduce(pca_machine, test_real); test_attack = pca.pcareduce(pca_machine, test_attack)
+    del train
+    train_real = chunked.apply_chunked(lambda x: pca.pcareduce(pca_machine, x), train_real); train_attack = chunked.apply_chunked(lambda x: pca.pcareduce(pca_machine, x), train_attack)
+
+  bases = {} # the base matrices of the histogram kernels of the training frames (see histkernel.histbase)
+
+  def kernel_base(kernel):
+    """Returns the base matrix of a histogram kernel of the training frames, from the cache if it was already computed"""
+    if kernel not in bases:
+      train = numpy.append(train_real, train_attack, axis=0)
+      print "Computing the %s kernel of the %d training frames..." % (kernel, len(train))
+      bases[kernel] = kernelcache.cached_matrix(args.kernelcache, kernel, train, lambda x, train=train: histkernel.histbase(kernel, train, x), args.jobs, svm.SVM_CHUNK_BYTES)
+    return bases[kernel]
+
+  def default_gamma(kernel):
+    """Returns the default parameter gamma of a kernel: the one of LIBSVM (the inverse of the number of features) for rbf, see histkernel.default_gamma for the others"""
+    if kernel == 'rbf':
+      return 1. / train_real.shape[1]
+    return histkernel.default_gamma(kernel, kernel_base(kernel))
+
+  def train_machine(kernel, cost, gamma, probability=True, rows=None):
+    """Trains an SVM machine on the training frames, or only on the given (sorted) rows of the training frames of both classes one after another (the real accesses first). Returns the tuple (svm_machine, predict, model), where predict is the function scoring (transformed) frames with the machine and model is None for rbf, and the tuple (vectors, coefs, rho) of the support vectors for the histogram kernels (see svm.precomputed_model)"""
+    svm_trainer = bob.learn.libsvm.Trainer()
+    svm_trainer.probability = probability
+    if cost is not None:
+      svm_trainer.cost = cost
+    if rows is None:
+      real = train_real; attack = train_attack
+    else:
+      real = train_real[rows[rows < len(train_real)]]; attack = train_attack[rows[rows >= len(train_real)] - len(train_real)]
+    if kernel == 'rbf':
+      if gamma is not None:
+        svm_trainer.gamma = gamma
+      svm_machine = svm_trainer.train([real, attack])
+      return svm_machine, lambda data: svm_predict(svm_machine, data), None
+    # precomputed histogram kernel
+    base = kernel_base(kernel)
+    if rows is not None: # the kernel of the given rows with themselves
+      base = base[numpy.ix_(rows, rows)]
+    inputs = histkernel.precomputed_inputs(kernel, base, gamma)
+    svm_trainer.kernel_type = 'PRECOMPUTED'
+    svm_machine = svm_trainer.train([inputs[:len(real)], inputs[len(real):]])
+    del inputs, base
+    samples, coefs, rho = svm.precomputed_model(svm_machine)
+    vectors = numpy.ndarray((len(samples), real.shape[1]), 'float64') # the histograms of the support vectors, the only ones the kernel is computed with to score new frames
+    isreal = samples < len(real)
+    vectors[isreal] = real[samples[isreal]]; vectors[~isreal] = attack[samples[~isreal] - len(real)]
+    return svm_machine, lambda data: histkernel.precomputed_predict(kernel, gamma, vectors, coefs, rho, data), (vectors, coefs, rho)
+
+  gamma = args.gamma
+  if args.search: # search of the kernel, the cost and gamma with the best EER of the cross-validation on the training set
+    rng = numpy.random.RandomState(0)
+    candidates = []
+    if args.search == 'grid':
+      for kernel in args.search_kernels:
+        for cost in args.search_costs:
+          for factor in ([None] if kernel == 'intersection' else args.search_gammas):
+            candidates.append((kernel, cost, factor))
+    else:
+      for trial in range(args.search_trials): # log-uniform in the ranges of the given costs and gammas
+        kernel = args.search_kernels[rng.randint(len(args.search_kernels))]
+        cost = 10 ** rng.uniform(numpy.log10(min(args.search_costs)), numpy.log10(max(args.search_costs)))
+        factor = 10 ** rng.uniform(numpy.log10(min(args.search_gammas)), numpy.log10(max(args.search_gammas)))
+        candidates.append((kernel, cost, None if kernel == 'intersection' else factor))
+    # the default gammas (and the kernel matrices they need) are computed before the processes are forked, so that they share them
+    defaults = dict((kernel, default_gamma(kernel)) for kernel in args.search_kernels)
+    candidates = [(kernel, cost, None if factor is None else factor * defaults[kernel]) for (kernel, cost, factor) in candidates]
+    # the folds of the training frames: all the frames of a video, or of a group of videos, are in the same fold
+    try:
+      groups_real = crossval.video_groups(index_real.paths, args.search_groupby); groups_attack = crossval.video_groups(index_attack.paths, args.search_groupby)
+      fold_of = crossval.assign_folds(groups_real + groups_attack, args.search_folds)
+    except ValueError as e:
+      parser.error(str(e))
+    folds = numpy.append(crossval.row_folds(index_real, rows_real, groups_real, fold_of), crossval.row_folds(index_attack, rows_attack, groups_attack, fold_of))
+    labels = numpy.arange(len(folds)) < len(train_real) # True for the real accesses
+    for fold in range(args.search_folds):
+      if labels[folds != fold].all() or not labels[folds != fold].any():
+        parser.error("the training frames out of the fold %d are all of the same class: use fewer folds or other groups" % fold)
+
+    def evaluate(item):
+      """Trains a machine with the parameters of a candidate on the training frames out of a fold, and returns the scores of the frames of the fold and the number of support vectors of the machine"""
+      (kernel, cost, cgamma), fold = item
+      svm_machine, predict, model = train_machine(kernel, cost, cgamma, False, numpy.flatnonzero(folds != fold))
+      held = numpy.flatnonzero(folds == fold)
+      data = numpy.append(train_real[held[held < len(train_real)]], train_attack[held[held >= len(train_real)] - len(train_real)], axis=0)
+      if len(data) == 0:
+        return numpy.zeros((0,), 'float64'), sum(svm_machine.n_support_vectors)
+      return chunked.apply_chunked(predict, data, svm.SVM_CHUNK_BYTES), sum(svm_machine.n_support_vectors)
+
+    print "Searching the best of %d SVM machines by %d-fold cross-validation on the training set..." % (len(candidates), args.search_folds)
+    items = [(candidate, fold) for candidate in candidates for fold in range(args.search_folds)]
+    outputs = parallel.fork_map(evaluate, items, args.jobs)
+    results = []
+    for k in range(len(candidates)): # the HTER of each candidate at the EER threshold of the scores of all the held-out frames
+      scores = numpy.ndarray((len(folds),), 'float64')
+      nsv = []
+      for fold in range(args.search_folds):
+        out, n = outputs[k * args.search_folds + fold]
+        scores[folds == fold] = out
+        nsv.append(n)
+      real_out = scores[labels]; attack_out = scores[~labels]
+      if numpy.mean(real_out) < numpy.mean(attack_out):
+        real_out = real_out * -1; attack_out = attack_out * -1
+      thres = bob.measure.eer_threshold(attack_out, real_out)
+      far, frr = bob.measure.farfrr(attack_out, real_out, thres)
+      results.append((50*(far+frr), numpy.mean(nsv)))
+    best = min(range(len(candidates)), key=lambda k: results[k][0])
+    tbl = []
+    tbl.append(" ")
+    tbl.append(" %s search of %d SVM machines, selected on the HTER at the EER threshold of a %d-fold cross-validation on the training set" % (args.search, len(candidates), args.search_folds))
+    for k, ((kernel, cost, cgamma), (hter, nsv)) in enumerate(zip(candidates, results)):
+      tbl.append("%s %-12s C %-10.4g gamma %-10s | cv HTER %.2f%% | %.0f support vectors (mean over the folds)" % ('*' if k == best else ' ', kernel, cost, '-' if cgamma is None else '%.4g' % cgamma, hter, nsv))
+    txt = ''.join([k+'\n' for k in tbl])
+
+    print txt
+
+    tf = open(os.path.join(args.outputdir, 'search_report.txt'), 'w')
+    tf.write(txt)
+    tf.close()
+
+    args.kernel, args.cost, gamma = candidates[best]
+
+  if args.kernel != 'rbf' and gamma is None:
+    gamma = default_gamma(args.kernel)
 
   print "Training SVM machine..."
-  svm_trainer = bob.learn.libsvm.Trainer()
-  svm_trainer.probability = True
-  svm_machine = svm_trainer.train([train_real, train_attack])
+  start = time.time()
+  svm_machine, predict, model = train_machine(args.kernel, args.cost, gamma)
+  print "...trained on %d frames in %.1f seconds" % (len(train_real) + len(train_attack), time.time() - start)
+  if model is not None:
+    vectors, coefs, rho = model
   
   sys.stdout.write("...saving parameters...\n")   
   if args.min_max_normalize: 
@@ -132,16 +351,76 @@ def main():
   fout.cd('svm_machine')
   svm_machine.save(fout)
   fout.cd('/')
+
+  if args.kernel != 'rbf':
+    fout.create_group('histkernel')
+    fout.cd('histkernel')
+    fout.set('kind', args.kernel)
+    if gamma is not None:
+      fout.set('gamma', gamma)
+    fout.set('vectors', vectors)
+    fout.set('coefs', coefs)
+    fout.set('rho', rho)
+    fout.cd('/')
   
-  if args.eval:
-    
+  if args.eval or args.approx:
     print "Computing devel and test scores..."
-    devel_real_out = svm_predict(svm_machine, devel_real);
-    devel_attack_out = svm_predict(svm_machine, devel_attack);
-    test_real_out = svm_predict(svm_machine, test_real);
-    test_attack_out = svm_predict(svm_machine, test_attack);
-    train_real_out = svm_predict(svm_machine, train_real);
-    train_attack_out = svm_predict(svm_machine, train_attack);
+    devel_real_out = chunked.apply_chunked(lambda x: predict(transform(x)), devel_real, svm.SVM_CHUNK_BYTES);
+    devel_attack_out = chunked.apply_chunked(lambda x: predict(transform(x)), devel_attack, svm.SVM_CHUNK_BYTES);
+    test_real_out = chunked.apply_chunked(lambda x: predict(transform(x)), test_real, svm.SVM_CHUNK_BYTES);
+    test_attack_out = chunked.apply_chunked(lambda x: predict(transform(x)), test_attack, svm.SVM_CHUNK_BYTES);
+
+  if args.approx:
+    print "Making the %s approximation of the SVM machine..." % args.approx
+    if args.approx == 'rff':
+      fmap = svm.FeatureMap.random_fourier(svm_machine, args.approx_dim)
+    else:
+      fmap = svm.FeatureMap.nystroem(svm_machine, args.approx_dim)
+    rows = numpy.sort(numpy.random.RandomState(0).permutation(len(train_real) + len(train_attack))[:args.approx_samples]) # the training frames on which the approximation is distilled
+    train = numpy.append(train_real[rows[rows < len(train_real)]], train_attack[rows[rows >= len(train_real)] - len(train_real)], axis=0)
+    weights, bias = svm.distill(fmap, train, chunked.apply_chunked(predict, train, svm.SVM_CHUNK_BYTES))
+    del train
+    fout.create_group('approx')
+    fout.cd('approx')
+    fmap.save(fout)
+    fout.set('weights', weights)
+    fout.set('bias', bias)
+    fout.cd('/')
+
+    def approx_score(data):
+      return chunked.apply_chunked(lambda x: svm.approx_predict(fmap, weights, bias, transform(x)), data, svm.SVM_CHUNK_BYTES)
+
+    def error_rates(devel_real_scores, devel_attack_scores, test_real_scores, test_attack_scores):
+      """Returns the sign which makes the scores of the real accesses higher than the ones of the attacks, the EER threshold on the devel set and the HTER of the devel and test sets"""
+      sign = -1 if numpy.mean(devel_real_scores) < numpy.mean(devel_attack_scores) else 1
+      thres = bob.measure.eer_threshold(sign * devel_attack_scores, sign * devel_real_scores)
+      dev_far, dev_frr = bob.measure.farfrr(sign * devel_attack_scores, sign * devel_real_scores, thres)
+      test_far, test_frr = bob.measure.farfrr(sign * test_attack_scores, sign * test_real_scores, thres)
+      return sign, thres, 50*(dev_far+dev_frr), 50*(test_far+test_frr)
+
+    exact_out = [devel_real_out, devel_attack_out, test_real_out, test_attack_out]
+    approx_out = [approx_score(data) for data in (devel_real, devel_attack, test_real, test_attack)]
+    exact_rates = error_rates(*exact_out)
+    approx_rates = error_rates(*approx_out)
+    exact_test = numpy.concatenate(exact_out[2:]); approx_test = numpy.concatenate(approx_out[2:])
+    agreement = numpy.mean((exact_rates[0] * exact_test >= exact_rates[1]) == (approx_rates[0] * approx_test >= approx_rates[1])) # the same decisions at the thresholds of each model
+    tbl = []
+    tbl.append(" ")
+    tbl.append(" approximation: %s, %d dimensions, %d support vectors" % (args.approx, len(weights), sum(svm_machine.n_support_vectors)))
+    tbl.append(" exact:  threshold %.4f | dev HTER %.2f%% | test HTER %.2f%% " % exact_rates[1:])
+    tbl.append(" approx: threshold %.4f | dev HTER %.2f%% | test HTER %.2f%% " % approx_rates[1:])
+    tbl.append(" correlation of the devel and test scores: %.4f" % numpy.corrcoef(numpy.concatenate(exact_out), numpy.concatenate(approx_out))[0, 1])
+    tbl.append(" same decisions on the test set: %.2f%%" % (100 * agreement))
+    txt = ''.join([k+'\n' for k in tbl])
+
+    print txt
+
+    with open(os.path.join(args.outputdir, 'approx_fidelity.txt'), 'w') as tf:
+      tf.write(txt)
+
+  if args.eval:
+    train_real_out = chunked.apply_chunked(lambda x: predict(transform(x)), full_train_real, svm.SVM_CHUNK_BYTES); # one score per valid frame, as map_scores expects
+    train_attack_out = chunked.apply_chunked(lambda x: predict(transform(x)), full_train_attack, svm.SVM_CHUNK_BYTES);
 
     # it is expected that the scores of the real accesses are always higher then the scores of the attacks. Therefore, a check is first made, if the average of the scores of real accesses is smaller then the average of the scores of the attacks, all the scores are inverted by multiplying with -1.
     if numpy.mean(devel_real_out) < numpy.mean(devel_attack_out):
@@ -151,12 +430,12 @@ def main():
     
     if args.score: # save the scores in a file
       score_dir = os.path.join(args.outputdir, 'scores') # output directory for the socre files
-      sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1])) 
-      sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]))
-      sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]))
-      sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]))
-      sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]))
-      sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]))
+      sm.map_scores(args.inputdir, score_dir, process_devel_real, numpy.reshape(devel_real_out, [len(devel_real_out), 1]), store=featurestore.store_filename(args.storedir, 'devel_real')) 
+      sm.map_scores(args.inputdir, score_dir, process_devel_attack, numpy.reshape(devel_attack_out, [len(devel_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'devel_attack'))
+      sm.map_scores(args.inputdir, score_dir, process_test_real, numpy.reshape(test_real_out, [len(test_real_out), 1]), store=featurestore.store_filename(args.storedir, 'test_real'))
+      sm.map_scores(args.inputdir, score_dir, process_test_attack, numpy.reshape(test_attack_out, [len(test_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'test_attack'))
+      sm.map_scores(args.inputdir, score_dir, process_train_real, numpy.reshape(train_real_out, [len(train_real_out), 1]), store=featurestore.store_filename(args.storedir, 'train_real'))
+      sm.map_scores(args.inputdir, score_dir, process_train_attack, numpy.reshape(train_attack_out, [len(train_attack_out), 1]), store=featurestore.store_filename(args.storedir, 'train_attack'))
   
     thres = bob.measure.eer_threshold(devel_attack_out, devel_real_out)
     dev_far, dev_frr = bob.measure.farfrr(devel_attack_out, devel_real_out, thres)
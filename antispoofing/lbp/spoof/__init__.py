@@ -1,2 +1,6 @@
 from .calclbp import *
+from .batchlbp import *
+from .normface import *
 from .chi2 import *
+from .svm import *
+from .histkernel import *
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""Vectorized computation of LBP codes and histograms over stacks of equally sized gray-scale images (for example, all the normalized faces of a video), using numpy only. The codes follow the conventions of the bob LBP operator: the first sampling point gives the most significant bit, a neighbour sets its bit if it is greater than or close to the compared value and the non-uniform patterns get the label 0 in the uniform and riu2 variants
+"""
+
+import numpy
+import math
+
+# lookup tables, keyed by (lbptype, neighbors)
+_luts = {}
+
+def _is_uniform(code, neighbors):
+  """Returns True if the circular binary pattern has at most two 0/1 transitions"""
+  rotated = ((code >> 1) | ((code & 1) << (neighbors - 1)))
+  return bin(code ^ rotated).count('1') <= 2
+
+
+def lbp_lut(lbptype, neighbors=8):
+  """Returns the lookup table which maps the raw LBP codes into labels, together with the number of labels
+
+  Keyword Parameters:
+
+  lbptype
+    The type of the LBP operator (regular, uniform or riu2)
+  neighbors
+    The number of points around the central point on which LBP is computed (4, 8, 16)
+  """
+  key = (lbptype, neighbors)
+  if key not in _luts:
+    numcodes = 1 << neighbors
+    if lbptype == 'uniform':
+      lut = numpy.zeros((numcodes,), 'uint16')
+      label = 1
+      for code in range(numcodes):
+        if _is_uniform(code, neighbors):
+          lut[code] = label
+          label += 1
+      max_label = label
+    elif lbptype == 'riu2':
+      lut = numpy.zeros((numcodes,), 'uint16')
+      for code in range(numcodes):
+        if _is_uniform(code, neighbors):
+          lut[code] = bin(code).count('1') + 1
+      max_label = neighbors + 2
+    else: # regular LBP
+      lut = numpy.arange(numcodes, dtype='uint16')
+      max_label = numcodes
+    _luts[key] = (lut, max_label)
+  return _luts[key]
+
+
+def _sampling_points(radius, neighbors, circ):
+  """Returns the list of (dy, dx) offsets of the sampling points and the size of the border which is lost around the image. The points are in the order of the bob LBP operator: the circular ones start at the top left (at the top for 4 neighbors), like the square ones, and go clockwise"""
+  if circ:
+    offset = -0.5 * math.pi if neighbors == 4 else -0.75 * math.pi # the angle of the first point, as in bob
+    points = []
+    for p in range(neighbors):
+      angle = offset + 2. * math.pi * p / neighbors
+      points.append((round(radius * math.sin(angle), 10), round(radius * math.cos(angle), 10)))
+    return points, int(math.ceil(radius))
+  r = int(radius)
+  if neighbors == 4:
+    return [(-r, 0), (0, r), (r, 0), (0, -r)], r
+  if neighbors == 8:
+    return [(-r, -r), (-r, 0), (-r, r), (0, r), (r, r), (r, 0), (r, -r), (0, -r)], r
+  raise ValueError("non-circular LBP supports only 4 or 8 neighbors, not %d" % neighbors)
+
+
+def _sample(stack, dy, dx, border, shape):
+  """Samples the stack at the given offset from all the central points, using bilinear interpolation for non-integer offsets"""
+  h, w = shape
+  y0 = int(math.floor(dy)); x0 = int(math.floor(dx))
+  fy = dy - y0; fx = dx - x0
+  top = border + y0; left = border + x0
+  sampled = stack[:, top:top+h, left:left+w].astype('float64')
+  if fy == 0 and fx == 0:
+    return sampled
+  sampled *= (1 - fy) * (1 - fx)
+  if fx != 0:
+    sampled += fx * (1 - fy) * stack[:, top:top+h, left+1:left+1+w]
+  if fy != 0:
+    sampled += fy * (1 - fx) * stack[:, top+1:top+1+h, left:left+w]
+    if fx != 0:
+      sampled += fy * fx * stack[:, top+1:top+1+h, left+1:left+1+w]
+  return sampled
+
+
+def lbp_codes(stack, lbptype, elbptype='regular', radius=1, neighbors=8, circ=False):
+  """Calculates the LBP code images of a stack of images. Returns an (N, H - 2*border, W - 2*border) uint16 array, where border is the (rounded up) radius
+
+  Keyword Parameters:
+
+  stack
+    3D array (N, H, W) of gray-scale images, or a single 2D image
+  lbptype
+    The type of the LBP operator (regular, uniform or riu2)
+  elbptype
+    The type of extended version of LBP (only regular and modified are supported)
+  radius
+    The radius of the circle on which the points are taken (for circular LBP)
+  neighbors
+    The number of points around the central point on which LBP is computed (4, 8, 16)
+  circ
+    True if circular LBP is needed, False otherwise
+  """
+  if elbptype not in ('regular', 'modified'):
+    raise ValueError("the numpy LBP engine does not support the '%s' extended LBP, use the bob operator instead" % elbptype)
+  stack = numpy.asarray(stack)
+  if stack.ndim == 2:
+    stack = stack[numpy.newaxis]
+  points, border = _sampling_points(radius, neighbors, circ)
+  shape = (stack.shape[1] - 2 * border, stack.shape[2] - 2 * border)
+  if shape[0] <= 0 or shape[1] <= 0:
+    raise ValueError("images of size %s are too small for LBP with radius %s" % (stack.shape[1:], radius))
+
+  samples = [_sample(stack, dy, dx, border, shape) for (dy, dx) in points]
+  cmp_point = stack[:, border:border+shape[0], border:border+shape[1]].astype('float64')
+  if elbptype == 'modified': # compare to the average of the neighbourhood, including the central point
+    for s in samples:
+      cmp_point += s
+    cmp_point /= (neighbors + 1)
+
+  codes = numpy.zeros((stack.shape[0],) + shape, 'uint32')
+  for s in samples:
+    codes <<= 1
+    codes |= (s > cmp_point) | numpy.isclose(s, cmp_point) # as in bob: the interpolated samples are not exact, so a sample equal to the compared value up to the rounding errors sets its bit
+  lut, _ = lbp_lut(lbptype, neighbors)
+  return lut[codes]
+
+
+def lbphist_batch(stack, lbptype, elbptype='regular', radius=1, neighbors=8, circ=False, numbl=1, overlap=False, exact=True):
+  """Calculates the normalized LBP histograms of a stack of images at once, by blocks or on the full images. Returns an (N, numbl*numbl*bins) float64 array with one (concatenated) histogram per image
+
+  Keyword Parameters:
+
+  stack
+    3D array (N, H, W) of gray-scale images
+  lbptype
+    The type of the LBP operator (regular, uniform or riu2)
+  elbptype
+    The type of extended version of LBP (only regular and modified are supported)
+  radius
+    The radius of the circle on which the points are taken (for circular LBP)
+  neighbors
+    The number of points around the central point on which LBP is computed (4, 8, 16)
+  circ
+    True if circular LBP is needed, False otherwise
+  numbl
+    Square root of the number of blocks the images are to be divided into (ex. 9 blocks => numbl = 3)
+  overlap
+    True for overlapping blocks (hardcoded to 16 pixels overlap, as in divideframe_overlap)
+  exact
+    If True, the blocks lose their own LBP border, exactly as if the LBP operator was applied on each block separately (see block_layout)
+  """
+  stack = numpy.asarray(stack)
+  codes = lbp_codes(stack, lbptype, elbptype, radius, neighbors, circ)
+  _, bins = lbp_lut(lbptype, neighbors)
+  border = (stack.shape[-2] - codes.shape[-2]) // 2
+  layout = block_layout(stack.shape[-2:], numbl, overlap, border, exact)
+  return blockhist(codes, bins, layout)
+
+
+# block layouts, keyed by (shape, numbl, overlap, border, exact)
+_layouts = {}
+
+def _block_bounds(length, numbl, overlap):
+  """Returns the list of (start, end) bounds of the blocks along one dimension, as cut by divideframe (overlap=False) or divideframe_overlap (overlap=True)"""
+  if overlap:
+    ovl = 16 # hard-coded as in divideframe_overlap
+    bl = (length + (numbl-1)*ovl) // numbl
+    return [(i*bl - i*ovl, min((i+1)*bl - i*ovl, length)) for i in range(numbl)]
+  bl = length // numbl
+  start = (length - bl*numbl) // 2
+  return [(start + i*bl, start + (i+1)*bl) for i in range(numbl)]
+
+
+def block_layout(shape, numbl, overlap=False, border=0, exact=True):
+  """Returns the layout of the blocks over an LBP code image, as a tuple of three arrays: the flat indices of the code image pixels, the index of the block they belong to and the number of pixels in each block. With overlapping blocks, a pixel appears once for each block it belongs to
+
+  Keyword Parameters:
+
+  shape
+    The shape of the image the LBP code image is computed from
+  numbl
+    Square root of the number of blocks the frame is to be divided into (ex. 9 blocks => numbl = 3)
+  overlap
+    True for overlapping blocks (hardcoded to 16 pixels overlap, as in divideframe_overlap)
+  border
+    The number of pixels lost at each side of the image by the LBP operator
+  exact
+    If True, the blocks are cut from the image and each of them loses its own LBP border, exactly as when the LBP operator is applied on the result of divideframe or divideframe_overlap. If False, the LBP code image itself is divided into blocks
+  """
+  key = (tuple(shape), numbl, overlap, border, exact)
+  if key not in _layouts:
+    height, width = shape[0] - 2*border, shape[1] - 2*border # the size of the LBP code image
+    if exact:
+      rows = [(y0, y1 - 2*border) for (y0, y1) in _block_bounds(shape[0], numbl, overlap)]
+      cols = [(x0, x1 - 2*border) for (x0, x1) in _block_bounds(shape[1], numbl, overlap)]
+    else:
+      rows = _block_bounds(height, numbl, overlap)
+      cols = _block_bounds(width, numbl, overlap)
+    pixels = []; blocks = []; counts = []
+    for (y0, y1) in rows:
+      for (x0, x1) in cols:
+        if y1 <= y0 or x1 <= x0:
+          raise ValueError("the blocks of an image of size %s are too small for LBP with border %d" % (tuple(shape), border))
+        idx = (numpy.arange(y0, y1)[:, numpy.newaxis] * width + numpy.arange(x0, x1)[numpy.newaxis, :]).ravel()
+        pixels.append(idx)
+        blocks.append(numpy.repeat(len(counts), idx.size))
+        counts.append(idx.size)
+    _layouts[key] = (numpy.concatenate(pixels), numpy.concatenate(blocks).astype('int64'), numpy.array(counts, 'float64'))
+  return _layouts[key]
+
+
+def blockhist(codes, bins, layout):
+  """Calculates the concatenated normalized histograms of all the blocks of a stack of LBP code images, with a single bincount. Returns an (N, numbl*numbl*bins) float64 array
+
+  Keyword Parameters:
+
+  codes
+    3D array (N, h, w) of LBP code images, or a single 2D code image
+  bins
+    The number of labels of the LBP operator
+  layout
+    The layout of the blocks, as returned by block_layout
+  """
+  pixels, blocks, counts = layout
+  codes = numpy.asarray(codes)
+  if codes.ndim == 2:
+    codes = codes[numpy.newaxis]
+  numimg = codes.shape[0]
+  numblocks = counts.size
+  labels = codes.reshape(numimg, -1)[:, pixels].astype('int64')
+  labels += blocks * bins # a separate range of bins for each block...
+  labels += (numpy.arange(numimg, dtype='int64') * (numblocks * bins))[:, numpy.newaxis] # ... of each image
+  hist = numpy.bincount(labels.ravel(), minlength=numimg * numblocks * bins).reshape(numimg, numblocks, bins).astype('float64')
+  hist /= counts[numpy.newaxis, :, numpy.newaxis] # histogram normalization
+  return hist.reshape(numimg, numblocks * bins)
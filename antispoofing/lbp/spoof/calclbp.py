@@ -9,6 +9,60 @@ import numpy
 import math
 import bob.ip.base
 
+from .batchlbp import block_layout, blockhist
+
+# shared LBP operators, keyed by (lbptype, elbptype, radius, neighbors, circular)
+_lbp_operators = {}
+
+# reusable LBP code images, keyed by their shape
+_lbp_buffers = {}
+
+def lbp_operator(lbptype, elbptype='regular', rad=1, neighbors=8, circ=False):
+  """Returns a preconfigured bob LBP operator for the given parameters. The operators are constructed only once and shared between all the calls with the same parameters
+
+  Keyword Parameters:
+
+  lbptype
+    The type of the LBP operator (regular, uniform or riu2)
+  elbptype
+    The type of extended version of LBP (regular if not extended version is used, otherwise transitional, direction_coded or modified)
+  rad
+    The radius of the circle on which the points are taken (for circular LBP)
+  neighbors
+    The number of points around the central point on which LBP is computed (4, 8, 16)
+  circ
+    True if circular LBP is needed, False otherwise
+  """
+  key = (lbptype, elbptype, rad, neighbors, circ)
+  lbp = _lbp_operators.get(key)
+  if lbp is None:
+    elbps = {'regular':'regular', 'transitional':'transitional', 'direction_coded':'direction-coded', 'modified':'regular'}
+    mct = (elbptype == 'modified')
+    uniform = lbptype in ('uniform', 'riu2')
+    rotinv = (lbptype == 'riu2')
+    lbp = bob.ip.base.LBP(neighbors=neighbors, uniform=uniform, rotation_invariant=rotinv, radius=rad, circular=circ, to_average=mct, elbp_type=elbps[elbptype])
+    _lbp_operators[key] = lbp
+  return lbp
+
+
+def lbp_buffer(lbp, img):
+  """Returns an uint16 array with the shape of the LBP code image of the given operator on the given image. The array is shared between the calls with the same shape and will be overwritten by the next call
+
+  Keyword Parameters:
+
+  lbp
+    The bob LBP operator
+  img
+    The image in gray-scale
+  """
+  shape = tuple(lbp.lbp_shape(img))
+  lbpimage = _lbp_buffers.get(shape)
+  if lbpimage is None:
+    lbpimage = numpy.ndarray(shape, 'uint16')
+    _lbp_buffers[shape] = lbpimage
+  return lbpimage
+
+
 def lbphist(img, lbptype, elbptype='regular', rad=1, neighbors=8, circ=False):
   """Calculates a normalized LBP histogram over an image, using the bob LBP operator
 
@@ -27,30 +81,8 @@ def lbphist(img, lbptype, elbptype='regular', rad=1, neighbors=8, circ=False):
   circ
     True if circular LBP is needed, False otherwise
   """
-
-  elbps = {'regular':'regular', 'transitional':'trainsitional', 'direction_coded':'direction-coded', 'modified':'regular'}
-
-  if elbptype=='modified':
-    mct = True
-  else: mct = False
-
-  if lbptype == 'uniform':
-    if neighbors==16:
-      lbp = bob.ip.base.LBP(neighbors=16, uniform=True, circular=circ, radius=rad, to_average=mct, elbp_type=elbps[elbptype])
-    else: # we assume neighbors==8 in this case
-      lbp = bob.ip.base.LBP(neighbors=8, uniform=True, circular=circ, radius=rad, to_average=mct, elbp_type=elbps[elbptype])
-  elif lbptype == 'riu2':
-    if neighbors==16:
-      lbp = bob.ip.base.LBP(neighbors=16, uniform=True, rotation_invariant=True, radius=rad, circular=circ, to_average=mct, elbp_type=elbps[elbptype])
-    else: # we assume neighbors==8 in this case
-      lbp = bob.ip.base.LBP(neighbors=8, uniform=True, rotation_invariant=True, radius=rad, circular=circ, to_average=mct, elbp_type=elbps[elbptype])
-  else: # regular LBP
-    if neighbors==16:
-      lbp = bob.ip.base.LBP(neighbors=16, circular=circ, radius=rad, to_average=mct, elbp_type=elbps[elbptype])
-    else: # we assume neighbors==8 in this case
-      lbp = bob.ip.base.LBP(neighbors=16, circular=circ, radius=rad, to_average=mct, elbp_type=elbps[elbptype])
-
-  lbpimage = numpy.ndarray(lbp.lbp_shape(img), 'uint16') # allocating the image with lbp codes
+  lbp = lbp_operator(lbptype, elbptype, rad, neighbors, circ)
+  lbpimage = lbp_buffer(lbp, img) # the (shared) image with lbp codes
   lbp(img, lbpimage) # calculating the lbp image
   hist = bob.ip.base.histogram(lbpimage, (0, lbp.max_label-1), lbp.max_label)
   hist = hist / sum(hist) # histogram normalization
@@ -147,17 +179,41 @@ def lbphist_frame(frame, lbptype, elbptype='regular', radius=1, neighbors=8, cir
   if numbl == 1:
     finalhist, vf = lbphist(frame, lbptype, elbptype, radius, neighbors, circ)
   else:
-    finalhist = numpy.array([])
-    if overlap == False:
-      blockslist = divideframe(frame, numbl) # divide the frame into blocks
-    else:
-      blockslist = divideframe_overlap(frame, numbl) # divide the frame into overlapping blocks
-    for bl in blockslist: # calculate separate histogram for each frame subblock
-      hist, vf = lbphist(bl, lbptype, elbptype, radius, neighbors, circ)
-      finalhist = numpy.append(finalhist, hist) # concatenate the subblocks' already normalized histograms
+    lbp = lbp_operator(lbptype, elbptype, radius, neighbors, circ)
+    lbpimage = lbp_buffer(lbp, frame)
+    lbp(frame, lbpimage) # the lbp image is computed only once for all the blocks
+    border = (frame.shape[0] - lbpimage.shape[0]) // 2
+    layout = block_layout(frame.shape, numbl, overlap, border, exact=True) # the blocks as cut by divideframe or divideframe_overlap
+    finalhist = blockhist(lbpimage, lbp.max_label, layout)[0] # the concatenated normalized histograms of the blocks
+    vf = 1
   return finalhist, vf
 
 
+def facenorm(frame, bbx, sz, bbxsize_filter=0):
+  """Cuts the given bounding box (bbx) out of an image and rescales it to a predefined size. Returns the normalized face as an uint8 image and 1, or None and 0 if bbx is None or invalid
+
+  Keyword Parameters:
+
+  frame
+    The frame as a gray-scale image
+  bbx
+    the face bounding box
+  sz
+    The size of the rescaled face bounding box
+  bbxsize_filter
+    Considers as invalid all the bounding boxes with size smaller then this value
+  """
+  if bbx and bbx.is_valid() and bbx.height > bbxsize_filter:
+    cutframe = frame[bbx.y:(bbx.y+bbx.height),bbx.x:(bbx.x+bbx.width)] # cutting the box region
+    tempbbx = numpy.ndarray((sz, sz), 'float64')
+    bob.ip.base.scale(cutframe, tempbbx) # normalization
+    tempbbx_ = tempbbx + 0.5
+    tempbbx_ = numpy.floor(tempbbx_)
+    normbbx = numpy.cast['uint8'](tempbbx_)
+    return normbbx, 1
+  return None, 0
+
+
 def lbphist_facenorm(frame, lbptype, bbx, sz, elbptype='regular', radius=1, neighbors=8, circ=False, numbl=1, overlap=False, bbxsize_filter=0):
   """Calculates the normalized 3x3 LBP histogram over a given bounding box (bbx) in an image (around the detected face for example), using the bob LBP operator, after first rescaling bbx to a predefined size. If bbx is None or invalid, returns an empty histogram.
 
@@ -190,14 +246,8 @@ def lbphist_facenorm(frame, lbptype, bbx, sz, elbptype='regular', radius=1, neig
   if neighbors == 16:   lbphistlength = {'regular':65536, 'riu2':18, 'uniform':243}
   else:  lbphistlength = {'regular':256, 'riu2':10, 'uniform':59}
 
-  if bbx and bbx.is_valid() and bbx.height > bbxsize_filter:
-    cutframe = frame[bbx.y:(bbx.y+bbx.height),bbx.x:(bbx.x+bbx.width)] # cutting the box region
-    tempbbx = numpy.ndarray((sz, sz), 'float64')
-    normbbx = numpy.ndarray((sz, sz), 'uint8')
-    bob.ip.base.scale(cutframe, tempbbx) # normalization
-    tempbbx_ = tempbbx + 0.5
-    tempbbx_ = numpy.floor(tempbbx_)
-    normbbx = numpy.cast['uint8'](tempbbx_)
+  normbbx, vf = facenorm(frame, bbx, sz, bbxsize_filter)
+  if vf == 1:
     finalhist, vf = lbphist_frame(normbbx, lbptype, elbptype, radius, neighbors, circ, numbl, overlap)
     return finalhist, vf # the last argument is 1 if the frame was valid and 0 otherwise
   return  numpy.array(numbl * numbl * lbphistlength[lbptype] * [numpy.NaN]), 0 # return histogram with Nans if there is no valid bounding box (example: detected face in the frame)
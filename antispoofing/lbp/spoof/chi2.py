@@ -7,33 +7,108 @@
 
 import numpy
 
-def cmphistbinschimod(model, data):
-  """ Calculates the chi-square distribution scores of similarity of the data according to the model, but using the modified chi-square difference (for the formula of the Chi-2 difference see paper "Face Recognition for Local Binary Patterns" - Ahonen, Hadid, Pietikainen). The returned score for each sample in the data is the probablility that that sample comes from the model distribution. 
-   
+from ..helpers.chunked import CHUNK_BYTES
+
+# the minimum number of rows of a chunk of the data, so that the loop over the models is amortized over many samples even for long histograms
+MIN_CHUNK_ROWS = 256
+
+def chi2scores(model, data, dtype='float64', budget=CHUNK_BYTES):
+  """ Calculates the modified chi-square differences between each sample of the data and the model (see cmphistbinschimod). The samples are compared by chunks of rows, so that the memory needed is bounded whatever the size of the data.
+
+      Keyword parameters:
+
+      model
+        The model distribution (1D array)
+      data
+        2D array of histograms, one per row
+      dtype
+        The precision of the computation ('float32' or 'float64'). The differences of each sample are always summed in float64
+      budget
+        The size of a chunk of the data, in bytes
+
+      Returns:
+
+        1D float64 array with the score of each sample
+  """
+  return chi2bank(numpy.asarray(model).reshape(1, -1), data, dtype, budget)[:, 0]
+
+
+def cmphistbinschimod(model, data, dtype='float64'):
+  """ Calculates the chi-square distribution scores of similarity of the data according to the model, but using the modified chi-square difference (for the formula of the Chi-2 difference see paper "Face Recognition for Local Binary Patterns" - Ahonen, Hadid, Pietikainen). The returned score for each sample in the data is the probablility that that sample comes from the model distribution.
+
       Keyword parameters:
 
       model
         The model distribution
       data
         A tuple whose first element is a 2D array of the real access histogram data, and the second element is a 2D array of the attack histogram data
-   
+      dtype
+        The precision of the computation ('float32' or 'float64', see chi2scores)
+
       Returns:
-    
+
+        A tuple whose first element is a 2D column array of the scores of the real access data and the second a 2D column array of the scores of the attack data
+  """
+  scores_real = chi2scores(model, data[0], dtype).reshape(-1, 1)
+  scores_attack = chi2scores(model, data[1], dtype).reshape(-1, 1)
+  return (scores_real, scores_attack)
+
+
+def chi2bank(models, data, dtype='float64', budget=CHUNK_BYTES):
+  """ Calculates the modified chi-square differences between each sample of the data and each model of a bank of models (see cmphistbinschimod). The data is compared by chunks of rows (of at least MIN_CHUNK_ROWS rows), which are compared to all the models one after another, with no per-sample Python loop and no temporary arrays other than two of the size of a chunk.
+
+      Keyword parameters:
+
+      models
+        2D array (M, D) with one model distribution per row
+      data
+        2D array (N, D) of histograms, one per row
+      dtype
+        The precision of the computation ('float32' or 'float64'). The differences of each sample are always summed in float64
+      budget
+        The size of a chunk of the data, in bytes
+
+      Returns:
+
+        2D float64 array (N, M) with the score of each sample against each model
+  """
+  models = numpy.asarray(models, dtype)
+  scores = numpy.ndarray((data.shape[0], models.shape[0]), 'float64')
+  rows = max(MIN_CHUNK_ROWS, budget // max(1, numpy.dtype(dtype).itemsize * models.shape[1]))
+  for start in range(0, data.shape[0], rows):
+    chunk = numpy.asarray(data[start:start+rows], dtype)
+    tmp = numpy.empty_like(chunk)
+    den = numpy.empty_like(chunk)
+    for j in range(models.shape[0]):
+      numpy.subtract(chunk, models[j], tmp)
+      numpy.square(tmp, tmp)
+      numpy.add(chunk, models[j], den)
+      with numpy.errstate(divide='ignore', invalid='ignore'):
+        numpy.divide(tmp, den, tmp)
+      tmp[numpy.isnan(tmp)] = 0 # empty bins give 0/0, which counts as 0
+      scores[start:start+rows, j] = tmp.sum(axis=1, dtype='float64')
+  return scores
+
+
+def cmphistbankchimod(models, data, reduction='min', dtype='float64'):
+  """ Calculates the chi-square scores of the data according to a bank of models, reducing the scores against all the models into a single score per sample.
+
+      Keyword parameters:
+
+      models
+        2D array (M, D) with one model distribution per row
+      data
+        A tuple whose first element is a 2D array of the real access histogram data, and the second element is a 2D array of the attack histogram data
+      reduction
+        How the scores against the models are reduced: 'min' (the difference to the closest model) or 'mean'
+      dtype
+        The precision of the computation ('float32' or 'float64', see chi2bank)
+
+      Returns:
+
         A tuple whose first element is a 2D column array of the scores of the real access data and the second a 2D column array of the scores of the attack data
   """
-  data_real = data[0]
-  data_attack = data[1]
-  scores_real = numpy.ndarray((data_real.shape[0],1), 'float64') # initialize array for scores of the real data
-  scores_attack =  numpy.ndarray((data_attack.shape[0],1), 'float64') # initialize array for scores of the attack data
-
-  for k in range(0, data_real.shape[0]): # calc scores for the real data
-    tmp = numpy.square(data_real[k,:] - model)
-    s = sum(numpy.nan_to_num(tmp / (model + data_real[k,:])))
-    scores_real[k,0] = s
-
-  for k in range(0, data_attack.shape[0]): # calc scores for the attack data
-    tmp = numpy.square(data_attack[k,:] - model)
-    s = sum(numpy.nan_to_num(tmp / (model + data_attack[k,:])))
-    scores_attack[k,0] = s
-  
+  reduce = {'min': numpy.min, 'mean': numpy.mean}[reduction]
+  scores_real = reduce(chi2bank(models, data[0], dtype), axis=1).reshape(-1, 1)
+  scores_attack = reduce(chi2bank(models, data[1], dtype), axis=1).reshape(-1, 1)
   return (scores_real, scores_attack)
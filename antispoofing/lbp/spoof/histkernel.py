@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Support methods to classify histograms with an SVM on a precomputed histogram kernel: the exponential chi-square kernel exp(-gamma * chi2(x, y)) or the histogram intersection kernel sum(min(x, y))
+"""
+
+import numpy
+
+from .chi2 import chi2bank, CHUNK_BYTES, MIN_CHUNK_ROWS
+
+# the histogram kernels
+KERNELS = ('chi2', 'intersection')
+
+def intersectionbank(models, data, budget=CHUNK_BYTES):
+  """ Calculates the histogram intersection between each sample of the data and each model, by chunks of rows of the data (see chi2bank).
+
+      Keyword parameters:
+
+      models
+        2D array (M, D) with one histogram per row
+      data
+        2D array (N, D) of histograms, one per row
+      budget
+        The size of a chunk of the data, in bytes
+
+      Returns:
+
+        2D float64 array (N, M) with the intersection of each sample with each model
+  """
+  models = numpy.asarray(models, 'float64')
+  output = numpy.ndarray((data.shape[0], models.shape[0]), 'float64')
+  rows = max(MIN_CHUNK_ROWS, budget // max(1, 8 * models.shape[1]))
+  for start in range(0, data.shape[0], rows):
+    chunk = numpy.asarray(data[start:start+rows], 'float64')
+    tmp = numpy.empty_like(chunk)
+    for j in range(models.shape[0]):
+      numpy.minimum(chunk, models[j], tmp)
+      output[start:start+rows, j] = tmp.sum(axis=1)
+  return output
+
+
+def histbase(kind, vectors, data):
+  """ Calculates the part of a histogram kernel which does not depend on its parameters, between each sample of the data and each of the vectors: the chi-square distance for 'chi2' and the intersection itself for 'intersection'. Returns a 2D array with one row per sample
+  """
+  if kind == 'chi2':
+    return chi2bank(vectors, data)
+  return intersectionbank(vectors, data)
+
+
+def default_gamma(kind, base):
+  """ Returns the default parameter of a histogram kernel, given the base matrix of the training samples with themselves (see histbase): the inverse of the average chi-square distance between two different samples for 'chi2', and None for 'intersection', which has no parameter
+  """
+  if kind != 'chi2':
+    return None
+  n = base.shape[0]
+  total = sum(float(base[start:start+1024].sum()) for start in range(0, n, 1024))
+  return 1. / max(total / max(1, n * (n - 1)), 1e-12)
+
+
+def kernel_matrix(kind, base, gamma=None):
+  """ Calculates a histogram kernel from its base matrix (see histbase)"""
+  if kind == 'chi2':
+    return numpy.exp(-gamma * numpy.asarray(base))
+  return numpy.array(base, 'float64')
+
+
+def precomputed_inputs(kind, base, gamma=None):
+  """ Returns the inputs of the training samples of a precomputed histogram kernel to train an SVM with LIBSVM: the serial number of each sample (counting from 1) followed by its row of the kernel. The kernel is computed from the base matrix of the samples (see histbase) by blocks of rows, directly into the inputs. Its zeros are replaced by the smallest positive number, as LIBSVM drops the zero inputs, which would shift the columns of the kernel
+  """
+  n = base.shape[0]
+  inputs = numpy.ndarray((n, base.shape[1] + 1), 'float64')
+  inputs[:, 0] = numpy.arange(1, n + 1)
+  for start in range(0, n, 1024):
+    numpy.maximum(kernel_matrix(kind, base[start:start+1024], gamma), numpy.finfo('float64').tiny, inputs[start:start+1024, 1:])
+  return inputs
+
+
+def precomputed_predict(kind, gamma, vectors, coefs, rho, data):
+  """ Calculates the scores of the samples of the data (2D array) with an SVM trained on a precomputed histogram kernel, from the histograms of its support vectors (see svm.precomputed_model). Only the kernel with the support vectors is computed. Returns a 1D float64 array with the score of each sample
+  """
+  return numpy.dot(kernel_matrix(kind, histbase(kind, vectors, data), gamma), coefs) - rho
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Support methods to cut the face bounding boxes out of all the frames of a video and rescale them to a predefined size, so that the descriptors (LBP, multiscale LBP, HOG) can be computed on a stack of normalized faces
+"""
+
+import sys
+import numpy
+import bob.ip.base
+
+class FaceNormalizer(object):
+  """Cuts the face bounding boxes out of the frames of a video and rescales them to sz x sz pixels. The result is an (N, sz, sz) uint8 stack of normalized faces and a boolean mask of the valid frames. The buffers holding the results are reused for all the videos processed by the same normalizer (they only grow when a longer video comes), so the returned arrays are overwritten by the next call
+
+  Keyword Parameters:
+
+  sz
+    The size of the rescaled face bounding box
+  bbxsize_filter
+    Considers as invalid all the bounding boxes with size smaller then this value
+  """
+
+  def __init__(self, sz, bbxsize_filter=0):
+    self.sz = sz
+    self.bbxsize_filter = bbxsize_filter
+    self._scaled = numpy.ndarray((0, sz, sz), 'float64')
+    self._faces = numpy.ndarray((0, sz, sz), 'uint8')
+    self._valid = numpy.ndarray((0,), 'bool')
+
+  def _reserve(self, numframes):
+    """Makes sure the buffers can hold the given number of frames"""
+    if self._faces.shape[0] < numframes:
+      self._scaled = numpy.ndarray((numframes, self.sz, self.sz), 'float64')
+      self._faces = numpy.ndarray((numframes, self.sz, self.sz), 'uint8')
+      self._valid = numpy.ndarray((numframes,), 'bool')
+
+  def is_valid(self, bbx):
+    """Returns True if the bounding box is a valid face for normalization"""
+    return bool(bbx and bbx.is_valid() and bbx.height > self.bbxsize_filter)
+
+  def __call__(self, frames, locations, numframes):
+    """Normalizes the faces of all the frames. Returns the tuple (faces, valid) of views on the internal buffers: the (N, sz, sz) uint8 normalized faces (zeros for the invalid frames) and the boolean mask of the valid frames
+
+    Keyword Parameters:
+
+    frames
+      Iterable over the frames of the video as gray-scale images (a 3D array works as well)
+    locations
+      The face bounding boxes of the frames, indexed by the frame number
+    numframes
+      The number of frames announced for the video. N, the number of frames actually read, can be smaller. The frame counts of some codecs are off by one or two, so the frames beyond the announced ones are ignored, with a warning
+    """
+    self._reserve(numframes)
+    scaled = self._scaled[:numframes]
+    faces = self._faces[:numframes]
+    valid = self._valid[:numframes]
+    valid[:] = False
+    numread = 0
+    for k, frame in enumerate(frames):
+      if k >= numframes:
+        sys.stderr.write("The video has more frames than the %d announced, the extra frames are ignored\n" % numframes)
+        break
+      bbx = locations[k]
+      if self.is_valid(bbx):
+        cutframe = frame[bbx.y:(bbx.y+bbx.height),bbx.x:(bbx.x+bbx.width)] # cutting the box region
+        bob.ip.base.scale(cutframe, scaled[k]) # normalization
+        valid[k] = True
+      numread = k + 1
+    # the video may have less frames than announced
+    scaled = scaled[:numread]
+    faces = faces[:numread]
+    valid = valid[:numread]
+    # rounding of all the normalized faces at once
+    scaled[~valid] = 0.
+    numpy.add(scaled, 0.5, out=scaled)
+    numpy.floor(scaled, out=scaled)
+    faces[:] = scaled
+    return faces, valid
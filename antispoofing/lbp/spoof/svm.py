@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""Support methods to score data with an SVM machine
+"""
+
+import os
+import tempfile
+import numpy
+
+# the size of the chunks of data which are scored at once, in bytes. It is small, so that the chunks can be distributed over several processes, and fixed, so that the scores do not depend on the number of processes
+SVM_CHUNK_BYTES = 1 << 23
+
+def svm_predict(svm_machine, data):
+  """ Calculates the SVM scores of the samples of the data. All the samples are passed to the machine at once, so that they are scored in a single call instead of one call per sample. To bound the memory which the machine needs to convert them, give the data by chunks of rows (see helpers.chunked.apply_chunked).
+
+      Keyword parameters:
+
+      svm_machine
+        The SVM machine (bob.learn.libsvm.Machine)
+      data
+        2D array of samples, one per row
+
+      Returns:
+
+        1D float64 array with the score of each sample (the first score returned by the machine)
+  """
+  data = numpy.ascontiguousarray(data, 'float64')
+  if data.shape[0] == 0:
+    return numpy.zeros((0,), 'float64')
+  labels, scores = svm_machine.predict_class_and_scores(data)
+  return numpy.asarray(scores, 'float64')[:, 0]
+
+
+def _read_model(svm_machine):
+  """ Saves an SVM machine in the native format of LIBSVM and reads it back. Returns the tuple (header, rows): the dictionary of the lines of the header (name: list of values) and the list of the support vectors, each as the tuple (coefficients, features), where the features are the list of their sparse (index, value) pairs
+  """
+  fd, filename = tempfile.mkstemp(suffix='.svm')
+  os.close(fd)
+  try:
+    svm_machine.save(filename)
+    lines = open(filename).read().split('\n')
+  finally:
+    os.remove(filename)
+  start = lines.index('SV')
+  header = dict((line.split()[0], line.split()[1:]) for line in lines[:start] if line.strip())
+  rows = []
+  for line in lines[start + 1:]:
+    if not line.strip():
+      continue
+    items = line.split()
+    features = [item.split(':') for item in items if ':' in item]
+    rows.append(([float(item) for item in items if ':' not in item], [(int(index), float(value)) for (index, value) in features]))
+  return header, rows
+
+
+def support_vectors(svm_machine):
+  """ Returns the support vectors of an SVM machine, as a 2D array with one support vector per row. They are read from the machine saved in the native format of LIBSVM, and are in the space of the inputs after the normalization of the machine (input_subtract and input_divide).
+  """
+  header, rows = _read_model(svm_machine)
+  vectors = numpy.zeros((len(rows), svm_machine.input_size), 'float64')
+  for k, (coefs, features) in enumerate(rows):
+    for index, value in features: # the indices of the features count from 1
+      vectors[k, index - 1] = value
+  return vectors
+
+
+def precomputed_model(svm_machine):
+  """ Returns the tuple (samples, coefs, rho) of a two-class SVM machine trained on a precomputed kernel: the indices (counting from 0) of the training samples which are its support vectors, their coefficients and the bias. The score of a sample x is then sum(coefs * k(x, samples)) - rho, which is the score returned by the machine
+  """
+  header, rows = _read_model(svm_machine)
+  samples = numpy.array([int(features[0][1]) - 1 for (coefs, features) in rows], 'int64') # the feature 0 of each support vector is the serial number of its training sample, counting from 1
+  coefs = numpy.array([c[0] for (c, features) in rows], 'float64')
+  return samples, coefs, float(header['rho'][0])
+
+
+def rbf_kernel(data, vectors, gamma):
+  """ Calculates the RBF kernel exp(-gamma * ||x - y||^2) between each sample of the data (2D array) and each of the vectors (2D array). Returns a 2D array with one row per sample.
+  """
+  dist = numpy.dot(data, vectors.T)
+  dist *= -2
+  dist += (data ** 2).sum(axis=1).reshape(-1, 1)
+  dist += (vectors ** 2).sum(axis=1).reshape(1, -1)
+  numpy.maximum(dist, 0, dist)
+  dist *= -gamma
+  return numpy.exp(dist, dist)
+
+
+class FeatureMap(object):
+  """ An explicit feature map approximating the RBF kernel of an SVM machine: the dot product of the maps of two samples is approximately their kernel. A linear model on the map then approximates the SVM, and scores a batch of samples with a few matrix products, whatever the number of support vectors.
+
+      Keyword parameters:
+
+      method
+        'rff' (random Fourier features) or 'nystroem' (Nystroem approximation on a subset of the support vectors)
+      gamma
+        The parameter of the RBF kernel of the machine
+      subtract, divide
+        The normalization of the inputs of the machine
+      basis
+        The random frequencies (rff, 2D array with one column per dimension of the map) or the landmarks (nystroem, 2D array with one row per dimension of the map)
+      phase
+        The random phases of the dimensions of the map (rff only)
+      projection
+        The inverse square root of the kernel matrix of the landmarks (nystroem only)
+  """
+
+  def __init__(self, method, gamma, subtract, divide, basis, phase=None, projection=None):
+    self.method = method
+    self.gamma = float(gamma)
+    self.subtract = numpy.asarray(subtract, 'float64')
+    self.divide = numpy.asarray(divide, 'float64')
+    self.basis = numpy.asarray(basis, 'float64')
+    self.phase = phase
+    self.projection = projection
+
+  @classmethod
+  def random_fourier(cls, svm_machine, dim, seed=0):
+    """ Makes a map of random Fourier features of the given dimension for the kernel of the machine (Rahimi & Recht, 2007)"""
+    rng = numpy.random.RandomState(seed)
+    basis = rng.normal(0, numpy.sqrt(2 * svm_machine.gamma), (svm_machine.input_size, dim))
+    phase = rng.uniform(0, 2 * numpy.pi, (dim,))
+    return cls('rff', svm_machine.gamma, svm_machine.input_subtract, svm_machine.input_divide, basis, phase=phase)
+
+  @classmethod
+  def nystroem(cls, svm_machine, dim, seed=0):
+    """ Makes a Nystroem map of the kernel of the machine, with landmarks drawn at random among its support vectors (at most dim of them). The directions in which the kernel matrix of the landmarks is singular are dropped"""
+    vectors = support_vectors(svm_machine)
+    rng = numpy.random.RandomState(seed)
+    landmarks = vectors[numpy.sort(rng.permutation(len(vectors))[:dim])]
+    values, vecs = numpy.linalg.eigh(rbf_kernel(landmarks, landmarks, svm_machine.gamma))
+    keep = values > values.max() * 1e-10
+    projection = vecs[:, keep] / numpy.sqrt(values[keep])
+    return cls('nystroem', svm_machine.gamma, svm_machine.input_subtract, svm_machine.input_divide, landmarks, projection=projection)
+
+  @classmethod
+  def read(cls, hdf5):
+    """ Reads a map from an open bob HDF5 file"""
+    method = hdf5.read('method')
+    return cls(method, hdf5.read('gamma'), hdf5.read('subtract'), hdf5.read('divide'), hdf5.read('basis'),
+        phase=hdf5.read('phase') if method == 'rff' else None, projection=hdf5.read('projection') if method == 'nystroem' else None)
+
+  def save(self, hdf5):
+    """ Writes the map into an open bob HDF5 file"""
+    hdf5.set('method', self.method)
+    hdf5.set('gamma', self.gamma)
+    hdf5.set('subtract', self.subtract)
+    hdf5.set('divide', self.divide)
+    hdf5.set('basis', self.basis)
+    if self.phase is not None:
+      hdf5.set('phase', self.phase)
+    if self.projection is not None:
+      hdf5.set('projection', self.projection)
+
+  def __call__(self, data):
+    """ Maps the samples of the data (2D array, one sample per row)"""
+    data = (numpy.asarray(data, 'float64') - self.subtract) / self.divide
+    if self.method == 'rff':
+      output = numpy.dot(data, self.basis)
+      output += self.phase
+      numpy.cos(output, output)
+      output *= numpy.sqrt(2. / self.basis.shape[1])
+      return output
+    return numpy.dot(rbf_kernel(data, self.basis, self.gamma), self.projection)
+
+
+def distill(fmap, data, scores, ridge=1e-6, budget=SVM_CHUNK_BYTES):
+  """ Fits the linear model on a feature map which best reproduces the scores of an SVM machine, by ridge regression. The data is mapped by chunks of rows and only the second order statistics of the map are kept in the memory.
+
+      Keyword parameters:
+
+      fmap
+        The feature map (FeatureMap)
+      data
+        2D array of samples, one per row
+      scores
+        1D array with the score of the SVM machine for each sample (see svm_predict)
+      ridge
+        The regularization, relative to the average variance of the dimensions of the map
+      budget
+        The size of a chunk of the data, in bytes
+
+      Returns:
+
+        The tuple (weights, bias) of the linear model
+  """
+  rows = max(1, budget // max(1, 8 * data.shape[1]))
+  scores = numpy.asarray(scores, 'float64')
+  n = data.shape[0]
+  zz = None
+  for start in range(0, n, rows):
+    z = fmap(data[start:start+rows])
+    if zz is None:
+      zz = numpy.zeros((z.shape[1], z.shape[1]), 'float64'); zf = numpy.zeros((z.shape[1],), 'float64'); zsum = numpy.zeros((z.shape[1],), 'float64')
+    zz += numpy.dot(z.T, z)
+    zf += numpy.dot(z.T, scores[start:start+rows])
+    zsum += z.sum(axis=0)
+  zmean = zsum / n; fmean = scores.mean()
+  cov = zz / n - numpy.outer(zmean, zmean) # the statistics are centered, so that the bias is not regularized
+  cross = zf / n - zmean * fmean
+  cov[numpy.diag_indices_from(cov)] += ridge * max(numpy.trace(cov) / len(cov), 1e-12)
+  weights = numpy.linalg.solve(cov, cross)
+  return weights, fmean - numpy.dot(zmean, weights)
+
+
+def approx_predict(fmap, weights, bias, data):
+  """ Calculates the approximate SVM scores of the samples of the data (2D array) with a feature map and the linear model distilled on it (see distill). Returns a 1D float64 array with the score of each sample
+  """
+  return numpy.dot(fmap(data), weights) + bias
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""Tests the numpy LBP engine (see spoof/batchlbp.py): on images with hand-computed LBP codes and, if bob is installed, against the bob LBP operator on stacks of faces
+"""
+
+import os
+import imp
+import numpy
+import pytest
+
+# the numpy engine needs numpy only, so it is loaded without the spoof package, which imports the bob operators
+batchlbp = imp.load_source('batchlbp', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spoof', 'batchlbp.py'))
+
+try:
+  import bob.ip.base
+  have_bob = True
+except ImportError:
+  have_bob = False
+
+requires_bob = pytest.mark.skipif(not have_bob, reason='bob.ip.base is not installed')
+
+# the configurations of the LBP operator supported by the numpy engine: (neighbors, radius, circular)
+OPERATORS = [(8, 1, True), (8, 2, True), (16, 1, True), (16, 2, True), (4, 1, True), (8, 1, False), (8, 2, False), (4, 1, False)]
+
+# the label of the code with all the bits set (the last uniform pattern) in uniform LBP: P*(P-1)+2 uniform patterns, counting from 1
+UNIFORM_ALL_ONES = {4: 14, 8: 58, 16: 242}
+
+# the codes of a vertical gradient (brighter at the top): the points above the central point and the ones at its height set their bit
+GRADIENT_CODES = {
+    4: 0b1101, # top, right, bottom, left
+    8: 0b11110001, # top left, top, top right, right, bottom right, bottom, bottom left, left
+    16: 0b1111111000000011, # from the top left, clockwise
+    }
+
+def gradient(size):
+  """Returns an image whose values decrease linearly from the top to the bottom, which the bilinear interpolation samples exactly"""
+  return numpy.repeat(10. * numpy.arange(size, 0, -1)[:, numpy.newaxis], size, axis=1)
+
+
+@pytest.mark.parametrize('elbptype', ('regular', 'modified'))
+@pytest.mark.parametrize('neighbors,radius,circ', OPERATORS)
+def test_constant_codes(neighbors, radius, circ, elbptype):
+  stack = numpy.repeat(numpy.arange(256, dtype='uint8'), 49).reshape(256, 7, 7) # all the gray values
+  regular = batchlbp.lbp_codes(stack, 'regular', elbptype, radius, neighbors, circ)
+  assert (regular == (1 << neighbors) - 1).all()
+  uniform = batchlbp.lbp_codes(stack, 'uniform', elbptype, radius, neighbors, circ)
+  assert (uniform == UNIFORM_ALL_ONES[neighbors]).all()
+  riu2 = batchlbp.lbp_codes(stack, 'riu2', elbptype, radius, neighbors, circ)
+  assert (riu2 == neighbors + 1).all()
+
+
+@pytest.mark.parametrize('elbptype', ('regular', 'modified'))
+@pytest.mark.parametrize('neighbors,radius,circ', OPERATORS)
+def test_gradient_codes(neighbors, radius, circ, elbptype):
+  image = gradient(2 * radius + 3)
+  regular = batchlbp.lbp_codes(image, 'regular', elbptype, radius, neighbors, circ)
+  assert (regular == GRADIENT_CODES[neighbors]).all()
+  riu2 = batchlbp.lbp_codes(image, 'riu2', elbptype, radius, neighbors, circ)
+  assert (riu2 == bin(GRADIENT_CODES[neighbors]).count('1') + 1).all()
+
+
+@pytest.mark.parametrize('numbl,overlap', ((1, False), (3, False), (3, True)))
+def test_constant_histograms(numbl, overlap):
+  stack = numpy.full((2, 64, 64), 128, 'uint8')
+  hists = batchlbp.lbphist_batch(stack, 'uniform', radius=1, neighbors=8, numbl=numbl, overlap=overlap)
+  expected = numpy.zeros((numbl * numbl, 59)); expected[:, 58] = 1.
+  assert numpy.allclose(hists, expected.ravel())
+
+
+def random_faces(number=4, size=64, seed=0):
+  """Returns a stack of random gray-scale faces of the size of the normalized faces. The top of each face is flat, as the flat regions are where rounding errors change the codes"""
+  faces = numpy.random.RandomState(seed).randint(0, 256, (number, size, size)).astype('uint8')
+  faces[:, :size // 4] = numpy.arange(0, 256, 256 // number, dtype='uint8')[:number, numpy.newaxis, numpy.newaxis]
+  return faces
+
+
+def bob_blockhist(face, lbptype, elbptype, neighbors, radius, circ, numbl, overlap):
+  """Computes the concatenated histograms of the blocks of a face as the original lbphist_frame did: the face is cut into blocks and the bob LBP operator is applied on each of them"""
+  from .spoof import calclbp
+  if overlap:
+    blocks = calclbp.divideframe_overlap(face, numbl)
+  else:
+    blocks = calclbp.divideframe(face, numbl)
+  return numpy.concatenate([calclbp.lbphist(bl, lbptype, elbptype, radius, neighbors, circ)[0] for bl in blocks])
+
+
+# the configurations compared to the bob operator: (lbptype, elbptype, neighbors, radius, circular)
+CONFIGURATIONS = [(lbptype, 'regular') + operator for lbptype in ('regular', 'uniform', 'riu2') for operator in OPERATORS] + \
+    [(lbptype, 'modified') + operator for lbptype in ('regular', 'uniform') for operator in ((8, 1, True), (16, 2, True), (8, 1, False))]
+
+@requires_bob
+@pytest.mark.parametrize('lbptype,elbptype,neighbors,radius,circ', CONFIGURATIONS)
+def test_lbp_codes(lbptype, elbptype, neighbors, radius, circ):
+  from .spoof import calclbp
+  faces = random_faces()
+  codes = batchlbp.lbp_codes(faces, lbptype, elbptype, radius, neighbors, circ)
+  lbp = calclbp.lbp_operator(lbptype, elbptype, radius, neighbors, circ)
+  for face, code in zip(faces, codes):
+    assert numpy.array_equal(code, lbp(face))
+  assert batchlbp.lbp_lut(lbptype, neighbors)[1] == lbp.max_label
+
+
+@requires_bob
+@pytest.mark.parametrize('lbptype,elbptype,neighbors,radius,circ', CONFIGURATIONS)
+def test_lbphist_batch(lbptype, elbptype, neighbors, radius, circ):
+  from .spoof import calclbp
+  faces = random_faces()
+  hists = batchlbp.lbphist_batch(faces, lbptype, elbptype, radius, neighbors, circ)
+  for face, hist in zip(faces, hists):
+    assert numpy.allclose(hist, calclbp.lbphist(face, lbptype, elbptype, radius, neighbors, circ)[0])
+
+
+@requires_bob
+@pytest.mark.parametrize('overlap', (False, True))
+@pytest.mark.parametrize('lbptype,elbptype,neighbors,radius,circ', CONFIGURATIONS)
+def test_blockhist(lbptype, elbptype, neighbors, radius, circ, overlap):
+  from .spoof import calclbp
+  faces = random_faces()
+  hists = batchlbp.lbphist_batch(faces, lbptype, elbptype, radius, neighbors, circ, numbl=3, overlap=overlap)
+  for face, hist in zip(faces, hists):
+    expected = bob_blockhist(face, lbptype, elbptype, neighbors, radius, circ, 3, overlap)
+    assert numpy.allclose(hist, expected)
+    assert numpy.allclose(calclbp.lbphist_frame(face, lbptype, elbptype, radius, neighbors, circ, 3, overlap)[0], expected)
+
+
+# the default scales of calcframelbp_multiscale.py (the ones of the paper by Maatta, Hadid & Pietikainen): (radius, neighbors, blocks, overlap), all of them circular
+SCALES = [(2, 16, 1, False), (1, 8, 3, True), (2, 8, 1, False)]
+
+def test_multiscale_constant():
+  faces = numpy.full((2, 64, 64), 77, 'uint8')
+  for (radius, neighbors, blocks, overlap) in SCALES:
+    hists = batchlbp.lbphist_batch(faces, 'uniform', radius=radius, neighbors=neighbors, circ=True, numbl=blocks, overlap=overlap)
+    expected = numpy.zeros((blocks * blocks, UNIFORM_ALL_ONES[neighbors] + 1)); expected[:, -1] = 1.
+    assert numpy.allclose(hists, expected.ravel())
+
+
+@requires_bob
+@pytest.mark.parametrize('lbptype', ('regular', 'uniform', 'riu2'))
+def test_multiscale(lbptype):
+  from .spoof import calclbp
+  faces = random_faces()
+  numpy_hists = numpy.hstack([batchlbp.lbphist_batch(faces, lbptype, 'regular', radius=radius, neighbors=neighbors, circ=True, numbl=blocks, overlap=overlap) for (radius, neighbors, blocks, overlap) in SCALES])
+  for face, hist in zip(faces, numpy_hists):
+    expected = numpy.hstack([calclbp.lbphist_frame(face, lbptype, 'regular', radius=radius, neighbors=neighbors, numbl=blocks, circ=True, overlap=overlap)[0] for (radius, neighbors, blocks, overlap) in SCALES])
+    assert numpy.allclose(hist, expected)
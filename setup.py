@@ -64,6 +64,8 @@ setup(
         'ldatrain_lbp.py = antispoofing.lbp.script.ldatrain_lbp:main',
         'svmtrain_lbp.py = antispoofing.lbp.script.svmtrain_lbp:main',
         'svmeval_lbp.py = antispoofing.lbp.script.svmeval_lbp:main',
+        'checkshards.py = antispoofing.lbp.script.checkshards:main',
+        'mkfeaturestore.py = antispoofing.lbp.script.mkfeaturestore:main',
         #'check_rotated_videos.py = antispoofing.lbp.script.check_rotated_videos:main',
         ],
       },